@@ -0,0 +1,300 @@
+"""
+metrics.py
+~~~
+Live counters and histograms of a long scraping run (pages fetched, bytes downloaded, fetch latency per host, selenium
+and pdf durations, extraction failures, cache hit rates, rows written...). They are exposed in the Prometheus text
+format, either on a local http endpoint (see serve) or written to a file every few seconds (see write_periodically),
+so throughput can be watched and a slow issuer spotted while the run is still going.
+
+Metrics are always counted, recording one costs a lock and a dictionary update. Modules declare their metrics at
+import time with counter and histogram, and values computed elsewhere (ie. the term cache statistics) are added when
+the metrics are rendered with register_collector.
+
+Example:
+    pages_fetched = metrics.counter("scraper_pages_fetched_total", "Pages downloaded.", ["host"])
+    pages_fetched.inc(host="www.chase.com")
+    metrics.serve(9108)  # curl localhost:9108/metrics
+"""
+
+import bisect
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# The default histogram buckets in seconds, from a fast regex to a slow pdf
+default_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+class _Metric:
+    """
+    A metric with a time series per combination of label values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: List[str] = ()):
+        """
+        Args:
+            name (str): The metric name.
+            documentation (str): One line describing the metric.
+            labels (List[str]): The label names. (ie. ["host"])
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = list(labels)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, per combination of label values. Counter names end in _total by convention.
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Adds amount to the counter of the label values.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """
+        Returns the counter of the label values.
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, dict, float]]:
+        """
+        Returns the (name, labels, value) of every time series.
+        """
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """
+    Observations (ie. durations in seconds) counted in cumulative buckets, per combination of label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: List[str] = (), buckets: List[float] = None):
+        """
+        Args:
+            name (str): The metric name. (ie. "scraper_fetch_seconds")
+            documentation (str): One line describing the metric.
+            labels (List[str]): The label names.
+            buckets (List[float]): The upper bounds of the buckets. Defaults to default_buckets.
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = sorted(buckets or default_buckets)
+
+    def observe(self, value: float, **labels):
+        """
+        Records one observation.
+        """
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # the count of every bucket, then the +Inf bucket, then the sum
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def time(self, **labels) -> "_Timer":
+        """
+        Returns a context manager that observes the seconds spent in the enclosed block.
+        """
+        return _Timer(self, labels)
+
+    def samples(self) -> List[Tuple[str, dict, float]]:
+        """
+        Returns the (name, labels, value) of the buckets, sum and count of every time series.
+        """
+        with self._lock:
+            series_items = [(key, list(series)) for key, series in sorted(self._values.items())]
+
+        samples = []
+        for key, series in series_items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], series[:-1]):
+                cumulative += count
+                samples.append((self.name + "_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            samples.append((self.name + "_sum", labels, series[-1]))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+# Every declared metric by name, and the functions adding computed metrics at render time
+_metrics = dict()
+_collectors = []
+_lock = threading.Lock()
+
+
+def counter(name: str, documentation: str, labels: List[str] = ()) -> Counter:
+    """
+    Returns the counter with this name, declaring it the first time.
+    """
+    return _declare(Counter, name, documentation, labels)
+
+
+def histogram(name: str, documentation: str, labels: List[str] = (), buckets: List[float] = None) -> Histogram:
+    """
+    Returns the histogram with this name, declaring it the first time.
+    """
+    return _declare(Histogram, name, documentation, labels, buckets=buckets)
+
+
+def register_collector(collector: Callable[[], Iterable[Tuple[str, str, str, List[Tuple[str, dict, float]]]]]):
+    """
+    Registers a function returning metrics computed when they are rendered, as a list of
+    (name, kind, documentation, samples) where samples is a list of (sample name, labels, value).
+    """
+    with _lock:
+        _collectors.append(collector)
+
+
+def render() -> str:
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    with _lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+
+    families = [(metric.name, metric.kind, metric.documentation, metric.samples()) for metric in metrics]
+    for collector in collectors:
+        try:
+            families.extend(collector())
+        except Exception as e:
+            print("Error collecting metrics: {!r}".format(e))
+
+    lines = []
+    for name, kind, documentation, samples in families:
+        lines.append("# HELP {} {}".format(name, documentation))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for sample_name, labels, value in samples:
+            lines.append("{}{} {}".format(sample_name, _format_labels(labels), _format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+def serve(port: int, host: str = "127.0.0.1"):
+    """
+    Serves the metrics on http://host:port/metrics from a background thread, for Prometheus to scrape.
+
+    Args:
+        port (int): The port. 0 to pick a free port. (see server.server_port)
+        host (str): The interface to listen on. Local only by default.
+    Returns:
+        ThreadingHTTPServer: The server. Call shutdown() to stop it.
+    """
+    # only a run that serves its metrics needs the http server modules
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print("Serving metrics on http://{}:{}/metrics".format(host, server.server_port))
+    return server
+
+
+def write_file(path: str):
+    """
+    Writes the metrics to a file, replaced atomically so readers never see half a file. (ie. for the node exporter
+    textfile collector)
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as metrics_file:
+        metrics_file.write(render())
+    os.replace(temp_path, path)
+
+
+def write_periodically(path: str, interval: float = 15) -> Callable[[], None]:
+    """
+    Writes the metrics to a file every interval seconds from a background thread.
+
+    Args:
+        path (str): The path of the metrics file.
+        interval (float): The number of seconds between two writes.
+    Returns:
+        Callable[[], None]: Stops the thread, after writing the metrics one last time.
+    """
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            write_file(path)
+        write_file(path)
+
+    thread = threading.Thread(target=run, name="metrics-writer", daemon=True)
+    thread.start()
+
+    def stop():
+        stopped.set()
+        thread.join()
+    return stop
+
+
+def _declare(metric_class, name: str, documentation: str, labels: List[str], **kwargs):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = metric_class(name, documentation, labels, **kwargs)
+        elif not isinstance(metric, metric_class) or metric.labels != list(labels):
+            raise ValueError("Metric {} is already declared with other labels".format(name))
+        return metric
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = ('{}="{}"'.format(label, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+               for label, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
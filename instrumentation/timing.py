@@ -0,0 +1,384 @@
+"""
+timing.py
+~~~
+Lightweight timers around the stages of scraping, term processing and phrase generation. Each card gets a timing
+record holding the seconds spent in every stage (ie. "fetch.download", "parse.collect_info", "clean.second_clean",
+"write.csv"), and finished records are collected in run_timings, which reports percentiles over the whole run.
+
+Timing is off by default, and then every timer costs a single check. A card's record follows it across threads: the
+staged pipeline binds the record of a card to whichever worker is handling it. (see recording) Stage times are
+inclusive, so "parse.toc" also contains the "parse.collect_info" calls it made.
+
+With profile_slowest set, every card also runs under cProfile, and the profiles of the slowest cards are kept so they
+can be written out and opened with pstats or snakeviz. Only one thread profiles at a time (since python 3.12 a second
+active profiler raises), so in the staged pipeline a card's work is profiled only while no other card is being
+profiled, and the kept profiles are of the slowest cards that got the profiler.
+
+Records can be pickled, profiles included, so cards timed in worker processes (ie. phrase generation with several
+workers) are sent back and added to the run of the parent with finish_card.
+
+Example:
+    timing.configure(enabled=True, profile_slowest=5)
+    for row in rows:
+        with timing.card(row[0]):
+            scraped = run_scraper(*row)
+    print(timing.run_timings.report())
+    timing.run_timings.write_profiles("profiles")
+"""
+
+import cProfile
+import functools
+import heapq
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+# Whether the timers record anything. (see configure)
+ENABLED = False
+
+# The percentiles reported in the run summary
+percentiles = [50, 90, 99]
+
+
+class CardTiming:
+    """
+    The seconds spent in every stage while working on one card.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name (str): The name of the card.
+        """
+        self.name = name
+        self.stages = dict()
+        self.calls = dict()
+        self.total = 0.0
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        """
+        Adds the duration of one call of a stage.
+        """
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def as_dict(self) -> dict:
+        """
+        Returns the record as a json serializable dictionary.
+        """
+        return {"card": self.name, "total": self.total, "stages": self.stages, "calls": self.calls}
+
+    def __getstate__(self) -> dict:
+        # the lock can't be pickled, and profiles are sent as their stats
+        with self._lock:
+            state = dict(self.__dict__)
+        del state["_lock"]
+        state["profiles"] = [ProfileStats(profile) for profile in self.profiles]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class ProfileStats:
+    """
+    The stats of a finished cProfile profile, which unlike the profile can be pickled. Loads into pstats.Stats like
+    a profile does.
+    """
+
+    def __init__(self, profile):
+        """
+        Args:
+            profile: The cProfile.Profile, or another ProfileStats.
+        """
+        profile.create_stats()
+        self.stats = profile.stats
+
+    def create_stats(self):
+        """
+        Does nothing, the stats are already created. (called by pstats.Stats)
+        """
+
+
+class RunTimings:
+    """
+    The timing records of every card finished during a run.
+    """
+
+    def __init__(self, profile_slowest: int = 0):
+        """
+        Args:
+            profile_slowest (int): The number of slowest cards whose cProfile output is kept. 0 to not profile.
+        """
+        self.profile_slowest = profile_slowest
+        self.records = []
+        self._profiled = []  # heap of (total, sequence, record) of the slowest profiled cards
+        self._lock = threading.Lock()
+
+    def add(self, record: "CardTiming"):
+        """
+        Adds the record of a finished card. Only the profiles of the slowest cards are kept.
+        """
+        with self._lock:
+            self.records.append(record)
+            if not record.profiles:
+                return
+            heapq.heappush(self._profiled, (record.total, len(self.records), record))
+            if len(self._profiled) > self.profile_slowest:
+                heapq.heappop(self._profiled)[2].profiles = []
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Returns, for every stage and for the whole card ("card"), the number of cards, the total seconds, the mean,
+        the percentiles, and the maximum of the per card seconds.
+
+        Returns:
+            Dict[str, dict]: Mapping of stage to its statistics.
+        """
+        with self._lock:
+            records = list(self.records)
+
+        per_stage = {"card": [record.total for record in records]}
+        for record in records:
+            for stage, seconds in record.stages.items():
+                per_stage.setdefault(stage, []).append(seconds)
+
+        summary = dict()
+        for stage, values in per_stage.items():
+            values.sort()
+            statistics = {"cards": len(values), "total": sum(values),
+                          "mean": sum(values) / len(values) if values else 0.0, "max": values[-1] if values else 0.0}
+            for percent in percentiles:
+                statistics["p{}".format(percent)] = percentile(values, percent)
+            summary[stage] = statistics
+        return summary
+
+    def report(self) -> str:
+        """
+        Returns the summary as a table, in milliseconds, with the slowest stages first.
+        """
+        summary = self.summary()
+        columns = ["p{}".format(percent) for percent in percentiles] + ["max"]
+        lines = ["{:<28} {:>6} {:>10} {:>9} ".format("stage", "cards", "total s", "mean ms") +
+                 " ".join("{:>9}".format(column + " ms") for column in columns)]
+        for stage, statistics in sorted(summary.items(), key=lambda item: -item[1]["total"]):
+            lines.append("{:<28} {:>6} {:>10.2f} {:>9.1f} ".format(stage, statistics["cards"], statistics["total"],
+                                                                   1000 * statistics["mean"]) +
+                         " ".join("{:>9.1f}".format(1000 * statistics[column]) for column in columns))
+        for record in self.slowest(3):
+            lines.append("slow card: {} {:.2f} s".format(record.name, record.total))
+        return "\n".join(lines)
+
+    def slowest(self, count: int) -> List["CardTiming"]:
+        """
+        Returns the records of the slowest cards, slowest first.
+        """
+        with self._lock:
+            return heapq.nlargest(count, self.records, key=lambda record: record.total)
+
+    def write_records(self, path: str):
+        """
+        Writes the record of every card as one line of json.
+
+        Args:
+            path (str): The path of the json lines file.
+        """
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w") as records_file:
+            for record in records:
+                records_file.write(json.dumps(record.as_dict()) + "\n")
+
+    def write_profiles(self, directory: str) -> List[str]:
+        """
+        Writes the cProfile output of the slowest profiled cards, one .prof file per card. (see pstats.Stats)
+
+        Args:
+            directory (str): The folder the files are written to. Created if needed.
+        Returns:
+            List[str]: The paths of the files, slowest card first.
+        """
+        with self._lock:
+            profiled = sorted(self._profiled, reverse=True)
+
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for rank, (total, _, record) in enumerate(profiled, start=1):
+            # the profile of every thread that worked on the card is merged into one
+            stats = pstats.Stats(record.profiles[0])
+            for profile in record.profiles[1:]:
+                stats.add(profile)
+            file_name = "{:02d}_{}.prof".format(rank, re.sub(r"[^A-Za-z0-9]+", "_", record.name).strip("_"))
+            path = os.path.join(directory, file_name)
+            stats.dump_stats(path)
+            paths.append(path)
+        return paths
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """
+    Returns the nearest rank percentile of sorted values. (0.0 if there are none)
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(int(-(-percent * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+
+# The records of the current run
+run_timings = RunTimings()
+
+# The record bound to the current thread (see recording)
+_local = threading.local()
+
+# Held by the thread that is profiling, one at a time (see recording)
+_profiler_lock = threading.Lock()
+
+
+def configure(enabled: bool = True, profile_slowest: int = 0):
+    """
+    Turns timing on or off and starts a new run.
+
+    Args:
+        enabled (bool): Whether the timers record anything.
+        profile_slowest (int): The number of slowest cards whose cProfile output is kept. 0 to not profile.
+    """
+    global ENABLED, run_timings
+    ENABLED = enabled
+    run_timings = RunTimings(profile_slowest)
+
+
+def current() -> CardTiming:
+    """
+    Returns the record of the card the current thread is working on, or None.
+    """
+    return getattr(_local, "record", None)
+
+
+def start_card(name: str) -> CardTiming:
+    """
+    Returns a new record for a card, or None when timing is off. Bind it with recording, and hand it to finish_card
+    once the card is done.
+    """
+    if not ENABLED:
+        return None
+    return CardTiming(name)
+
+
+def finish_card(record: CardTiming):
+    """
+    Adds the record of a finished card to the run.
+    """
+    if record is not None:
+        run_timings.add(record)
+
+
+@contextmanager
+def recording(record: CardTiming):
+    """
+    Binds a card's record to the current thread while the enclosed work runs, so the timers add to it. The time
+    spent is added to the card's total, and profiled when profiling is on.
+
+    Args:
+        record (CardTiming): The record, from start_card. None does nothing.
+    """
+    if record is None or current() is record:
+        yield record
+        return
+
+    previous = current()
+    _local.record = record
+    profiler = None
+    if run_timings.profile_slowest and _profiler_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiling tool (ie. python -m cProfile) is already active
+            profiler = None
+            _profiler_lock.release()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            _profiler_lock.release()
+            record.profiles.append(profiler)
+        with record._lock:
+            record.total += elapsed
+        _local.record = previous
+
+
+@contextmanager
+def card(name: str):
+    """
+    Times the enclosed work as one card, and adds the record to the run when it is done. Inside the work of another
+    card (ie. run_scraper called by mass_scrape), the work counts towards that card instead.
+
+    Args:
+        name (str): The name of the card.
+    """
+    if not ENABLED or current() is not None:
+        yield current()
+        return
+
+    record = CardTiming(name.strip())
+    with recording(record):
+        yield record
+    finish_card(record)
+
+
+@contextmanager
+def timer(stage: str):
+    """
+    Adds the time spent in the enclosed block to a stage of the current card.
+
+    Args:
+        stage (str): The name of the stage. (ie. "write.csv")
+    """
+    record = current() if ENABLED else None
+    if record is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.add(stage, time.perf_counter() - start)
+
+
+def timed(stage: str) -> Callable:
+    """
+    Decorator that adds the time spent in every call of the function to a stage of the current card.
+
+    Args:
+        stage (str): The name of the stage. (ie. "parse.collect_info")
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            record = current() if ENABLED else None
+            if record is None:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record.add(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
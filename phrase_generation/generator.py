@@ -6,28 +6,34 @@ category and company templates.
 """
 
 import re
-import copy
 import json
 import os
-import boto3
+import hashlib
+from instrumentation.timing import timed
+from phrase_generation.image_index import ImageIndex
+from phrase_generation.templates import compile_voices
 
 current_directory = os.path.dirname(os.path.realpath(__file__))
+template_hash = hashlib.sha256()
+
 f = os.path.join(current_directory, "category_template.json")
 with open(f, "r") as rt:
-    category_template = json.load(rt)
+    template_text = rt.read()
+    template_hash.update(template_text.encode("utf-8"))
+    category_template = json.loads(template_text)
 
 f = os.path.join(current_directory, "company_template.json")
 with open(f, "r") as rt:
-    company_template = json.load(rt)
+    template_text = rt.read()
+    template_hash.update(template_text.encode("utf-8"))
+    company_template = json.loads(template_text)
 
-# gather images from S3
-s3 = boto3.client('s3')
-s3_response = s3.list_objects(Bucket='static.starbutter.com')
+# Version of the templates, changes whenever either template file is edited. Used to regenerate every card's phrases
+# after a template change.
+template_version = template_hash.hexdigest()
 
-base_url = "https://s3-us-west-2.amazonaws.com/static.starbutter.com/images/card/"
-s3_images = []
-for k in s3_response['Contents']:
-    s3_images.append(k['Key'].replace("images/card/", ""))
+# card images in S3, listed the first time an image is needed. The listing is cached on disk for a day.
+image_index = ImageIndex(snapshot_path=os.path.join(current_directory, "s3_image_index.json"))
 
 # Attributes whose values might contain a "None"
 supported_none_case_attributes = [
@@ -107,6 +113,58 @@ category_rank = [
 ]
 
 
+def __compile_category_template(template: dict) -> dict:
+    """
+    Compiles the voice templates of every intent in the category template, and works out once which card attribute
+    fills each placeholder. {full_card_name} is the card name, {company_name} is the issuer, and every other
+    placeholder is the value of the intent.
+
+    Args:
+        template (dict): The category template.
+    Returns:
+        dict: Mapping of intent to its compiled voices, the card attribute of each voice's slots, chips, and followup
+              question.
+    """
+    compiled = dict()
+    for intent, templates in template.items():
+        if intent in value_keys:
+            value_key = intent + "_value"
+        elif intent in short_keys:
+            value_key = intent + "_short"
+        else:
+            value_key = intent
+
+        slot_sources = {"full_card_name": "name", "company_name": "issuer"}
+        voices = compile_voices(templates["voice"])
+        compiled[intent] = {
+            "value_key": value_key,
+            "voices": voices,
+            "voice_keys": [[slot_sources.get(slot, value_key) for slot in voice.slots] for voice in voices],
+            "chips": templates.get("chips"),
+            "followup_question": templates["followup_question"],
+        }
+    return compiled
+
+
+def __compile_company_template(template: dict) -> dict:
+    """
+    Compiles the voice templates of every intent in the company template.
+
+    Args:
+        template (dict): The company template.
+    Returns:
+        dict: Mapping of intent to its compiled voices.
+    """
+    return {intent: compile_voices(templates["voice"] if type(templates) == dict else templates)
+            for intent, templates in template.items()}
+
+
+# the templates compiled once at load time, used by generate_responses
+compiled_category_template = __compile_category_template(category_template)
+compiled_company_template = __compile_company_template(company_template)
+
+
+@timed("generate.phrases")
 def generate_responses(full_card_name: str, card_scraped_info: dict, card_score_info: dict,
                        individual_card_info: dict) -> dict:
     """
@@ -125,23 +183,17 @@ def generate_responses(full_card_name: str, card_scraped_info: dict, card_score_
         dict: A dictionary of all of the responses for the card.
     """
     output_dict = dict()
-    copy_template = copy.deepcopy(category_template)
 
     print("Generating responses for " + full_card_name)
 
     # (1) Write values from response template
-    for intent, templates in copy_template.items():
+    for intent, templates in compiled_category_template.items():
         # a. gets the scraped info for a specific card and attribute
         issuer_choice = False
         if intent == 'score_response':
             continue
         try:
-            if intent in value_keys:
-                value = card_scraped_info[intent + "_value"].strip()
-            elif intent in short_keys:
-                value = card_scraped_info[intent + "_short"].strip()
-            else:
-                value = card_scraped_info[intent].strip()
+            value = card_scraped_info[templates["value_key"]].strip()
         except KeyError:
             print("Error trying to get the intent {} from card_scraped_info, defaulting to empty string".format(intent))
             value = str()
@@ -150,26 +202,26 @@ def generate_responses(full_card_name: str, card_scraped_info: dict, card_score_
         if value == "-1" or value == "None":
             # if the terms and conditions does not disclose an attribute, we direct the user to issuer website
             issuer_choice = True
-            voice_template_to_use = templates['voice'][1]
+            voice_index = 1
 
         elif value == str() or value.isspace():
             print("Error! {} has a empty string for the attribute {}".format(full_card_name, intent))
             return
 
         elif intent in supported_none_case_attributes and (value.lower() == "$0" or value.lower() == "0%"):
-            voice_template_to_use = templates['voice'][2]
+            voice_index = 2
 
         else:
-            voice_template_to_use = templates['voice'][0]
+            voice_index = 0
 
-        # c. configures the text response using the voice template and scraped values
-        text = __configure_response_for_intent(intent, card_scraped_info, voice_template_to_use, full_card_name)
+        # c. configures the text response using the compiled voice template and scraped values
+        text = templates["voices"][voice_index].render_from(card_scraped_info, templates["voice_keys"][voice_index])
 
         # d. store the display text in output dictionary
         output_dict[intent] = text
 
-        # e. get the chips for the intent
-        chips = templates.get("chips")
+        # e. get the chips for the intent (copied, the compiled template is shared between cards)
+        chips = list(templates["chips"])
 
         # f. add "see issuer site" chip if issuer does not disclose an attribute
         if issuer_choice:
@@ -190,14 +242,8 @@ def generate_responses(full_card_name: str, card_scraped_info: dict, card_score_
     output_dict["our_take"] = our_take_speech
 
     # (3) Store the image url and the facebook horizontal image url
-    image_url = "https://s3-us-west-2.amazonaws.com/static.starbutter.com/images/card/generic+card.jpeg"
-    fb_horiz_url = "https://s3-us-west-2.amazonaws.com/static.starbutter.com/images/card/generic+card.jpeg"
     print("Getting images for this card " + full_card_name)
-    for k in s3_images:
-        if full_card_name.lower().replace("/", "") == k.lower().replace(".jpg", ""):
-            image_url = base_url + k.replace(" ", "+")
-            fb_horiz_url = base_url + "facebook_horiz/" + k.replace(" ", "+")
-            break
+    image_url, fb_horiz_url = image_index.resolve(full_card_name)
     output_dict["image_link"] = image_url
     output_dict["fb_horizontal_link"] = fb_horiz_url
 
@@ -210,20 +256,20 @@ def generate_responses(full_card_name: str, card_scraped_info: dict, card_score_
     output_dict['score'] = final_score
 
     # (5) Write score response
+    score_voices = compiled_category_template['score_response']['voices']
     if final_score != "Unknown":
-        score_response = category_template['score_response']['voice'][0].replace("{full_card_name}", full_card_name)\
-            .replace("{score}", str(final_score))
+        score_response = score_voices[0].render({"full_card_name": full_card_name, "score": str(final_score)})
     else:
-        score_response = category_template['score_response']['voice'][1].replace("{full_card_name}", full_card_name)
+        score_response = score_voices[1].render({"full_card_name": full_card_name})
     output_dict['score_response'] = score_response
-    output_dict['score_response_chips'] = category_template['score_response']["chips"]
-    output_dict['score_response_followup_question'] = category_template['score_response']["followup_question"]
+    output_dict['score_response_chips'] = list(compiled_category_template['score_response']["chips"])
+    output_dict['score_response_followup_question'] = \
+        compiled_category_template['score_response']["followup_question"]
 
     # (6) Writes the issuer phrase to the output dictionary
     company = card_score_info["issuer"]
-    issuer_phrase = company_template["name"][0]
-    output_dict["issuer_phrase"] = issuer_phrase.replace("{company_name}", company)\
-        .replace("{full_card_name}", full_card_name)
+    output_dict["issuer_phrase"] = compiled_company_template["name"][0].render({"company_name": company,
+                                                                                "full_card_name": full_card_name})
 
     # (7) Write values from company response template
     for intent, templates in company_template.items():
@@ -246,9 +292,9 @@ def generate_responses(full_card_name: str, card_scraped_info: dict, card_score_
                     score_5 = 4
             except KeyError:
                 score = 2  # score is average if company score doesn't exist
-            text = templates['voice'][score_5].replace("{company_name}", full_card_name)
+            text = compiled_company_template[intent][score_5].render({"company_name": full_card_name})
             follow_up_q = templates["followup_question"]
-            chips = templates["chips"][score_5]
+            chips = list(templates["chips"][score_5])
             output_dict[intent] = text
             output_dict[intent + "_chips"] = chips
             output_dict[intent + "_followup_question"] = follow_up_q
@@ -274,46 +320,6 @@ def generate_responses(full_card_name: str, card_scraped_info: dict, card_score_
     return output_dict
 
 
-def __configure_response_for_intent(intent: str, scraped_info: dict, template_string: str, full_card_name: str) -> str:
-    """
-    Given a template string, configures the response using the scraped info.
-
-    Args:
-        intent (str): The name of the intent. (ie. balance_transfer_apr)
-        scraped_info (dict): The dictionary of card data.
-        template_string (str): The template string with the {} for placeholder values.
-        full_card_name (str): The full card name
-    Returns:
-        str: The configured response.
-
-    """
-    voice_answer = template_string
-
-    # 1. Find all variables needed for this template
-    variables = __process_regex(template_string)
-
-    # 2. Figure out what the variables are
-    variable_dict = {"full_card_name": scraped_info["name"]}
-    for var in variables:
-        if var == "company_name":
-            company_name = scraped_info["issuer"]
-            variable_dict[var] = company_name
-        elif var != "full_card_name":
-            if intent in value_keys:
-                variable_dict[var] = scraped_info[intent + "_value"]
-            elif intent in short_keys:
-                variable_dict[var] = scraped_info[intent + "_short"]
-            else:
-                variable_dict[var] = scraped_info[intent]
-
-    # 3. Replace the variables with actual values
-    for var_key, var_found in variable_dict.items():
-        update_regex = r"\{" + var_key + r"\}"
-        voice_answer = re.sub(update_regex, var_found, voice_answer)
-
-    return voice_answer
-
-
 def __get_similar_cards(similar_card_string: str) -> list:
     """
     Returns a list of similar cards given the similar card string.
@@ -333,26 +339,3 @@ def __get_similar_cards(similar_card_string: str) -> list:
         cards.append(substring)
         i += 2
     return [c for c in cards if c != 'S']
-
-
-def __process_regex(text: str) -> list:
-    """
-    Given a template string with {} placeholders, use regex to search for all variables in the {} placeholders
-    and returns them in a list.
-
-    Args:
-        text (str): The template string.
-    Returns:
-        list: A list of all variables contained within the {} placeholders.
-    """
-    answer = list()
-    regex = r"\{(.*?)\}"
-    matches = re.finditer(regex, text)
-    for match in matches:
-        answer.append(match.group(1))
-    return answer
-
-
-
-
-
@@ -0,0 +1,154 @@
+"""
+image_index.py
+~~~~~~~~~~~~~~~~~~~~~
+Index of the card images stored in S3, keyed by normalized card name. The index is only built the first time an
+image is resolved, so importing the generator doesn't need network access or credentials. Listing the bucket follows
+pagination, and the listing can be cached in a json snapshot on disk that is reused until it is older than its TTL.
+"""
+
+import json
+import os
+import time
+
+base_url = "https://s3-us-west-2.amazonaws.com/static.starbutter.com/images/card/"
+generic_image_url = base_url + "generic+card.jpeg"
+
+
+def normalize_card_name(full_card_name: str) -> str:
+    """
+    Normalizes a card name the same way image file names are normalized, so the two can be compared.
+
+    Args:
+        full_card_name (str): The full card name.
+    Returns:
+        str: The normalized card name.
+    """
+    return full_card_name.lower().replace("/", "")
+
+
+def normalize_image_name(image_name: str) -> str:
+    """
+    Normalizes an image file name. ("Blue Cash Everyday Card.jpg" -> "blue cash everyday card")
+
+    Args:
+        image_name (str): The file name of the image, relative to the images/card/ folder.
+    Returns:
+        str: The normalized image name.
+    """
+    return image_name.lower().replace(".jpg", "")
+
+
+class ImageIndex:
+    """
+    Lazily built mapping of normalized card name to the image file name in S3.
+    """
+
+    def __init__(self, bucket: str = "static.starbutter.com", prefix: str = "images/card/", snapshot_path: str = None,
+                 ttl: float = 24 * 60 * 60, client=None, images: dict = None):
+        """
+        Args:
+            bucket (str): The S3 bucket containing the images.
+            prefix (str): The folder of the card images in the bucket.
+            snapshot_path (str): The path of the json snapshot of the listing. None to always list the bucket.
+            ttl (float): The number of seconds a snapshot stays valid.
+            client: The boto3 S3 client. Created on first use if not given.
+            images (dict): An already built index (see images()), ie. handed to a worker process. None to build it
+                           on first use.
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self.client = client
+        self._images = images
+
+    def resolve(self, full_card_name: str) -> (str, str):
+        """
+        Returns the image url and the facebook horizontal image url of a card. Defaults to the generic card image.
+
+        Args:
+            full_card_name (str): The full card name.
+        Returns:
+            (str, str): The image url and the facebook horizontal image url.
+        """
+        image_name = self.images().get(normalize_card_name(full_card_name))
+        if image_name is None:
+            return generic_image_url, generic_image_url
+
+        image_name = image_name.replace(" ", "+")
+        return base_url + image_name, base_url + "facebook_horiz/" + image_name
+
+    def images(self) -> dict:
+        """
+        Returns the index, building it on first use.
+
+        Returns:
+            dict: Mapping of normalized image name to image file name.
+        """
+        if self._images is None:
+            image_names = self.__load_snapshot()
+            if image_names is None:
+                image_names = self.__list_image_names()
+                self.__save_snapshot(image_names)
+
+            images = dict()
+            for image_name in image_names:
+                # the first image in listing order wins, like the original linear search
+                images.setdefault(normalize_image_name(image_name), image_name)
+            self._images = images
+
+        return self._images
+
+    def invalidate(self):
+        """
+        Drops the index and the snapshot, so the next lookup lists the bucket again.
+        """
+        self._images = None
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            os.remove(self.snapshot_path)
+
+    def __list_image_names(self) -> list:
+        """
+        Lists every image in the prefix folder, following pagination.
+
+        Returns:
+            list: The image file names, relative to the prefix folder.
+        """
+        if self.client is None:
+            import boto3
+            self.client = boto3.client("s3")
+
+        print("Listing card images in S3.")
+        image_names = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for s3_object in page.get("Contents", []):
+                image_names.append(s3_object["Key"].replace(self.prefix, ""))
+        return image_names
+
+    def __load_snapshot(self):
+        """
+        Returns the image names saved in the snapshot, or None if there is no valid snapshot.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        if time.time() - os.path.getmtime(self.snapshot_path) > self.ttl:
+            return None
+
+        with open(self.snapshot_path, "r") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        if snapshot.get("bucket") != self.bucket or snapshot.get("prefix") != self.prefix:
+            return None
+        return snapshot["image_names"]
+
+    def __save_snapshot(self, image_names: list):
+        """
+        Saves the image names to the snapshot, if a snapshot path is set.
+        """
+        if not self.snapshot_path:
+            return
+
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "w") as snapshot_file:
+            json.dump({"bucket": self.bucket, "prefix": self.prefix, "image_names": image_names}, snapshot_file)
+        os.replace(temp_path, self.snapshot_path)
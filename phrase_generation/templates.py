@@ -0,0 +1,86 @@
+"""
+templates.py
+~~~~~~~~~~~~~~~~~~~~~
+Compiles the response template strings in category_template.json and company_template.json once, at load time. Each
+template string with {placeholders} becomes a format string with known slots, so rendering a response is a single
+str.format call instead of extracting the placeholders with a regex and substituting them one by one.
+"""
+
+import re
+from typing import List
+
+placeholder_regex = re.compile(r"\{(.*?)\}")
+
+
+class CompiledTemplate:
+    """
+    A template string compiled into a positional format string. ("The {full_card_name} has..." -> "The {0} has...")
+    """
+
+    def __init__(self, template: str):
+        """
+        Args:
+            template (str): The template string with {} placeholders.
+        """
+        self.template = template
+        self.slots = []  # unique placeholder names, in order of first appearance
+
+        parts = []
+        last_index = 0
+        for match in placeholder_regex.finditer(template):
+            slot = match.group(1)
+            if slot not in self.slots:
+                self.slots.append(slot)
+            parts.append(escape_braces(template[last_index:match.start()]))
+            parts.append("{" + str(self.slots.index(slot)) + "}")
+            last_index = match.end()
+        parts.append(escape_braces(template[last_index:]))
+
+        self.format_string = "".join(parts)
+
+    def render(self, values: dict) -> str:
+        """
+        Fills in the placeholders with values. Placeholders without a value are left as they are.
+
+        Args:
+            values (dict): Mapping of placeholder name to value.
+        Returns:
+            str: The rendered string.
+        """
+        return self.format_string.format(*[values.get(slot, "{" + slot + "}") for slot in self.slots])
+
+    def render_from(self, source: dict, keys: List[str]) -> str:
+        """
+        Fills in the placeholders with source[key], where keys gives the key of each slot in order.
+
+        Args:
+            source (dict): The dictionary holding the values. (ie. the card data)
+            keys (List[str]): The key in source of every slot, in the order of self.slots.
+        Returns:
+            str: The rendered string.
+        """
+        return self.format_string.format(*[source[key] for key in keys])
+
+
+def compile_voices(voices: List[str]) -> List[CompiledTemplate]:
+    """
+    Compiles a list of voice template strings.
+
+    Args:
+        voices (List[str]): The template strings.
+    Returns:
+        List[CompiledTemplate]: The compiled templates.
+    """
+    return [CompiledTemplate(voice) for voice in voices]
+
+
+def escape_braces(text: str) -> str:
+    """
+    Escapes literal braces so they survive str.format.
+
+    Args:
+        text (str): The literal text.
+    Returns:
+        str: The escaped text.
+    """
+    return text.replace("{", "{{").replace("}", "}}")
@@ -6,9 +6,15 @@ describing a credit card.
 """
 
 import copy
+from instrumentation import metrics
+from instrumentation.timing import timed
+from scrape_to_dict.deadline import Deadline
 from scrape_to_dict.get_visible_text import scrape_visual_text_directly
 import re
 
+extraction_failures = metrics.counter("scraper_extraction_failures_total", "Pages whose visible text could not be "
+                                      "split into attributes, by scraper (toc, agg).", ["scraper"])
+
 # All attribute headers have a _ appended to the front of it to mark it as a header
 agg_attribute_mapping_dict = {
     "pros": ["_Pros", "_ Pros"],
@@ -34,13 +40,40 @@ def scrape_from_agg(agg_url: str, card_dict_param: dict) -> dict:
     Returns:
         dict: The dictionary containing scraped data from both the TOC and Nerdwallet.
     """
-    card_dict = copy.deepcopy(card_dict_param)
-    card_name = card_dict["full_card_name"]
-    print("scraping from agg for " + card_name)
+    print("scraping from agg for " + card_dict_param["full_card_name"])
     print(agg_url)
 
     # (1) Get all visible text on the webpage (via script using beautiful soup).
-    block = scrape_visual_text_directly(agg_url, add_new_lines=True)
+    block = fetch_agg_text(agg_url)
+    return parse_agg_text(block, card_dict_param)
+
+
+def fetch_agg_text(agg_url: str, deadline: Deadline = None) -> str:
+    """
+    Gets all of the visible text on the aggregator page, with the dummy strings that mark new lines.
+
+    Args:
+        agg_url (str): The url of the agg link we scrape from.
+        deadline (Deadline): The time budget of the fetch.
+    Returns:
+        str: The visible text.
+    """
+    return scrape_visual_text_directly(agg_url, add_new_lines=True, deadline=deadline)
+
+
+@timed("parse.agg")
+def parse_agg_text(block: str, card_dict_param: dict) -> dict:
+    """
+    Scrapes the visible text of an aggregator page (see fetch_agg_text) and adds the data to a copy of
+    card_dict_param. Doesn't do any network access, so the text can be fetched separately.
+
+    Args:
+        block (str): The visible text of the aggregator page.
+        card_dict_param (dict): The dictionary of attributes and data scraped from the terms and conditions.
+    Returns:
+        dict: The dictionary containing scraped data from both the TOC and Nerdwallet.
+    """
+    card_dict = copy.deepcopy(card_dict_param)
 
     # (2) Try to get rid of unicode garbage as well as replace all "XYZABC123!!!" with new lines.
     try:
@@ -60,6 +93,7 @@ def scrape_from_agg(agg_url: str, card_dict_param: dict) -> dict:
 
     if important_index < 0 or other_index < 0:
         print("important or other index less than 0")
+        extraction_failures.inc(scraper="agg")
         return
 
     if other_index < important_index:
@@ -73,6 +107,7 @@ def scrape_from_agg(agg_url: str, card_dict_param: dict) -> dict:
 
     if start_index < 0 or end_index < 0:
         print("start or end index less than 0")
+        extraction_failures.inc(scraper="agg")
         return
     important_block = block[start_index:end_index]
 
@@ -0,0 +1,197 @@
+"""
+cassette.py
+~~~
+Record and replay of the pages fetched by get_visible_text, so a scraping run can be repeated offline and
+deterministically. In record mode, every response (status, headers, and body, pdfs included) and the time it took are
+captured into a cassette archive. In replay mode, the responses are served from the cassette instead of the network,
+with the recorded latencies, a synthetic latency, or none at all.
+
+The cassette is a zip file holding interactions.json, which maps every fetched url to its response, and the bodies,
+stored once per distinct content under their sha256.
+
+Example:
+    with use_cassette("cassettes/2018-08.zip", "record"):
+        mass_scrape(input_csv, 1)
+    with use_cassette("cassettes/2018-08.zip", "replay", latency="original"):
+        mass_scrape(input_csv, 1)
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+from scrape_to_dict.deadline import Deadline
+
+modes = ["record", "replay"]
+index_name = "interactions.json"
+
+
+class CassetteMiss(LookupError):
+    """
+    Raised in replay mode when a url was not recorded in the cassette.
+    """
+
+
+class Cassette:
+    """
+    The recorded responses of a run. Safe to share between scraper threads.
+    """
+
+    def __init__(self, path: str, mode: str, latency=None, jitter: float = 0.0, seed: int = 0):
+        """
+        Args:
+            path (str): The path of the cassette archive.
+            mode (str): "record" to capture the responses, "replay" to serve them back.
+            latency: In replay mode, "original" to wait as long as the recorded response took, a number of seconds to
+                     wait that long for every response, or None to not wait.
+            jitter (float): The maximum number of seconds a replayed delay differs from latency, either way.
+            seed (int): The seed of the random jitter, so replays are reproducible.
+        """
+        if mode not in modes:
+            raise ValueError("Unknown cassette mode {}, expected one of {}".format(mode, modes))
+
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.interactions = dict()
+        self.bodies = dict()
+        self.replayed = 0
+        self._lock = threading.Lock()
+
+        # recording into an existing cassette adds to it, so a run can be recorded in several parts
+        if os.path.exists(path):
+            self.__load()
+        elif mode == "replay":
+            raise FileNotFoundError("No cassette at " + path)
+
+    def record(self, kind: str, url: str, body: bytes, status: int = 200, headers: dict = None, elapsed: float = 0.0):
+        """
+        Records a response. A url fetched again replaces its earlier response.
+
+        Args:
+            kind (str): How the page was fetched. ("download" or "browser")
+            url (str): The url of the page.
+            body (bytes): The body of the response.
+            status (int): The http status code.
+            headers (dict): The response headers.
+            elapsed (float): The number of seconds the fetch took.
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            self.bodies[digest] = body
+            self.interactions[self.__key(kind, url)] = {"kind": kind, "url": url, "status": status,
+                                                        "headers": dict(headers or {}), "body": digest,
+                                                        "size": len(body), "elapsed": elapsed}
+
+    def replay(self, kind: str, url: str, deadline: Deadline = None) -> bytes:
+        """
+        Returns the recorded body of a url, after the replay latency. The wait stops at the deadline.
+
+        Args:
+            kind (str): How the page was fetched. ("download" or "browser")
+            url (str): The url of the page.
+            deadline (Deadline): The time budget of the fetch.
+        Returns:
+            bytes: The body of the response.
+        """
+        with self._lock:
+            interaction = self.interactions.get(self.__key(kind, url))
+            if interaction is None:
+                raise CassetteMiss("{} {} is not in the cassette {}".format(kind, url, self.path))
+            body = self.bodies[interaction["body"]]
+            self.replayed += 1
+            delay = self.__delay(interaction)
+
+        if delay > 0:
+            if deadline is not None:
+                delay = min(delay, max(deadline.remaining(), 0))
+            time.sleep(delay)
+        if deadline is not None:
+            deadline.check()
+        return body
+
+    def save(self):
+        """
+        Writes the cassette archive. The file is replaced atomically so a crash never leaves a half written cassette.
+        """
+        with self._lock:
+            interactions = dict(self.interactions)
+            bodies = dict(self.bodies)
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(index_name, json.dumps(interactions, indent=1, sort_keys=True))
+            # only the bodies still referenced by an interaction are kept
+            for digest in sorted({interaction["body"] for interaction in interactions.values()}):
+                archive.writestr("bodies/" + digest, bodies[digest])
+        os.replace(temp_path, self.path)
+
+    def __load(self):
+        with zipfile.ZipFile(self.path, "r") as archive:
+            self.interactions = json.loads(archive.read(index_name).decode("utf-8"))
+            for interaction in self.interactions.values():
+                if interaction["body"] not in self.bodies:
+                    self.bodies[interaction["body"]] = archive.read("bodies/" + interaction["body"])
+
+    def __delay(self, interaction: dict) -> float:
+        if self.latency is None:
+            return 0.0
+        delay = interaction["elapsed"] if self.latency == "original" else float(self.latency)
+        if self.jitter:
+            delay += self.random.uniform(-self.jitter, self.jitter)
+        return max(delay, 0.0)
+
+    @staticmethod
+    def __key(kind: str, url: str) -> str:
+        return kind + " " + url
+
+
+def parse_latency(value: str):
+    """
+    Returns the replay latency written on the command line. ("original", "none" -> None, or a number of seconds)
+    """
+    if value in ("original", "none"):
+        return None if value == "none" else value
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError("expected 'original', 'none', or a number of seconds, got " + value)
+
+
+# The cassette used by get_visible_text, if any (see use_cassette)
+active = None
+
+
+@contextmanager
+def use_cassette(path: str, mode: str, latency=None, jitter: float = 0.0):
+    """
+    Records or replays every page fetched by get_visible_text while the enclosed work runs, on every thread. A
+    recorded cassette is saved on exit, even if the work failed.
+
+    Args:
+        path (str): The path of the cassette archive.
+        mode (str): "record" or "replay".
+        latency: In replay mode, "original", a number of seconds, or None. (see Cassette)
+        jitter (float): In replay mode, the maximum number of seconds a delay differs from latency.
+    """
+    global active
+    cassette = Cassette(path, mode, latency, jitter)
+    previous = active
+    active = cassette
+    try:
+        yield cassette
+    finally:
+        active = previous
+        if mode == "record":
+            cassette.save()
+            print("Recorded {} responses in {}".format(len(cassette.interactions), path))
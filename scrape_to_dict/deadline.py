@@ -0,0 +1,202 @@
+"""
+deadline.py
+~~~
+Time budgets for scraping a card. A Deadline is created with the budget of a card (or of one stage of a card), and is
+passed down to every fetch, which uses the remaining time as its timeout. Work that can't be interrupted by a timeout
+(a browser waiting on a page, a PDF worker process) registers a cancel callback, and the watchdog thread calls it as
+soon as the deadline passes, so one bad card can't stall the whole run.
+
+Example:
+    deadline = Deadline(120, "Blue Cash Everyday Card")
+    with watch(deadline):
+        text = get_visible_text(toc_link, toc_type, deadline.stage(60, "toc"))
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+# The default budgets in seconds
+card_budget = 120
+toc_budget = 75
+agg_budget = 45
+pdf_budget = 60
+
+# The default timeouts in seconds of a single http request
+connect_timeout = 5
+read_timeout = 30
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a card or stage runs out of time.
+    """
+
+
+class Deadline:
+    """
+    A point in time a piece of work has to finish by.
+    """
+
+    def __init__(self, budget: float = None, name: str = "", parent: "Deadline" = None):
+        """
+        Args:
+            budget (float): The number of seconds from now. None for no deadline.
+            name (str): The name of the work, used in error messages. (ie. the card name)
+            parent (Deadline): The deadline of the enclosing work. Never ends later than its parent.
+        """
+        self.name = name
+        self.parent = parent
+        self.expires_at = math.inf if budget is None else time.monotonic() + budget
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def stage(self, budget: float, name: str) -> "Deadline":
+        """
+        Returns the deadline of a stage of this work, budget seconds from now but no later than this deadline. A
+        stage is cancelled with its parent.
+
+        Args:
+            budget (float): The budget of the stage in seconds.
+            name (str): The name of the stage. (ie. "toc")
+        Returns:
+            Deadline: The deadline of the stage.
+        """
+        child = Deadline(budget, "{} {}".format(self.name, name).strip(), parent=self)
+        self.on_cancel(child.cancel)
+        return child
+
+    def remaining(self) -> float:
+        """
+        Returns the number of seconds left. (inf if there is no deadline)
+        """
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        """
+        Returns True if the deadline has passed or the work was cancelled.
+        """
+        return self.cancelled or self.remaining() <= 0
+
+    def check(self):
+        """
+        Raises DeadlineExceeded if the deadline has passed.
+        """
+        if self.expired():
+            raise DeadlineExceeded("{} ran out of time".format(self.name or "Work"))
+
+    def timeout(self, cap: float) -> float:
+        """
+        Returns the timeout of a blocking call: the remaining time, but at most cap seconds. Raises DeadlineExceeded
+        if no time is left.
+
+        Args:
+            cap (float): The maximum timeout in seconds.
+        Returns:
+            float: The timeout in seconds.
+        """
+        self.check()
+        return min(cap, self.remaining())
+
+    def on_cancel(self, callback: Callable) -> Callable:
+        """
+        Registers a function called when the deadline is cancelled, ie. to close a browser or kill a worker process.
+
+        Args:
+            callback (Callable): Zero argument function.
+        Returns:
+            Callable: Zero argument function that unregisters the callback, once the work finished on time.
+        """
+        with self._lock:
+            self._callbacks.append(callback)
+            call_now = self.cancelled
+
+        if call_now:
+            callback()
+
+        def unregister():
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+        return unregister
+
+    def cancel(self):
+        """
+        Marks the work as cancelled and calls every registered cancel callback. Errors in callbacks are printed.
+        """
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks = list(self._callbacks)
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print("Error cancelling {}: {!r}".format(self.name, e))
+
+
+class Watchdog:
+    """
+    Background thread that cancels the watched deadlines once they pass.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        """
+        Args:
+            interval (float): The number of seconds between two checks.
+        """
+        self.interval = interval
+        self._deadlines = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, deadline: Deadline):
+        """
+        Starts watching a deadline. Starts the watchdog thread on first use.
+        """
+        with self._lock:
+            self._deadlines.add(deadline)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.__run, name="deadline-watchdog", daemon=True)
+                self._thread.start()
+
+    def unwatch(self, deadline: Deadline):
+        """
+        Stops watching a deadline.
+        """
+        with self._lock:
+            self._deadlines.discard(deadline)
+
+    def __run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                expired = [deadline for deadline in self._deadlines if deadline.expired()]
+                self._deadlines.difference_update(expired)
+            for deadline in expired:
+                if not deadline.cancelled:
+                    print("Watchdog: {} ran out of time, cancelling it.".format(deadline.name or "work"))
+                deadline.cancel()
+
+
+# The watchdog shared by every scraper
+watchdog = Watchdog()
+
+
+@contextmanager
+def watch(deadline: Deadline):
+    """
+    Watches a deadline with the shared watchdog while the enclosed work runs.
+    """
+    watchdog.watch(deadline)
+    try:
+        yield deadline
+    finally:
+        watchdog.unwatch(deadline)
@@ -4,12 +4,17 @@ general_scraper.py
 Returns dict with scraped info from url with terms and conditions for a credit card.
 """
 
+from instrumentation import metrics
+from instrumentation.timing import timed
 from scrape_to_dict.get_visible_text import get_visible_text
 from scrape_to_dict.card_schema import card_dict, upper_table_attribute_mapping_dict, \
     annual_fees_attribute_mapping_dict, transaction_fees_attribute_mapping_dict, penalty_fees_attribute_mapping_dict
 import copy
 import re
 
+extraction_failures = metrics.counter("scraper_extraction_failures_total", "Pages whose visible text could not be "
+                                      "split into attributes, by scraper (toc, agg).", ["scraper"])
+
 
 def general_scraper(url: str, toc_type: str) -> dict:
     """
@@ -24,6 +29,24 @@ def general_scraper(url: str, toc_type: str) -> dict:
     """
     print("Scraping from " + url)
 
+    # (1) Get all visible text on the webpage (via script using beautiful soup)
+    print("Getting visible text from url.")
+    block = get_visible_text(url, toc_type)
+    return parse_toc_text(block)
+
+
+@timed("parse.toc")
+def parse_toc_text(block: str) -> dict:
+    """
+    Scrapes the visible text of a terms and conditions page. (see get_visible_text) Return a dictionary of the relevant
+    data. Breaks the text into chunks to be scraped. Doesn't do any network access, so the text can be fetched
+    separately.
+
+    Args:
+        block (str): All of the visible text on the terms and conditions page.
+    Returns:
+        dict: The dictionary with the relevant data, or -1 if the text could not be split into tables.
+    """
     # (0) Create deep copies of card schema stuff
     answer = copy.deepcopy(card_dict)
     deep_copy_upper_table = copy.deepcopy(upper_table_attribute_mapping_dict)
@@ -31,9 +54,6 @@ def general_scraper(url: str, toc_type: str) -> dict:
     deep_copy_transaction_fees = copy.deepcopy(transaction_fees_attribute_mapping_dict)
     deep_copy_penalty_fees = copy.deepcopy(penalty_fees_attribute_mapping_dict)
 
-    # (1) Get all visible text on the webpage (via script using beautiful soup)
-    print("Getting visible text from url.")
-    block = get_visible_text(url, toc_type)
     # answer["block"] = block # uncomment this if you want to store full block of text
 
     # # (2) Split table text and fine print((assume webpage begins with table))
@@ -57,6 +77,7 @@ def general_scraper(url: str, toc_type: str) -> dict:
     div_index = find_div_index(dividers, table_text_lowercase)
     if div_index < 0:  # ERROR with separating tables
         print("Scraping Error: Problem with separating tables between apr and fees.")
+        extraction_failures.inc(scraper="toc")
         return -1
 
     upper_table_text = table_text[:div_index]
@@ -68,6 +89,7 @@ def general_scraper(url: str, toc_type: str) -> dict:
                                     lower_table_text_lowercase)
     if fee_div_index1 < 0:  # ERROR with separating fees table
         print("Scraping Error: Problem with separating fee table between annual and trans/penalty fees.")
+        extraction_failures.inc(scraper="toc")
         return -1
 
     annual_fees_text = lower_table_text[:fee_div_index1]
@@ -77,6 +99,7 @@ def general_scraper(url: str, toc_type: str) -> dict:
     fee_div_index2 = find_div_index(["penalty fees", "penaltyfees", "penalty\nfees"], other_lower_text_lowercase)
     if fee_div_index2 < 0:
         print("Scraping Error: Problem with separating fee table between transaction and penalty fees.")
+        extraction_failures.inc(scraper="toc")
         return -1
     transaction_fees_text = other_lower_text[:fee_div_index2]
     penalty_fees_text = other_lower_text[fee_div_index2:]
@@ -115,6 +138,7 @@ def find_div_index(dividers, text):
     return answer
 
 
+@timed("parse.collect_info")
 def collect_info(attributes: dict, text: str) -> dict:
     """
     In text, find attributes and collect the corresponding info. Returns dictionary with attribute and its
@@ -4,27 +4,47 @@ get_visible_text.py
 Returns all visible text from a url.
 """
 
-import requests
+import math
+import os
 import re
-from bs4 import BeautifulSoup
-from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
-from pdfminer.converter import TextConverter
-from pdfminer.layout import LAParams
-from pdfminer.pdfpage import PDFPage
+import tempfile
+import time
 from io import StringIO
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
+from typing import Callable, List
 
-def get_visible_text(url: str, toc_type: str) -> str:
+from instrumentation import metrics
+from instrumentation.timing import timed
+from scrape_to_dict import cassette as cassettes
+from scrape_to_dict.deadline import Deadline, DeadlineExceeded, connect_timeout, read_timeout, pdf_budget
+from scrape_to_dict.selector_preferences import host_of, selector_preferences
+
+# The scraping backends (requests, BeautifulSoup, selenium, pdfminer) are heavy to import, so each one is imported
+# the first time a function that needs it is called. Scraping regular html pages never loads selenium or pdfminer.
+
+# The class names of the terms-and-conditions table on dynamic pages, in the order they are checked by default
+toc_selectors = ["schumer", "preamble", "tncinner"]
+# The number of seconds to wait for any of the selectors to appear, and between two checks
+selector_wait = 10
+selector_poll = 0.25
+
+pages_fetched = metrics.counter("scraper_pages_fetched_total", "Pages downloaded, by host and outcome (ok, error, "
+                                "timeout).", ["host", "outcome"])
+bytes_downloaded = metrics.counter("scraper_bytes_downloaded_total", "Bytes downloaded, by host.", ["host"])
+fetch_seconds = metrics.histogram("scraper_fetch_seconds", "Seconds to download a page, by host.", ["host"])
+selenium_seconds = metrics.histogram("scraper_selenium_seconds", "Seconds to load a dynamic page in the browser, by "
+                                     "host.", ["host"])
+pdf_seconds = metrics.histogram("scraper_pdf_seconds", "Seconds to convert a pdf to text.")
+
+
+def get_visible_text(url: str, toc_type: str, deadline: Deadline = None) -> str:
     """
     Returns all of the visible text in a web page. Gets rid of html tags and other unnecessary text.
 
     Args:
         url (str): The url of the web page.
         toc_type (str): The type of the TOC webpage. (can either be "pdf", "dynamic", or "regular")
+        deadline (Deadline): The time budget of the fetch. None for only the default request timeouts.
     Returns:
         str: All of the visible text on the web page in one string block.
     """
@@ -34,18 +54,35 @@ def get_visible_text(url: str, toc_type: str) -> str:
     if toc_type == "pdf":
         # pdf website (most likely Citi)
         print("Terms and conditions are pdf.")
-        answer = scrape_from_pdf(url)
+        answer = scrape_from_pdf(url, deadline)
 
     elif toc_type == "dynamic":
         print("Terms and conditions are dynamic html.")
         # dynamic HTML content (most likely Capital One)
-        answer = scrape_using_node(url)
+        answer = scrape_using_node(url, deadline)
 
     else:
         print("Terms and conditions are regular html.")
         # normal website with terms and conditions table in HTML as visual text (most websites--Amex, Chase, Discover)
-        answer = scrape_visual_text_directly(url)
+        answer = scrape_visual_text_directly(url, deadline=deadline)
+
+    answer = clean_visible_text(answer)
+
+    print("This is the returned visible text")
+    print(answer)
+
+    return answer
 
+
+def clean_visible_text(answer: str) -> str:
+    """
+    Cleans up the visible text of a terms and conditions page before it is scraped. (see get_visible_text)
+
+    Args:
+        answer (str): The visible text.
+    Returns:
+        str: The visible text in one line, without unicode garbage or lingering html syntax.
+    """
     # (2) Clean up visual text string a little before scraping and get rid of unicode garbage
     try:
         answer = answer.decode('utf-8').strip()
@@ -58,49 +95,43 @@ def get_visible_text(url: str, toc_type: str) -> str:
     answer = re.sub(r">", "", answer)
     answer = re.sub(r"\t", "", answer)
     answer = re.sub(r"\n", "", answer)
-
-    print("This is the returned visible text")
-    print(answer)
-
     return answer
 
 
-def scrape_using_node(url: str) -> str:
+@timed("fetch.browser")
+def scrape_using_node(url: str, deadline: Deadline = None, selectors: List[str] = None) -> str:
     """
     Scrapes from dynamic HTML web pages. Primarily for Capital One websites. Uses selenium to load the JS first before
-    trying to scrape the visible text.
+    trying to scrape the visible text. The browser is always closed, and is closed by the watchdog if the deadline
+    passes while it is loading.
+
+    The page is polled for all of the selectors at once, and the wait ends as soon as one of them appears. The
+    selector that matched is remembered for the host, and checked first on its next page. (see selector_preferences)
+    With a cassette in use, the page source is recorded, or replayed without opening the browser. (see cassette)
 
     Args:
         url (str): The url to scrape.
+        deadline (Deadline): The time budget of the fetch.
+        selectors (List[str]): The class names of the terms-and-conditions table. Defaults to toc_selectors.
     Returns:
         str: The visible text to return.
     """
-    # (1) Use Selenium to get the visible text from webpages with elements dynamically loaded in with JS.
-    # If scraping from another computer, make sure to change this path.
-    browser = webdriver.Chrome(executable_path="/Users/user/chromedriver")
-    # browser.implicitly_wait(10)
-    browser.get(url)
+    if deadline is None:
+        deadline = Deadline()
 
-    # we wait for the TOC table to appear in the webpage before trying getting the visible text
-    try:
-        element = WebDriverWait(browser, 10).until(
-            EC.presence_of_element_located((By.CLASS_NAME, "schumer"), )
-        )
-    except:
-        try:
-            element = WebDriverWait(browser, 10).until(
-                EC.presence_of_element_located((By.CLASS_NAME, "preamble"), )
-            )
-        except:
-            try:
-                element = WebDriverWait(browser, 10).until(
-                    EC.presence_of_element_located((By.CLASS_NAME, "tncinner"), )
-                )
-            except:
-                print("Terms and conditions table not found.")
-                return
-
-    answer = browser.page_source
+    cassette = cassettes.active
+    if cassette is not None and cassette.mode == "replay":
+        answer = cassette.replay("browser", url, deadline).decode("utf-8")
+    else:
+        start = time.perf_counter()
+        answer = __load_in_browser(url, deadline, selectors)
+        if cassette is not None:
+            # a page without the table is recorded empty, so its replay fails the same way
+            cassette.record("browser", url, (answer or "").encode("utf-8"), 200 if answer else 404,
+                            {"Content-Type": "text/html; charset=utf-8"}, time.perf_counter() - start)
+    if not answer:
+        print("Terms and conditions table not found.")
+        return
 
     # (2) Gets rid of all of the text after the table. (We don't need the terms and conditions)
     # print(re.findall(r"</table.*?>", r_content))
@@ -123,7 +154,71 @@ def scrape_using_node(url: str) -> str:
     return answer
 
 
-def scrape_visual_text_directly(url: str, add_new_lines: bool = False) -> str:
+def __load_in_browser(url: str, deadline: Deadline, selectors: List[str] = None) -> str:
+    """
+    Loads a dynamic page in the browser, and returns its source once any of the selectors appears. (None if none
+    of them does)
+    """
+    from selenium import webdriver
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    # (1) Use Selenium to get the visible text from webpages with elements dynamically loaded in with JS.
+    # If scraping from another computer, make sure to change this path.
+    browser = webdriver.Chrome(executable_path="/Users/user/chromedriver")
+    unregister = deadline.on_cancel(browser.quit)
+    start = time.perf_counter()
+    try:
+        # browser.implicitly_wait(10)
+        browser.set_page_load_timeout(deadline.timeout(read_timeout))
+        browser.get(url)
+
+        # we wait for the TOC table to appear in the webpage before trying getting the visible text
+        ordered_selectors = selector_preferences.ordered(url, selectors or toc_selectors)
+        try:
+            matched = WebDriverWait(browser, deadline.timeout(selector_wait), poll_frequency=selector_poll).until(
+                any_class_present(ordered_selectors)
+            )
+        except TimeoutException:
+            deadline.check()
+            return None
+        selector_preferences.record(url, matched)
+
+        return browser.page_source
+    except Exception:
+        # the watchdog closing the browser makes selenium raise, report it as a timeout
+        deadline.check()
+        raise
+    finally:
+        unregister()
+        try:
+            browser.quit()
+        except Exception:
+            pass
+        selenium_seconds.observe(time.perf_counter() - start, host=host_of(url))
+
+
+def any_class_present(class_names: List[str]) -> Callable:
+    """
+    Returns a WebDriverWait condition that checks for the class names in order, and returns the first one present in
+    the page. (False while none of them are)
+
+    Args:
+        class_names (List[str]): The class names to look for.
+    Returns:
+        Callable: The condition, called with the browser.
+    """
+    from selenium.webdriver.common.by import By
+
+    def condition(browser):
+        for class_name in class_names:
+            if browser.find_elements(By.CLASS_NAME, class_name):
+                return class_name
+        return False
+    return condition
+
+
+def scrape_visual_text_directly(url: str, add_new_lines: bool = False, deadline: Deadline = None) -> str:
     """
     Returns all of the visible text directly from the url's html. Adapted from
     https://stackoverflow.com/questions/1936466/beautifulsoup-grab-visible-webpage-text.
@@ -131,6 +226,7 @@ def scrape_visual_text_directly(url: str, add_new_lines: bool = False) -> str:
     Args:
         url (str): The url to get the visible text from.
         add_new_lines (bool): Adds a new line (\n) in place of <li ...>. (For Nerdwallet scraping only)
+        deadline (Deadline): The time budget of the fetch.
     Returns:
         str: Returns all of the visible text (pre processed)
     """
@@ -138,14 +234,31 @@ def scrape_visual_text_directly(url: str, add_new_lines: bool = False) -> str:
     # port = "53281"
     # proxy = 'https://{}:{}/'.format(ip_address, port)
     # print(proxy)
-    r = requests.get(url)
+    content = download(url, deadline)
     # r = requests.get(url, proxies={"https": proxy})
+    print(content)
+    return html_to_visible_text(content, add_new_lines)
+
+
+@timed("parse.beautifulsoup")
+def html_to_visible_text(content: bytes, add_new_lines: bool = False) -> str:
+    """
+    Returns all of the visible text of an html page. (see scrape_visual_text_directly) Doesn't do any network access,
+    so saved pages can be scraped too.
+
+    Args:
+        content (bytes): The html of the page.
+        add_new_lines (bool): Adds a new line (\n) in place of <li ...>. (For Nerdwallet scraping only)
+    Returns:
+        str: Returns all of the visible text (pre processed)
+    """
+    from bs4 import BeautifulSoup
 
     # The response encoding should either be utf-8 or ISO-8859-1
     try:
-        r_content = r.content.decode("utf-8")
+        r_content = content.decode("utf-8")
     except:
-        r_content = r.content.decode("ISO-8859-1")
+        r_content = content.decode("ISO-8859-1")
 
     # gets rid of all text after the table (the terms and condition that we don't need)
     # print(re.findall(r"</table.*?>", r_content))
@@ -164,7 +277,6 @@ def scrape_visual_text_directly(url: str, add_new_lines: bool = False) -> str:
 
     soup = BeautifulSoup(r_content, "lxml")
     # kill all script and style elements
-    print(r.content)
     for script in soup.find_all(["script", "style"]):
         script.extract()  # rip it out
     # get text
@@ -179,25 +291,150 @@ def scrape_visual_text_directly(url: str, add_new_lines: bool = False) -> str:
     return text
 
 
-def scrape_from_pdf(url: str) -> str:
+@timed("fetch.download")
+def download(url: str, deadline: Deadline = None, chunk_size: int = 1 << 16) -> bytes:
     """
-    Scrapes visible text from a pdf.
+    Downloads the body of a url with connect and read timeouts. The download is streamed, so a server that keeps
+    trickling bytes is still stopped at the deadline, and the watchdog closes the connection once the deadline passes.
+    With a cassette in use, the response is recorded, or replayed from the cassette instead of the network.
+
+    Args:
+        url (str): The url to download.
+        deadline (Deadline): The time budget of the download.
+        chunk_size (int): The number of bytes read at a time.
+    Returns:
+        bytes: The body of the response.
+    """
+    import requests
+
+    if deadline is None:
+        deadline = Deadline()
+
+    host = host_of(url)
+    start = time.perf_counter()
+    size = 0
+    outcome = "error"
+    cassette = cassettes.active
+    try:
+        if cassette is not None and cassette.mode == "replay":
+            body = cassette.replay("download", url, deadline)
+            size = len(body)
+            outcome = "ok"
+            return body
+
+        response = requests.get(url, stream=True, timeout=(deadline.timeout(connect_timeout),
+                                                           deadline.timeout(read_timeout)))
+        unregister = deadline.on_cancel(response.close)
+        try:
+            chunks = []
+            for chunk in response.iter_content(chunk_size):
+                chunks.append(chunk)
+                size += len(chunk)
+                deadline.check()
+            outcome = "ok"
+            body = b"".join(chunks)
+            if cassette is not None:
+                cassette.record("download", url, body, response.status_code, response.headers,
+                                time.perf_counter() - start)
+            return body
+        except Exception:
+            deadline.check()
+            raise
+        finally:
+            unregister()
+            response.close()
+    except DeadlineExceeded:
+        outcome = "timeout"
+        raise
+    finally:
+        pages_fetched.inc(host=host, outcome=outcome)
+        bytes_downloaded.inc(size, host=host)
+        fetch_seconds.observe(time.perf_counter() - start, host=host)
+
+
+def scrape_from_pdf(url: str, deadline: Deadline = None) -> str:
+    """
+    Scrapes visible text from a pdf. The pdf is converted in a separate process, which is killed if it runs out of
+    time. (pdfminer can spend minutes on a pathological pdf)
 
     Args:
         url (str): The url to scrape from.
+        deadline (Deadline): The time budget of the download and conversion.
     Returns:
         str: The visible text scraped from the webpage.
     """
+    if deadline is None:
+        deadline = Deadline()
+
     # (1) Download PDF using requests
     # adapted from https://stackoverflow.com/questions/24844729/download-pdf-using-urllib
-    response = requests.get(url)
+    content = download(url, deadline)
+    # every card gets its own file, so several cards can be scraped at the same time
+    doc, document = tempfile.mkstemp(prefix="pdf_processing_doc", suffix=".pdf")
     print("Writing to the pdf_processing_doc.")
-    doc = open("pdf_processing_doc", 'wb')
-    doc.write(response.content)
-    doc.close()
+    with os.fdopen(doc, "wb") as pdf_file:
+        pdf_file.write(content)
 
     # # (2) Use pdfminer to scrape visual text from the pdf
-    return convert_pdf_to_txt("pdf_processing_doc")
+    try:
+        return convert_pdf_to_txt_killable(document, deadline.stage(pdf_budget, "pdf"))
+    finally:
+        os.remove(document)
+
+
+@timed("parse.pdf")
+def convert_pdf_to_txt_killable(document: str, deadline: Deadline) -> str:
+    """
+    Runs convert_pdf_to_txt in a worker process, and kills the process if the deadline passes first.
+
+    Args:
+        document (str): The pdf document we want to convert.
+        deadline (Deadline): The time budget of the conversion.
+    Returns:
+        str: The string text.
+    """
+    import multiprocessing
+
+    # spawn a fresh interpreter, forking a process that runs scraper threads is not safe
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=__convert_pdf_worker, args=(document, sender), daemon=True)
+    process.start()
+    sender.close()
+    unregister = deadline.on_cancel(process.terminate)
+    start = time.perf_counter()
+    try:
+        remaining = deadline.remaining()
+        if not receiver.poll(None if remaining == math.inf else max(remaining, 0)):
+            raise DeadlineExceeded("{} ran out of time converting the pdf".format(deadline.name or "Work"))
+        ok, result = receiver.recv()
+    except EOFError:
+        # the process died without sending a result, either killed by the watchdog or crashed
+        deadline.check()
+        raise RuntimeError("pdf conversion process exited with code {}".format(process.exitcode))
+    finally:
+        unregister()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        receiver.close()
+        pdf_seconds.observe(time.perf_counter() - start)
+
+    if not ok:
+        raise RuntimeError("pdf conversion failed: " + result)
+    return result
+
+
+def __convert_pdf_worker(document: str, sender):
+    """
+    Converts a pdf in the worker process and sends (True, text) or (False, error) back.
+    """
+    try:
+        sender.send((True, convert_pdf_to_txt(document)))
+    except Exception as e:
+        sender.send((False, repr(e)))
+    finally:
+        sender.close()
 
 
 def convert_pdf_to_txt(document: str) -> str:
@@ -210,6 +447,11 @@ def convert_pdf_to_txt(document: str) -> str:
     Returns:
         str: The string text.
     """
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfpage import PDFPage
+
     print("Converting pdf to string.")
     rsrcmgr = PDFResourceManager()
     retstr = StringIO()
@@ -5,14 +5,21 @@ scrape_card.py
 Scrape an individual card. Main function that handles the initial scraping.
 """
 
+from instrumentation import metrics, timing
 from scrape_to_dict import general_scraper, agg_scraper
-from scripts.short_name_dict import short_name_dict
-from scripts.issuer_processor_category_dict import ipc
+from scrape_to_dict.deadline import Deadline, DeadlineExceeded, watch, card_budget, toc_budget, agg_budget
+from scrape_to_dict.get_visible_text import get_visible_text
 import copy
 import traceback
 
+cards_scraped = metrics.counter("scraper_cards_total", "Cards scraped, by whether the terms and conditions could be "
+                                "scraped (ok, failed).", ["outcome"])
+pages_timed_out = metrics.counter("scraper_pages_timed_out_total", "Pages that ran out of time, by page (toc, agg).",
+                                  ["page"])
 
-def run_scraper(card_name: str, toc_link: str, offer_link: str, agg_link: str, toc_type: str) -> dict:
+
+def run_scraper(card_name: str, toc_link: str, offer_link: str, agg_link: str, toc_type: str,
+                budget: float = card_budget, changes=None) -> dict:
     """
     Scrape a card.
 
@@ -22,6 +29,79 @@ def run_scraper(card_name: str, toc_link: str, offer_link: str, agg_link: str, t
         offer_link (str): The URL of the offer link.
         agg_link (str): The URL of the agg page.
         toc_type (str): The type of TOC webpage. (can either be "pdf", "dynamic", or "regular")
+        budget (float): The number of seconds the card may spend fetching its pages. None for no limit.
+        changes (ChangeDetector): If given, the previous extraction is reused when the pages are unchanged. (see
+                                  scripts/change_detection.py)
+
+    Returns:
+        dict: The final dictionary of terms and values for each attribute of the card.
+    """
+    with timing.card(card_name):
+        fetched = fetch_card(toc_link, agg_link, toc_type, budget, card_name)
+        if changes is not None:
+            return changes.extract(card_name, toc_link, offer_link, agg_link, fetched)
+        return parse_card(card_name, toc_link, offer_link, agg_link, fetched)
+
+
+@timing.timed("fetch")
+def fetch_card(toc_link: str, agg_link: str, toc_type: str, budget: float = card_budget,
+               card_name: str = "") -> dict:
+    """
+    Fetches the visible text of a card's terms-and-conditions page and agg page. This is the network bound half of
+    run_scraper. Errors are recorded instead of raised, so parse_card handles them like run_scraper always has.
+
+    The card has a time budget, and each page a smaller one. (see deadline.py) A page that runs out of time is
+    cancelled by the watchdog and recorded in "timed_out", and the card moves on.
+
+    Args:
+        toc_link (str): The URL of the card's terms-and-conditions page.
+        agg_link (str): The URL of the agg page.
+        toc_type (str): The type of TOC webpage. (can either be "pdf", "dynamic", or "regular")
+        budget (float): The number of seconds the card may spend fetching its pages. None for no limit.
+        card_name (str): The name of the card, for error messages.
+
+    Returns:
+        dict: The "toc_text" and "agg_text" (None if not fetched), the "toc_error" and "agg_error" tracebacks, and
+              the pages that "timed_out".
+    """
+    fetched = {"toc_text": None, "toc_error": None, "agg_text": None, "agg_error": None, "timed_out": []}
+    with watch(Deadline(budget, card_name)) as deadline:
+        if toc_link:
+            try:
+                print("Scraping from " + toc_link)
+                with watch(deadline.stage(toc_budget, "toc")) as toc_deadline:
+                    fetched["toc_text"] = get_visible_text(toc_link, toc_type, toc_deadline)
+            except DeadlineExceeded:
+                fetched["toc_error"] = traceback.format_exc()
+                fetched["timed_out"].append("toc")
+                pages_timed_out.inc(page="toc")
+            except Exception:
+                fetched["toc_error"] = traceback.format_exc()
+        if agg_link:
+            try:
+                with watch(deadline.stage(agg_budget, "agg")) as agg_deadline:
+                    fetched["agg_text"] = agg_scraper.fetch_agg_text(agg_link, agg_deadline)
+            except DeadlineExceeded:
+                fetched["agg_error"] = traceback.format_exc()
+                fetched["timed_out"].append("agg")
+                pages_timed_out.inc(page="agg")
+            except Exception:
+                fetched["agg_error"] = traceback.format_exc()
+    return fetched
+
+
+@timing.timed("parse")
+def parse_card(card_name: str, toc_link: str, offer_link: str, agg_link: str, fetched: dict) -> dict:
+    """
+    Scrapes the text fetched by fetch_card. This is the CPU bound half of run_scraper, it doesn't do any network
+    access.
+
+    Args:
+        card_name (str): The name of the card to be scraped in.
+        toc_link (str): The URL of the card's terms-and-conditions page.
+        offer_link (str): The URL of the offer link.
+        agg_link (str): The URL of the agg page.
+        fetched (dict): The text fetched by fetch_card.
 
     Returns:
         dict: The final dictionary of terms and values for each attribute of the card.
@@ -30,19 +110,27 @@ def run_scraper(card_name: str, toc_link: str, offer_link: str, agg_link: str, t
     answer_dict = dict()
     if toc_link:  # then you scrape.
         try:
-            answer_dict = general_scraper.general_scraper(toc_link, toc_type)
+            if fetched["toc_error"]:
+                raise RuntimeError(fetched["toc_error"])
+            answer_dict = general_scraper.parse_toc_text(fetched["toc_text"])
             print("This is the result of general scraper. ")
             print(answer_dict)
         except Exception as e:
             print("Error when trying scraper. Returning empty dictionary.")
             print(traceback.print_exc())
-            answer_dict = dict()
+            # counts as the scraper erring, so the card is reported (and journaled) as failed
+            answer_dict = -1
 
     if answer_dict == -1:  # scraper erred without throwing error.
         answer_dict = dict()
         scraper_worked = False
     else:
         scraper_worked = True
+    cards_scraped.inc(outcome="ok" if scraper_worked else "failed")
+
+    # the short name and issuer/processor/category tables are large literals, only load them once a card is scraped
+    from scripts.short_name_dict import short_name_dict
+    from scripts.issuer_processor_category_dict import ipc
 
     # 2. Modify some variables in answer_dict.
     answer_dict["toc_link"] = toc_link
@@ -74,7 +162,10 @@ def run_scraper(card_name: str, toc_link: str, offer_link: str, agg_link: str, t
     # 3. Try to scrape from agg_scraper.
     if agg_link:
         try:
-            agg_dict = agg_scraper.scrape_from_agg(agg_link, answer_dict)
+            if fetched["agg_error"]:
+                raise RuntimeError(fetched["agg_error"])
+            print("scraping from agg for " + card_name)
+            agg_dict = agg_scraper.parse_agg_text(fetched["agg_text"], answer_dict)
         except Exception as e:
             print("You entered an agg link, but scraping from agg link failed")
             print(e)
@@ -88,6 +179,8 @@ def run_scraper(card_name: str, toc_link: str, offer_link: str, agg_link: str, t
         final_dict["scraper"] = "TRUE"
     else:
         final_dict["scraper"] = "FALSE"
+    # the pages that ran out of time, so timed out cards can be found and scraped again
+    final_dict["timed_out"] = ", ".join(fetched.get("timed_out", []))
 
     # 4. Return the final dictionary of scraped sentences.
     print("Scraper response")
@@ -0,0 +1,91 @@
+"""
+selector_preferences.py
+~~~
+Remembers which selector found the terms-and-conditions table on each host of a dynamic page, so the next card on
+that host checks for that selector first. The preferences are kept in a json file mapping host to class name.
+"""
+
+import json
+import os
+import threading
+from typing import List
+from urllib.parse import urlparse
+
+current_directory = os.path.dirname(os.path.realpath(__file__))
+preferences_json = os.path.join(current_directory, "selector_preferences.json")
+
+
+def host_of(url: str) -> str:
+    """
+    Returns the host of a url. ("https://www.capitalone.com/credit-cards/..." -> "www.capitalone.com")
+    """
+    return urlparse(url).netloc.lower()
+
+
+class SelectorPreferences:
+    """
+    A json backed mapping of host to the selector that last matched on it. Safe to share between scraper threads.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path (str): The path to the json file. None to only remember the preferences in memory.
+        """
+        self.path = path
+        self.preferences = dict()
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as preferences_file:
+                    self.preferences = json.load(preferences_file)
+            except ValueError:
+                print("Selector preferences in {} are not valid json, starting over.".format(path))
+
+    def ordered(self, url: str, selectors: List[str]) -> List[str]:
+        """
+        Returns the selectors with the preferred selector of the url's host first.
+
+        Args:
+            url (str): The url of the page.
+            selectors (List[str]): The selectors, in their default order.
+        Returns:
+            List[str]: The selectors in the order they should be checked.
+        """
+        with self._lock:
+            preferred = self.preferences.get(host_of(url))
+        if preferred not in selectors:
+            return list(selectors)
+        return [preferred] + [selector for selector in selectors if selector != preferred]
+
+    def record(self, url: str, selector: str):
+        """
+        Records the selector that matched on the url's host, and saves the file if the preference changed.
+
+        Args:
+            url (str): The url of the page.
+            selector (str): The selector that matched.
+        """
+        host = host_of(url)
+        with self._lock:
+            if self.preferences.get(host) == selector:
+                return
+            self.preferences[host] = selector
+            self.__save()
+
+    def __save(self):
+        """
+        Writes the preferences to disk. The file is replaced atomically so a crash never leaves a half written file.
+        """
+        if not self.path:
+            return
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as preferences_file:
+            json.dump(self.preferences, preferences_file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+# The preferences shared by every scraper
+selector_preferences = SelectorPreferences(preferences_json)
@@ -0,0 +1,89 @@
+"""
+benchmark_import_time.py
+~~~
+Measures the cold import time of the pipeline modules, each in a fresh python process, and checks that importing them
+doesn't load the heavy scraping backends (selenium, pdfminer, BeautifulSoup, requests, boto3) or the large lookup
+tables. Short tasks like term processing or single card scrapes should start in milliseconds.
+
+Run from the CreditCardScraper folder: python -m scripts.benchmark_import_time
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+repository_directory = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Modules to measure, with their import time budget in milliseconds
+import_budgets_ms = {
+    "scrape_to_dict.get_visible_text": 50,
+    "scrape_to_dict.scrape_card": 50,
+    "term_processor.clean_up_terms": 50,
+    "phrase_generation.generator": 50,
+}
+
+# Modules that must not be loaded just by importing the pipeline modules
+lazy_modules = [
+    "selenium",
+    "pdfminer",
+    "bs4",
+    "requests",
+    "boto3",
+    "scripts.short_name_dict",
+    "scripts.issuer_processor_category_dict",
+]
+
+# Code run in the child process. Prints the import time and the lazy modules that got loaded as json.
+measure_code = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed_ms = (time.perf_counter() - start) * 1000
+loaded = [name for name in {lazy_modules!r} if name in sys.modules]
+print(json.dumps({{"elapsed_ms": elapsed_ms, "loaded": loaded}}))
+"""
+
+
+def measure_import(module: str, repeat: int = 5) -> dict:
+    """
+    Imports a module in fresh python processes and returns the fastest import time.
+
+    Args:
+        module (str): The dotted module name.
+        repeat (int): The number of processes to run.
+    Returns:
+        dict: The best import time in milliseconds and the lazy modules loaded by the import.
+    """
+    best = None
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", measure_code.format(module=module,
+                                                                                  lazy_modules=lazy_modules)],
+                                         cwd=repository_directory)
+        result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+        if best is None or result["elapsed_ms"] < best["elapsed_ms"]:
+            best = result
+    return best
+
+
+def run_benchmark() -> bool:
+    """
+    Measures every module in import_budgets_ms and prints the results.
+
+    Returns:
+        bool: True if every module is within its budget and loads none of the lazy modules.
+    """
+    passed = True
+    for module, budget_ms in import_budgets_ms.items():
+        result = measure_import(module)
+        ok = result["elapsed_ms"] <= budget_ms and not result["loaded"]
+        passed = passed and ok
+        print("{:<40} {:8.1f} ms (budget {} ms) {}{}".format(
+            module, result["elapsed_ms"], budget_ms, "OK" if ok else "FAILED",
+            "" if not result["loaded"] else ", loaded " + ", ".join(result["loaded"])))
+    return passed
+
+
+if __name__ == "__main__":
+    if not run_benchmark():
+        raise SystemExit("Import time benchmark failed.")
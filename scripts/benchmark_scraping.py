@@ -0,0 +1,691 @@
+"""
+benchmark_scraping.py
+~~~
+Benchmarks scraping without touching the live issuer sites. A corpus of saved pages (terms-and-conditions html and pdf
+pages, and NerdWallet pages) is served by a local http server that adds a configurable latency and jitter to every
+response, so runs are reproducible and can be compared before and after a change.
+
+The corpus is a folder with a corpus.csv index (full_card_name, offer_link, toc_file, agg_file, toc_type) and the
+pages it points to. It can be built two ways:
+
+    build_corpus      ----> renders pages from the scraped sentences in CreditCardCardRaw - Main.csv (no network)
+    save_live_corpus  ----> downloads the real pages of an input csv file once, to be replayed afterwards
+
+Dynamic (selenium) pages need a browser, so they are saved and served as regular html pages.
+
+Run from the CreditCardScraper folder:
+
+    python -m scripts.benchmark_scraping --build
+    python -m scripts.benchmark_scraping --mode pipeline --latency 0.2 --jitter 0.1 --fetch-workers 16
+    python -m scripts.benchmark_scraping --parsers
+
+A run recorded with a cassette (see scrape_to_dict/cassette.py) can be replayed instead, so the real pages of an input
+csv file are scraped offline with their recorded latencies. Saving the result as a baseline and checking later runs
+against it makes a regression check that fails when throughput drops or the scraped output changes:
+
+    python -m scripts.cli scrape --input cards.csv --cassette cassettes/cards.zip --cassette-mode record
+    python -m scripts.benchmark_scraping --cassette cassettes/cards.zip --input cards.csv --save-baseline base.json
+    python -m scripts.benchmark_scraping --cassette cassettes/cards.zip --input cards.csv --baseline base.json
+"""
+
+import argparse
+import csv
+import hashlib
+import html
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from scripts.csv_stream import read_csv_rows
+
+current_directory = os.path.dirname(os.path.realpath(__file__))
+source_csv = os.path.join(current_directory, "csv_files/CreditCardCardRaw - Main.csv")
+corpus_directory = os.path.join(current_directory, "benchmark_corpus")
+corpus_index = "corpus.csv"
+
+# The rows of the terms-and-conditions table, as (heading, column of the scraped sentence in source_csv). A heading
+# without a column is a section title. The headings are aliases in card_schema.py, so general_scraper finds them.
+toc_rows = [
+    ("Interest Rates and Interest Charges", None),
+    ("Annual Percentage Rate (APR) for Purchases", "purchase_apr_string"),
+    ("APR for Balance Transfers", "balance_transfer_apr_string"),
+    ("APR for Cash Advances", "cash_advance_apr_string"),
+    ("Penalty APR and When it Applies", "penalty_apr_string"),
+    ("How to Avoid Paying Interest on Purchases", "paying_interest_string"),
+    ("Minimum Interest Charge", "minimum_interest_charge_apr_string"),
+    ("Fees", None),
+    ("Annual Fee", "annual_fee_string"),
+    ("Transaction Fees", None),
+    ("Balance Transfer", "balance_transfer_fee_string"),
+    ("Cash Advance", "cash_advance_fee_string"),
+    ("Foreign Transaction", "foreign_transaction_fee_string"),
+    ("Penalty Fees", None),
+    ("Late Payment", "late_payment_fee_string"),
+    ("Returned Payment", "returned_payment_fee_string"),
+    ("Returned Check", "returned_check_fee_string"),
+    ("Over-the-Credit-Limit", "over_limit_fee_string"),
+]
+toc_fine_print = ("How We Will Calculate Your Balance: We use a method called \"average daily balance (including new "
+                  "purchases).\" See your Cardmember Agreement for details. ")
+
+# The sections of the NerdWallet page, as (heading, column in source_csv). The headings are the aliases in
+# agg_scraper.agg_attribute_mapping_dict, without the _ the scraper puts in front of headers.
+agg_sections = [
+    ("Pros", "pros_string_2018"),
+    ("Cons", "cons_string_2018"),
+    ("Recommended credit score", "credit_score_string"),
+    ("Bonus offer", "bonus_offer_string_2018"),
+    ("Rewards rate", "reward_rate_string_2018"),
+    ("Intro APR", "intro_apr_check_string"),
+    ("APR, Variable", "variable_apr_check_string"),
+    ("Annual fee", "annual_fee_check_string"),
+]
+
+
+def build_corpus(corpus_dir: str = corpus_directory, source: str = source_csv, limit: int = None) -> int:
+    """
+    Renders a terms-and-conditions page and a NerdWallet page for every card in source, from the sentences that were
+    scraped from the real pages. Cards whose real terms-and-conditions link is a pdf get a pdf page.
+
+    Args:
+        corpus_dir (str): The folder the corpus is written to. It is replaced.
+        source (str): The csv file with the scraped sentences of every card. (CreditCardCardRaw - Main.csv)
+        limit (int): The maximum number of cards. None for every card.
+    Returns:
+        int: The number of cards in the corpus.
+    """
+    __reset_corpus(corpus_dir)
+    index = []
+    with open(source, "r", newline="", encoding="utf-8", errors="replace") as source_file:
+        for card in csv.DictReader(source_file):
+            if limit is not None and len(index) >= limit:
+                break
+            number = len(index)
+            name = card["name"].strip()
+            if card["toc_link"].lower().endswith(".pdf"):
+                toc_file, toc_type = "toc_{}.pdf".format(number), "pdf"
+                __write_page(corpus_dir, toc_file, text_pdf(__toc_lines(card)))
+            else:
+                toc_file, toc_type = "toc_{}.html".format(number), "regular"
+                __write_page(corpus_dir, toc_file, __toc_html(card).encode("utf-8"))
+            agg_file = ""
+            if card["agg_link"]:
+                agg_file = "agg_{}.html".format(number)
+                __write_page(corpus_dir, agg_file, __agg_html(card).encode("utf-8"))
+            index.append([name, card["offer_link"], toc_file, agg_file, toc_type])
+
+    __write_index(corpus_dir, index)
+    return len(index)
+
+
+def save_live_corpus(input_csv: str, corpus_dir: str = corpus_directory, start_index: int = 1) -> int:
+    """
+    Downloads the live terms-and-conditions and NerdWallet pages of every card in an input csv file. Pages that fail
+    to download are printed and left out.
+
+    Args:
+        input_csv (str): The csv file of cards and links. (card_name, offer_link, toc_link, agg_link, toc_type)
+        corpus_dir (str): The folder the corpus is written to. It is replaced.
+        start_index (int): The integer row index to start from in input_csv.
+    Returns:
+        int: The number of cards in the corpus.
+    """
+    from scrape_to_dict.get_visible_text import download
+
+    __reset_corpus(corpus_dir)
+    index = []
+    for row in read_csv_rows(input_csv, start_index):
+        if not row:
+            continue
+        number = len(index)
+        name, offer_link, toc_link, agg_link, toc_type = row[:5]
+        toc_type = "pdf" if toc_type == "pdf" else "regular"
+        toc_file = "toc_{}.{}".format(number, "pdf" if toc_type == "pdf" else "html")
+        agg_file = "agg_{}.html".format(number) if agg_link else ""
+        try:
+            __write_page(corpus_dir, toc_file, download(toc_link))
+            if agg_file:
+                __write_page(corpus_dir, agg_file, download(agg_link))
+        except Exception as e:
+            print("Could not save the pages of {}: {!r}".format(name, e))
+            continue
+        index.append([name, offer_link, toc_file, agg_file, toc_type])
+
+    __write_index(corpus_dir, index)
+    return len(index)
+
+
+def read_corpus(corpus_dir: str = corpus_directory) -> List[List[str]]:
+    """
+    Returns the rows of the corpus index. (full_card_name, offer_link, toc_file, agg_file, toc_type)
+    """
+    return [row for row in read_csv_rows(os.path.join(corpus_dir, corpus_index), 1) if row]
+
+
+def text_pdf(lines: List[str], lines_per_page: int = 50) -> bytes:
+    """
+    Returns a minimal pdf document showing the lines of text, in Helvetica.
+
+    Args:
+        lines (List[str]): The lines of text.
+        lines_per_page (int): The number of lines on a page.
+    Returns:
+        bytes: The pdf document.
+    """
+    pages = [lines[start:start + lines_per_page] for start in range(0, len(lines), lines_per_page)] or [[]]
+    # objects 1 to 3 are the catalog, the page tree and the font, then a page and its content stream per page
+    page_ids = [4 + 2 * number for number in range(len(pages))]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(" ".join("{} 0 R".format(page_id) for page_id in page_ids),
+                                                         len(pages)).encode("latin-1"),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for page_id, page_lines in zip(page_ids, pages):
+        text = "".join("({}) Tj T* ".format(line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)"))
+                       for line in page_lines)
+        stream = "BT /F1 10 Tf 14 TL 40 760 Td {}ET".format(text).encode("latin-1", "replace")
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                       "/Contents {} 0 R >>".format(page_id + 1).encode("latin-1"))
+        objects.append(b"<< /Length " + str(len(stream)).encode("latin-1") + b" >>\nstream\n" + stream +
+                       b"\nendstream")
+
+    document = b"%PDF-1.4\n"
+    offsets = []
+    for number, pdf_object in enumerate(objects, start=1):
+        offsets.append(len(document))
+        document += str(number).encode("latin-1") + b" 0 obj\n" + pdf_object + b"\nendobj\n"
+    xref_offset = len(document)
+    document += "xref\n0 {}\n0000000000 65535 f \n".format(len(objects) + 1).encode("latin-1")
+    document += b"".join("{:010d} 00000 n \n".format(offset).encode("latin-1") for offset in offsets)
+    document += "trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n".format(len(objects) + 1,
+                                                                                    xref_offset).encode("latin-1")
+    return document
+
+
+class CorpusServer:
+    """
+    Local http server serving the files of a corpus folder. Every response is delayed by latency seconds, give or
+    take a random jitter, to stand in for the issuer sites.
+    """
+
+    def __init__(self, corpus_dir: str = corpus_directory, latency: float = 0.05, jitter: float = 0.0,
+                 seed: int = 0):
+        """
+        Args:
+            corpus_dir (str): The folder of the corpus.
+            latency (float): The average number of seconds before a response is sent.
+            jitter (float): The maximum number of seconds the delay differs from latency, either way.
+            seed (int): The seed of the random jitter, so runs are reproducible.
+        """
+        self.corpus_dir = corpus_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self) -> "CorpusServer":
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.respond(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def url(self, file_name: str) -> str:
+        """
+        Returns the url of a file of the corpus. ("" for no file)
+        """
+        if not file_name:
+            return ""
+        return "http://127.0.0.1:{}/{}".format(self._server.server_port, file_name)
+
+    def delay(self) -> float:
+        """
+        Returns the number of seconds the next response is delayed by.
+        """
+        with self._lock:
+            self.requests += 1
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def respond(self, handler: BaseHTTPRequestHandler):
+        """
+        Sends a file of the corpus after the delay, or a 404.
+        """
+        time.sleep(self.delay())
+        path = os.path.join(self.corpus_dir, os.path.basename(handler.path.split("?")[0]))
+        if not os.path.isfile(path):
+            handler.send_error(404)
+            return
+
+        with open(path, "rb") as page_file:
+            body = page_file.read()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/pdf" if path.endswith(".pdf") else "text/html")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def benchmark_end_to_end(corpus_dir: str = corpus_directory, mode: str = "serial", latency: float = 0.05,
+                         jitter: float = 0.0, limit: int = None, fetch_workers: int = 8, extract_workers: int = 2,
+                         clean_workers: int = 2, trace_memory: bool = False, verbose: bool = False) -> dict:
+    """
+    Scrapes every card of the corpus from the local server, and measures the throughput, the time spent in every
+    stage, and the peak memory.
+
+    Modes:
+        serial       ----> fetch_card, parse_card and process_scraped_dict one card after another (run_scraper
+                           followed by term processing), timing each stage
+        mass_scrape  ----> run_scraping_script.mass_scrape end to end (no per stage times)
+        pipeline     ----> scrape_pipeline.run_pipeline, with the busy time of every stage
+
+    Args:
+        corpus_dir (str): The folder of the corpus.
+        mode (str): "serial", "mass_scrape", or "pipeline".
+        latency (float): The average delay of a response in seconds.
+        jitter (float): The maximum difference between the delay and latency in seconds.
+        limit (int): The maximum number of cards. None for every card.
+        fetch_workers (int): With pipeline, the number of cards fetched at the same time.
+        extract_workers (int): With pipeline, the number of extraction workers.
+        clean_workers (int): With pipeline, the number of term cleaning workers.
+        trace_memory (bool): Measure the peak python memory with tracemalloc. Slows the run down.
+        verbose (bool): Keep the output of the scrapers instead of hiding it.
+    Returns:
+        dict: The number of cards, the elapsed seconds, the cards per second, the seconds spent in every stage, and
+              the peak memory in MB.
+    """
+    rows = read_corpus(corpus_dir)[:limit]
+    work_dir = tempfile.mkdtemp(prefix="benchmark_scraping")
+    try:
+        with CorpusServer(corpus_dir, latency, jitter) as server:
+            input_rows = [[name, offer_link, server.url(toc_file), server.url(agg_file), toc_type]
+                          for name, offer_link, toc_file, agg_file, toc_type in rows]
+            input_csv = os.path.join(work_dir, "input.csv")
+            with open(input_csv, "w", newline="") as input_file:
+                csv.writer(input_file).writerows([["full_card_name", "offer_link", "toc_link", "agg_link",
+                                                   "toc_type"]] + input_rows)
+            result = __measure(mode, input_csv, input_rows, work_dir, fetch_workers, extract_workers, clean_workers,
+                               trace_memory, verbose)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result["requests"] = server.requests
+    return result
+
+
+def benchmark_replay(cassette_path: str, input_csv: str, mode: str = "mass_scrape", latency="original",
+                     jitter: float = 0.0, limit: int = None, fetch_workers: int = 8, extract_workers: int = 2,
+                     clean_workers: int = 2, trace_memory: bool = False, verbose: bool = False) -> dict:
+    """
+    Scrapes the cards of an input csv file with every page replayed from a cassette, without any network access, and
+    measures the same as benchmark_end_to_end. The replay is deterministic, so the digest of the scraped output only
+    changes when the scrapers do.
+
+    Args:
+        cassette_path (str): The cassette the pages of the input csv file were recorded in.
+        input_csv (str): The input csv file of the recorded run.
+        mode (str): "serial", "mass_scrape", or "pipeline".
+        latency: "original" to replay the recorded latencies, a number of seconds per response, or None.
+        jitter (float): The maximum difference between the delay and latency in seconds.
+        limit (int): The maximum number of cards. None for every card.
+        fetch_workers (int): With pipeline, the number of cards fetched at the same time.
+        extract_workers (int): With pipeline, the number of extraction workers.
+        clean_workers (int): With pipeline, the number of term cleaning workers.
+        trace_memory (bool): Measure the peak python memory with tracemalloc. Slows the run down.
+        verbose (bool): Keep the output of the scrapers instead of hiding it.
+    Returns:
+        dict: The result of benchmark_end_to_end, with the number of replayed responses as requests.
+    """
+    from scrape_to_dict.cassette import use_cassette
+
+    input_rows = [row[:5] for row in read_csv_rows(input_csv, 1)][:limit]
+    work_dir = tempfile.mkdtemp(prefix="benchmark_replay")
+    try:
+        limited_csv = os.path.join(work_dir, "input.csv")
+        with open(limited_csv, "w", newline="") as input_file:
+            csv.writer(input_file).writerows([["full_card_name", "offer_link", "toc_link", "agg_link", "toc_type"]] +
+                                             input_rows)
+        with use_cassette(cassette_path, "replay", latency, jitter) as cassette:
+            result = __measure(mode, limited_csv, input_rows, work_dir, fetch_workers, extract_workers,
+                               clean_workers, trace_memory, verbose)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result["requests"] = cassette.replayed
+    return result
+
+
+def check_regression(result: dict, baseline: dict, tolerance: float = 0.2) -> List[str]:
+    """
+    Compares a benchmark result with a baseline result of the same mode.
+
+    Args:
+        result (dict): The result of benchmark_replay or benchmark_end_to_end.
+        baseline (dict): An earlier result, ie. read from the file written by --save-baseline.
+        tolerance (float): The fraction the throughput may drop below the baseline.
+    Returns:
+        List[str]: The regressions found. Empty if there are none.
+    """
+    regressions = []
+    if result["cards_per_second"] < baseline["cards_per_second"] * (1 - tolerance):
+        regressions.append("throughput {:.2f} cards/s is more than {:.0%} below the baseline {:.2f} cards/s".format(
+            result["cards_per_second"], tolerance, baseline["cards_per_second"]))
+    if baseline.get("output_sha256") and result["output_sha256"] != baseline["output_sha256"]:
+        regressions.append("the scraped output differs from the baseline output")
+    return regressions
+
+
+def benchmark_parsers(corpus_dir: str = corpus_directory, repeat: int = 3, limit: int = None) -> dict:
+    """
+    Times general_scraper, agg_scraper and convert_pdf_to_txt on the saved pages, without any network access. The
+    html pages are converted to visible text once, so only the scraping is timed.
+
+    Args:
+        corpus_dir (str): The folder of the corpus.
+        repeat (int): The number of timing runs. The best run is reported.
+        limit (int): The maximum number of cards. None for every card.
+    Returns:
+        dict: For every scraper, the number of pages, the best total seconds, and the milliseconds per page.
+    """
+    from scrape_to_dict import agg_scraper, general_scraper
+    from scrape_to_dict.card_schema import card_dict
+    from scrape_to_dict.get_visible_text import clean_visible_text, convert_pdf_to_txt, html_to_visible_text
+
+    rows = read_corpus(corpus_dir)[:limit]
+    with __quiet(False):
+        toc_texts = [clean_visible_text(html_to_visible_text(__read_page(corpus_dir, toc_file)))
+                     for _, _, toc_file, _, toc_type in rows if toc_type != "pdf"]
+        agg_texts = [html_to_visible_text(__read_page(corpus_dir, agg_file), add_new_lines=True)
+                     for _, _, _, agg_file, _ in rows if agg_file]
+    pdf_paths = [os.path.join(corpus_dir, toc_file) for _, _, toc_file, _, toc_type in rows if toc_type == "pdf"]
+
+    timings = dict()
+    with __quiet(False):
+        timings["general_scraper.parse_toc_text"] = __best_time(
+            lambda: [general_scraper.parse_toc_text(text) for text in toc_texts], repeat), len(toc_texts)
+        timings["agg_scraper.parse_agg_text"] = __best_time(
+            lambda: [agg_scraper.parse_agg_text(text, card_dict) for text in agg_texts], repeat), len(agg_texts)
+        if pdf_paths:
+            timings["convert_pdf_to_txt"] = __best_time(
+                lambda: [convert_pdf_to_txt(path) for path in pdf_paths], repeat), len(pdf_paths)
+
+    return {name: {"pages": pages, "seconds": seconds, "ms_per_page": 1000 * seconds / pages if pages else 0.0}
+            for name, (seconds, pages) in timings.items()}
+
+
+def report_end_to_end(result: dict) -> str:
+    """
+    Returns the result of benchmark_end_to_end as text.
+    """
+    lines = ["{mode}: {cards} cards ({requests} requests) in {seconds:.2f} s, {cards_per_second:.2f} cards/s, "
+             "peak rss {peak_rss_mb:.0f} MB".format(**result)]
+    if result["peak_traced_mb"] is not None:
+        lines[0] += ", peak traced {:.1f} MB".format(result["peak_traced_mb"])
+    for stage, seconds in result["stage_seconds"].items():
+        lines.append("    {:<10} {:>8.2f} s {:>7.1f} ms/card".format(stage, seconds,
+                                                                    1000 * seconds / max(result["cards"], 1)))
+    return "\n".join(lines)
+
+
+def __measure(mode: str, input_csv: str, input_rows: List[List[str]], work_dir: str, fetch_workers: int,
+              extract_workers: int, clean_workers: int, trace_memory: bool, verbose: bool) -> dict:
+    """
+    Scrapes the input rows in the given mode, and returns the throughput, the time spent in every stage, the peak
+    memory, and the digest of the scraped output.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with __quiet(verbose):
+        stage_seconds = __run_mode(mode, input_csv, input_rows, work_dir, fetch_workers, extract_workers,
+                                   clean_workers)
+    elapsed = time.perf_counter() - start
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    output_digest = None
+    scraped_csv = os.path.join(work_dir, "scraped.csv")
+    if os.path.exists(scraped_csv):
+        with open(scraped_csv, "rb") as scraped_file:
+            output_digest = hashlib.sha256(scraped_file.read()).hexdigest()
+
+    return {
+        "mode": mode,
+        "cards": len(input_rows),
+        "seconds": elapsed,
+        "cards_per_second": len(input_rows) / elapsed if elapsed else 0.0,
+        "stage_seconds": stage_seconds,
+        # ru_maxrss is in KB on linux, and is the peak of the whole process so far
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_traced_mb": traced_peak,
+        "output_sha256": output_digest,
+    }
+
+
+def __run_mode(mode: str, input_csv: str, input_rows: List[List[str]], work_dir: str, fetch_workers: int,
+               extract_workers: int, clean_workers: int) -> dict:
+    """
+    Scrapes the input rows in the given mode, and returns the seconds spent in every stage.
+    """
+    if mode == "serial":
+        from scrape_to_dict.scrape_card import fetch_card, parse_card
+        from scripts.term_processing_script import process_scraped_dict
+
+        stage_seconds = {"fetch": 0.0, "extract": 0.0, "clean": 0.0}
+        for name, offer_link, toc_link, agg_link, toc_type in input_rows:
+            start = time.perf_counter()
+            fetched = fetch_card(toc_link, agg_link, toc_type, card_name=name)
+            middle = time.perf_counter()
+            scraped = parse_card(name, toc_link, offer_link, agg_link, fetched)
+            end = time.perf_counter()
+            process_scraped_dict(scraped)
+            stage_seconds["fetch"] += middle - start
+            stage_seconds["extract"] += end - middle
+            stage_seconds["clean"] += time.perf_counter() - end
+        return stage_seconds
+
+    if mode == "mass_scrape":
+        from scripts.run_scraping_script import mass_scrape
+        mass_scrape(input_csv, 1, dest_csv=os.path.join(work_dir, "scraped.csv"))
+        return dict()
+
+    if mode == "pipeline":
+        from scripts.scrape_pipeline import run_pipeline
+        stats = run_pipeline(input_csv, 1, raw_csv=os.path.join(work_dir, "scraped.csv"),
+                             dest_csv=os.path.join(work_dir, "processed.csv"), fetch_workers=fetch_workers,
+                             extract_workers=extract_workers, clean_workers=clean_workers)
+        return {stage.name: stage.busy_time for stage in stats.stages}
+
+    raise ValueError("Unknown benchmark mode " + mode)
+
+
+@contextmanager
+def __quiet(verbose: bool):
+    """
+    Hides the output of the scrapers, which would otherwise dominate the timings.
+    """
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        yield
+
+
+def __best_time(function, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def __toc_lines(card: dict) -> List[str]:
+    """
+    Returns the lines of text of a card's terms-and-conditions table. (heading, then sentence)
+    """
+    lines = []
+    for heading, column in toc_rows:
+        sentence = " ".join(card.get(column, "").split()) if column else ""
+        if column and not sentence:
+            continue
+        lines.append(heading)
+        if sentence:
+            # wrap long sentences, pdf text lines don't wrap by themselves
+            words = sentence.split(" ")
+            while words:
+                line = words.pop(0)
+                while words and len(line) + len(words[0]) < 100:
+                    line += " " + words.pop(0)
+                lines.append(line)
+    lines.append(toc_fine_print)
+    return lines
+
+
+def __toc_html(card: dict) -> str:
+    """
+    Returns the html of a card's terms-and-conditions page, with the pricing table issuers use.
+    """
+    table_rows = []
+    for heading, column in toc_rows:
+        if column is None:
+            table_rows.append("<tr><th colspan=\"2\"><h3>{}</h3></th></tr>".format(html.escape(heading)))
+        elif card.get(column, "").strip():
+            table_rows.append("<tr><th>{}</th><td>{}</td></tr>".format(html.escape(heading),
+                                                                      html.escape(card[column].strip())))
+    table_rows.append("<tr><td colspan=\"2\">{}</td></tr>".format(html.escape(toc_fine_print)))
+    return ("<!DOCTYPE html><html><head><title>{name} Pricing and Terms</title>"
+            "<style>table {{border-collapse: collapse;}}</style><script>var page = \"terms\";</script></head>"
+            "<body><h1>{name}</h1><p>Pricing and Terms</p><table class=\"schumer\">{rows}</table>"
+            "<p>Terms and conditions apply. Offer subject to credit approval.</p></body></html>"
+            .format(name=html.escape(card["name"].strip()), rows="".join(table_rows)))
+
+
+def __agg_html(card: dict) -> str:
+    """
+    Returns the html of a card's NerdWallet page, laid out the way agg_scraper expects.
+    """
+    sections = ["<h3>Card details</h3><ul>{}</ul>".format(__list_items(card.get("offer_details_string", "")))]
+    for heading, column in agg_sections:
+        sections.append("<h4>{}</h4><ul>{}</ul>".format(html.escape(heading), __list_items(card.get(column, ""))))
+    return ("<!DOCTYPE html><html><head><title>{name} Review</title><script>var page = \"card\";</script></head>"
+            "<body><div>Advertiser Disclosure</div><h1>{trademark}</h1><a href=\"#\">Apply Now</a>{sections}"
+            "<p>See if you may qualify</p><p>NerdWallet reviews are the result of independent research</p>"
+            "</body></html>".format(name=html.escape(card["name"].strip()),
+                                    trademark=html.escape(card["trademark_card_name"].strip() or card["name"].strip()),
+                                    sections="".join(sections)))
+
+
+def __list_items(text: str) -> str:
+    return "".join("<li>{}</li>".format(html.escape(line.strip())) for line in text.splitlines() if line.strip())
+
+
+def __reset_corpus(corpus_dir: str):
+    if os.path.isdir(corpus_dir):
+        shutil.rmtree(corpus_dir)
+    os.makedirs(corpus_dir)
+
+
+def __write_page(corpus_dir: str, file_name: str, content: bytes):
+    with open(os.path.join(corpus_dir, file_name), "wb") as page_file:
+        page_file.write(content)
+
+
+def __read_page(corpus_dir: str, file_name: str) -> bytes:
+    with open(os.path.join(corpus_dir, file_name), "rb") as page_file:
+        return page_file.read()
+
+
+def __write_index(corpus_dir: str, index: List[List[str]]):
+    with open(os.path.join(corpus_dir, corpus_index), "w", newline="") as index_file:
+        csv.writer(index_file).writerows([["full_card_name", "offer_link", "toc_file", "agg_file", "toc_type"]] +
+                                         index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m scripts.benchmark_scraping",
+                                     description="Benchmarks scraping against a local copy of the card pages.")
+    parser.add_argument("--corpus", default=corpus_directory, help="the corpus folder")
+    parser.add_argument("--build", action="store_true", help="render the corpus from CreditCardCardRaw - Main.csv")
+    parser.add_argument("--save-live", metavar="INPUT_CSV", help="download the live pages of an input csv file")
+    parser.add_argument("--parsers", action="store_true", help="benchmark the scrapers on the saved pages only")
+    parser.add_argument("--mode", choices=["serial", "mass_scrape", "pipeline"], nargs="+", default=["serial"])
+    parser.add_argument("--latency", type=float, default=0.05, help="average seconds before a response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum seconds a delay differs from latency")
+    parser.add_argument("--limit", type=int, help="number of cards")
+    parser.add_argument("--fetch-workers", type=int, default=8)
+    parser.add_argument("--extract-workers", type=int, default=2)
+    parser.add_argument("--clean-workers", type=int, default=2)
+    parser.add_argument("--trace-memory", action="store_true", help="measure the peak python memory (slower)")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the scrapers")
+    parser.add_argument("--cassette", help="replay the pages of --input from this cassette instead of the corpus")
+    parser.add_argument("--input", help="with --cassette, the input csv file of the recorded run")
+    parser.add_argument("--replay-latency", default="original",
+                        help="with --cassette, 'original', 'none', or a number of seconds per response")
+    parser.add_argument("--save-baseline", help="write the result of the (last) mode to this json file")
+    parser.add_argument("--baseline", help="fail if the result regressed from the result in this json file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="fraction the throughput may drop")
+    args = parser.parse_args(sys.argv[1:])
+    if args.cassette and not args.input:
+        parser.error("--cassette requires --input")
+
+    if args.build:
+        print("Built a corpus of {} cards.".format(build_corpus(args.corpus, limit=args.limit)))
+    elif args.save_live:
+        print("Saved the pages of {} cards.".format(save_live_corpus(args.save_live, args.corpus)))
+    elif args.parsers:
+        for scraper, timing in benchmark_parsers(args.corpus, limit=args.limit).items():
+            print("{:<32} {pages:>4} pages {seconds:>8.3f} s {ms_per_page:>8.2f} ms/page".format(scraper, **timing))
+    else:
+        benchmark_result = None
+        for benchmark_mode in args.mode:
+            if args.cassette:
+                from scrape_to_dict.cassette import parse_latency
+                benchmark_result = benchmark_replay(
+                    args.cassette, args.input, benchmark_mode, parse_latency(args.replay_latency), args.jitter,
+                    args.limit, args.fetch_workers, args.extract_workers, args.clean_workers, args.trace_memory,
+                    args.verbose)
+            else:
+                benchmark_result = benchmark_end_to_end(
+                    args.corpus, benchmark_mode, args.latency, args.jitter, args.limit, args.fetch_workers,
+                    args.extract_workers, args.clean_workers, args.trace_memory, args.verbose)
+            print(report_end_to_end(benchmark_result))
+
+        if args.save_baseline:
+            with open(args.save_baseline, "w") as baseline_file:
+                json.dump(benchmark_result, baseline_file, indent=1, sort_keys=True)
+        if args.baseline:
+            with open(args.baseline, "r") as baseline_file:
+                found = check_regression(benchmark_result, json.load(baseline_file), args.tolerance)
+            for regression in found:
+                print("Regression: " + regression)
+            sys.exit(1 if found else 0)
@@ -0,0 +1,172 @@
+"""
+benchmark_simple_clean.py
+~~~
+Checks that the single pass simple_clean in clean_up_terms.py gives the exact same output as the original multi pass
+version over a saved corpus of terms, then benchmarks both versions. The corpus is every cell in the csv files in
+csv_files (scraped terms, values, and phrases), plus a few hand written edge cases.
+"""
+
+import csv
+import os
+import re
+import timeit
+from typing import List
+
+from term_processor import clean_up_terms
+
+current_directory = os.path.dirname(os.path.realpath(__file__))
+corpus_csv_files = [
+    os.path.join(current_directory, "csv_files/CreditCardCardRaw - Main.csv"),
+    os.path.join(current_directory, "csv_files/2017 Processed Credit Card Data (from VoiceCard_raw) - Sheet1.csv"),
+    os.path.join(current_directory, "csv_files/credit_card_phrases.csv"),
+]
+
+# Hand written terms that exercise each spacing rule and the edge cases of the trailing character removal
+edge_case_terms = [
+    "Up to $40",
+    "None",
+    "$0.Terms Apply",
+    "13.99%to 23.99%,based on your creditworthiness.",
+    "See terms:apply\nnow&nbsp;today*",
+    "aBcD1e2$3f:g%h4i",
+    "0% intro APR on purchases for 15months.After that,17.49%-28.24%.",
+    "  spaced   out \n\n text .",
+    "TermsApply",
+    "Terms  Apply introductory APR",
+    ".",
+    "*",
+    "\n",
+]
+
+
+def reference_simple_clean(term: str) -> str:
+    """
+    The original multi pass simple_clean, kept as the reference the single pass version is checked against.
+
+    Args:
+        term (str): The string to fix.
+    Returns:
+         str: Fixed string.
+    """
+    answer = term
+
+    if term == "" or term == " ":
+        return ""
+
+    answer = answer.replace("\n", " ")
+    answer = answer.replace("&nbsp;", "")
+
+    answer = re.sub(r"\.[A-Z]", __add_space, answer)
+    answer = re.sub(r"\,[a-zA-Z]", __add_space, answer)
+
+    answer = re.sub(r"[a-z][A-Z]", __add_space, answer)
+    answer = re.sub(r"[a-z]\d", __add_space, answer)
+    answer = re.sub(r"[a-z]\$", __add_space, answer)
+    answer = re.sub(r":\w", __add_space, answer)
+    answer = re.sub(r"\d[a-zA-Z]", __add_space, answer)
+    answer = re.sub(r"%[a-zA-Z]", __add_space, answer)
+
+    last_index = len(answer) - 1
+    last_char = answer[last_index]
+    if last_char == "." or last_char == "*":
+        answer = answer[:last_index]
+
+    answer = re.sub(r" +", " ", answer)
+
+    answer = re.sub("Terms Apply", "", answer)
+    answer = re.sub(r" introductory APR", "", answer)
+
+    if answer == "" or answer.isspace():
+        return ""
+
+    return answer
+
+
+def __add_space(matchobj) -> str:
+    current_str = matchobj.group(0)
+    return current_str[:1] + " " + current_str[1:]
+
+
+def load_corpus() -> List[str]:
+    """
+    Loads every distinct non empty cell in the corpus csv files.
+
+    Returns:
+        List[str]: The list of terms.
+    """
+    terms = set(edge_case_terms)
+    for csv_path in corpus_csv_files:
+        with open(csv_path, "r", newline="", encoding="utf-8", errors="replace") as csv_file:
+            for row in csv.reader(csv_file):
+                terms.update(cell for cell in row if cell)
+    return sorted(terms)
+
+
+def check_equivalence(terms: List[str]) -> int:
+    """
+    Compares the output (or the raised exception) of both versions of simple_clean on every term.
+
+    Args:
+        terms (List[str]): The corpus of terms.
+    Returns:
+        int: The number of terms where the outputs differ.
+    """
+    mismatches = 0
+    for term in terms:
+        expected = __call(reference_simple_clean, term)
+        actual = __call(clean_up_terms.simple_clean.__wrapped__, term)
+        if expected != actual:
+            mismatches += 1
+            print("Mismatch for " + repr(term))
+            print("    expected " + repr(expected))
+            print("    actual   " + repr(actual))
+    return mismatches
+
+
+def __call(function, term: str):
+    try:
+        return function(term)
+    except Exception as e:
+        return type(e).__name__
+
+
+def benchmark(terms: List[str], repeat: int = 5) -> dict:
+    """
+    Times both versions of simple_clean over the whole corpus. The memo in front of simple_clean is bypassed so only
+    the regex work is measured.
+
+    Args:
+        terms (List[str]): The corpus of terms.
+        repeat (int): The number of timing runs. The best run is reported.
+    Returns:
+        dict: The best time in seconds of each version and the speedup.
+    """
+    terms = [term for term in terms if term.replace("&nbsp;", "").replace("\n", "")]
+    single_pass = clean_up_terms.simple_clean.__wrapped__
+
+    def run_reference():
+        for term in terms:
+            reference_simple_clean(term)
+
+    def run_single_pass():
+        for term in terms:
+            single_pass(term)
+
+    reference_time = min(timeit.repeat(run_reference, number=1, repeat=repeat))
+    single_pass_time = min(timeit.repeat(run_single_pass, number=1, repeat=repeat))
+    return {
+        "terms": len(terms),
+        "reference_seconds": reference_time,
+        "single_pass_seconds": single_pass_time,
+        "speedup": reference_time / single_pass_time,
+    }
+
+
+if __name__ == "__main__":
+    corpus = load_corpus()
+    print("Loaded {} terms.".format(len(corpus)))
+    if check_equivalence(corpus):
+        raise SystemExit("simple_clean output differs from the reference implementation.")
+    print("Outputs are identical.")
+    print("{terms} terms: reference {reference_seconds:.4f}s, single pass {single_pass_seconds:.4f}s, "
+          "{speedup:.2f}x speedup".format(**benchmark(corpus)))
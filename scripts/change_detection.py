@@ -0,0 +1,204 @@
+"""
+change_detection.py
+~~~
+Skips the extraction of cards whose disclosure pages have not changed since the previous run. The visible text of a
+card's TOC and agg pages is normalized (unicode forms and whitespace) and hashed, and the hash is kept in a json
+manifest along with the scraped and processed result of the card. When a card's hash matches the previous run, its
+previous results are reused, so only changed cards go through general_scraper, agg_scraper and term processing.
+
+Every card that is new, changed, or whose pages could not be fetched is listed in a csv file for manual review.
+Bump EXTRACTION_VERSION whenever the scrapers change, so every card is extracted again.
+
+Example:
+    changes = ChangeDetector()
+    mass_scrape(input_csv, 1, changes=changes)
+    changes.save()
+    changes.write_changes(changed_csv)
+"""
+
+import copy
+import os
+import re
+import threading
+import unicodedata
+from typing import List
+
+from instrumentation import metrics
+from scrape_to_dict.scrape_card import parse_card
+from scripts.csv_stream import BufferedCsvWriter
+from scripts.fingerprint_manifest import fingerprint, load_versioned_json, save_versioned_json
+from term_processor import term_cache
+
+current_directory = os.path.dirname(os.path.realpath(__file__))
+content_manifest_json = os.path.join(current_directory, "csv_files/credit_card_raw_scraped_manifest.json")
+changed_csv = os.path.join(current_directory, "csv_files/changed_cards.csv")
+
+# The version of the scrapers. Changing it makes every card count as changed.
+EXTRACTION_VERSION = "1"
+
+# The statuses of a card, compared with the previous run
+unchanged = "unchanged"
+changed = "changed"
+new = "new"
+fetch_failed = "fetch_failed"
+
+card_changes = metrics.counter("scraper_card_changes_total", "Cards by change since the previous run (unchanged, "
+                               "changed, new, fetch_failed).", ["status"])
+
+
+def normalize_text(text: str) -> str:
+    """
+    Returns the text with its unicode forms and whitespace normalized, so pages that only differ in formatting hash
+    the same. (None -> "")
+    """
+    if not text:
+        return ""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def content_fingerprint(toc_link: str, offer_link: str, agg_link: str, fetched: dict) -> str:
+    """
+    Returns the content hash of a card's fetched pages, or None if a page could not be fetched. The links are part of
+    the hash, so a card moved to another page counts as changed.
+
+    Args:
+        toc_link (str): The URL of the card's terms-and-conditions page.
+        offer_link (str): The URL of the offer link.
+        agg_link (str): The URL of the agg page.
+        fetched (dict): The text fetched by scrape_card.fetch_card.
+    Returns:
+        str: The hex digest.
+    """
+    if fetched.get("toc_error") or fetched.get("agg_error"):
+        return None
+    return fingerprint([toc_link, offer_link, agg_link, normalize_text(fetched.get("toc_text")),
+                        normalize_text(fetched.get("agg_text"))])
+
+
+class ChangeDetector:
+    """
+    A json backed mapping of card name to the content hash of its pages and the results extracted from them. Safe
+    to share between scraper threads.
+    """
+
+    def __init__(self, path: str = content_manifest_json, version: str = EXTRACTION_VERSION):
+        """
+        Loads the manifest at path. If the file does not exist, or was written with another version, every card
+        counts as new.
+
+        Args:
+            path (str): The path to the json manifest.
+            version (str): The version of the scrapers.
+        """
+        self.path = path
+        self.version = version
+        self.cards = load_versioned_json(path, version).get("cards", dict())
+        self.statuses = dict()
+        self._reused = set()
+        self._lock = threading.Lock()
+
+    def extract(self, card_name: str, toc_link: str, offer_link: str, agg_link: str, fetched: dict) -> dict:
+        """
+        Returns the scraped attributes of a card. If its pages have the same content as in the previous run, the
+        previous result is reused, otherwise the fetched text is scraped with scrape_card.parse_card.
+
+        Args:
+            card_name (str): The name of the card.
+            toc_link (str): The URL of the card's terms-and-conditions page.
+            offer_link (str): The URL of the offer link.
+            agg_link (str): The URL of the agg page.
+            fetched (dict): The text fetched by scrape_card.fetch_card.
+        Returns:
+            dict: The final dictionary of terms and values for each attribute of the card.
+        """
+        key = card_name.strip()
+        card_fingerprint = content_fingerprint(toc_link, offer_link, agg_link, fetched)
+        with self._lock:
+            previous = self.cards.get(key)
+
+        if card_fingerprint is None:
+            status = fetch_failed
+        elif previous is None:
+            status = new
+        elif previous["fingerprint"] != card_fingerprint:
+            status = changed
+        else:
+            status = unchanged
+        card_changes.inc(status=status)
+
+        if status == unchanged:
+            print("Pages of {} are unchanged, reusing the previous extraction.".format(key))
+            with self._lock:
+                self.statuses[key] = (status, toc_link, agg_link)
+                self._reused.add(key)
+            return copy.deepcopy(previous["scraped"])
+
+        scraped = parse_card(card_name, toc_link, offer_link, agg_link, fetched)
+        with self._lock:
+            self.statuses[key] = (status, toc_link, agg_link)
+            # a card whose pages failed keeps its last good result, to compare the next run against
+            if card_fingerprint is not None:
+                self.cards[key] = {"fingerprint": card_fingerprint, "scraped": copy.deepcopy(scraped)}
+        return scraped
+
+    def previous_processed(self, card_name: str) -> dict:
+        """
+        Returns the processed result of a card whose previous extraction was reused, if it was processed with the
+        current term processing rules. None if the card has to be processed.
+        """
+        key = card_name.strip()
+        with self._lock:
+            previous = self.cards.get(key)
+            if key not in self._reused or previous is None or \
+                    previous.get("rules_version") != term_cache.RULES_VERSION:
+                return None
+            return copy.deepcopy(previous.get("processed"))
+
+    def record_processed(self, card_name: str, processed: dict):
+        """
+        Records the processed result of a card, so it can be reused with its extraction.
+        """
+        key = card_name.strip()
+        with self._lock:
+            if key in self.cards:
+                self.cards[key]["processed"] = copy.deepcopy(processed)
+                self.cards[key]["rules_version"] = term_cache.RULES_VERSION
+
+    def changed_cards(self) -> List[tuple]:
+        """
+        Returns the (card name, status, toc link, agg link) of every card of the run that was not unchanged, by name.
+        """
+        with self._lock:
+            return sorted((key,) + status for key, status in self.statuses.items() if status[0] != unchanged)
+
+    def summary(self) -> str:
+        """
+        Returns the number of cards of the run in every status.
+        """
+        with self._lock:
+            statuses = [status[0] for status in self.statuses.values()]
+        return ", ".join("{} {}".format(statuses.count(status), status)
+                         for status in [unchanged, changed, new, fetch_failed])
+
+    def write_changes(self, dest_csv: str = changed_csv) -> int:
+        """
+        Writes the cards that are new, changed, or failed to fetch to a csv file, for manual review.
+
+        Args:
+            dest_csv (str): The csv file. Overwritten if it exists.
+        Returns:
+            int: The number of cards written.
+        """
+        cards = self.changed_cards()
+        with BufferedCsvWriter(dest_csv, mode="w", flush_every=0) as csv_writer:
+            csv_writer.writerow(["full_card_name", "status", "toc_link", "agg_link"])
+            for card in cards:
+                csv_writer.writerow(list(card))
+        return len(cards)
+
+    def save(self):
+        """
+        Writes the manifest to disk. (see save_versioned_json)
+        """
+        with self._lock:
+            save_versioned_json(self.path, self.version, {"cards": self.cards})
@@ -0,0 +1,354 @@
+"""
+cli.py
+~~~
+Command line entry point for the pipeline jobs, so they can be run and tuned from a scheduler without editing the
+scripts. Run from the CreditCardScraper folder:
+
+    python -m scripts.cli scrape --input csv_files/InputCreditCardsExample.csv --start-index 1
+    python -m scripts.cli scrape --pipeline --fetch-workers 16 --shard 1/4
+    python -m scripts.cli merge --inputs shard_1.csv shard_2.csv shard_3.csv shard_4.csv --order cards.csv
+    python -m scripts.cli process --incremental
+    python -m scripts.cli generate --workers 4 --format jsonl --output phrases.jsonl
+    python -m scripts.cli load --input "csv_files/CreditCardCardRaw - Main.csv" --table CreditCardCardRaw
+
+Every subcommand imports its job when it runs, so loading DynamoDB doesn't import selenium and the other way around.
+Add --timings to print how long every stage took per card, and --profile-slowest N to keep the cProfile output of the
+slowest cards. (see instrumentation/timing.py) Add --metrics-port or --metrics-file to watch live counters and
+histograms of the run in Prometheus format. (see instrumentation/metrics.py)
+
+Scrape with --cassette PATH --cassette-mode record to keep every fetched page, then replay the same run offline:
+
+    python -m scripts.cli scrape --cassette cassettes/run.zip --cassette-mode replay --replay-latency original
+"""
+
+import argparse
+import os
+import sys
+from contextlib import contextmanager
+from typing import List
+
+current_directory = os.path.dirname(os.path.realpath(__file__))
+csv_files = os.path.join(current_directory, "csv_files")
+
+
+def scrape(args: argparse.Namespace):
+    """
+    Scrapes the cards of the input csv file. (see run_scraping_script.mass_scrape and scrape_pipeline.run_pipeline)
+    With --cassette, the fetched pages are recorded to or replayed from a cassette. (see scrape_to_dict/cassette.py)
+    """
+    if not args.cassette:
+        __scrape(args)
+        return
+
+    from scrape_to_dict.cassette import use_cassette
+    with use_cassette(args.cassette, args.cassette_mode, args.replay_latency, args.replay_jitter):
+        __scrape(args)
+
+
+def __scrape(args: argparse.Namespace):
+    with __open_store(args) as store:
+        __scrape_with_store(args, store)
+
+
+def __scrape_with_store(args: argparse.Namespace, store):
+    changes = None
+    changes_output = None
+    if args.detect_changes:
+        # the defaults are the module's, resolved here so building the parser doesn't import the scrapers
+        from scripts import change_detection
+        changes = change_detection.ChangeDetector(args.content_manifest or change_detection.content_manifest_json)
+        changes_output = args.changes_output or change_detection.changed_csv
+
+    if args.pipeline:
+        from scripts.convert_csv import f2
+        from scripts.scrape_pipeline import run_pipeline
+        run_pipeline(args.input, args.start_index, raw_csv=args.output or f2, dest_csv=args.processed_output,
+                     fetch_workers=args.fetch_workers, extract_workers=args.extract_workers,
+                     clean_workers=args.clean_workers, queue_size=args.queue_size, store=store, run_id=args.run_id,
+                     flush_every=args.flush_every, shard=args.shard, budget=args.card_budget, changes=changes)
+    else:
+        from scripts.run_scraping_script import mass_scrape, resume_scrape
+        if args.resume:
+            resume_scrape(args.run_id, store=store, max_attempts=args.max_attempts, budget=args.card_budget,
+                          changes=changes)
+        else:
+            mass_scrape(args.input, args.start_index, dest_csv=args.output, flush_every=args.flush_every,
+                        store=store, run_id=args.run_id, max_attempts=args.max_attempts, shard=args.shard,
+                        budget=args.card_budget, changes=changes)
+
+    if changes is not None:
+        changes.save()
+        written = changes.write_changes(changes_output)
+        print("Changes since the previous run: {}. {} cards to review in {}".format(changes.summary(), written,
+                                                                                  changes_output))
+
+
+def process(args: argparse.Namespace):
+    """
+    Extracts the values and numbers of the scraped cards. (see term_processing_script)
+    """
+    from term_processor import term_cache
+    from scripts import term_processing_script
+
+    term_cache.set_enabled(args.cache == "on")
+    source = args.input or os.path.join(csv_files, "credit_card_raw_scraped.csv")
+    if args.store:
+        with __open_store(args) as store:
+            term_processing_script.term_process_store(store, args.source_run_id, args.run_id, dest_csv=args.output)
+    elif args.incremental:
+        term_processing_script.term_process_incremental(args.output, args.start_index, args.manifest,
+                                                        columnar_npy=args.columnar_npy, source=source)
+    else:
+        term_processing_script.term_process(args.output, args.start_index, flush_every=args.flush_every or 100,
+                                            columnar_npy=args.columnar_npy, source=source, shard=args.shard)
+
+
+def generate(args: argparse.Namespace):
+    """
+    Generates the phrases of the cards in DynamoDB. (see phrase_generation_script.generate_all)
+    """
+    from phrase_generation import generator
+    from scripts.dynamodb_io import dynamodb_client
+    from scripts.phrase_generation_script import generate_all
+
+    if args.refresh_images:
+        generator.image_index.invalidate()
+    client = dynamodb_client(args.endpoint_url, args.region)
+    with __open_store(args) as store:
+        generate_all(client, workers=args.workers, output_format=args.format, dest=args.output, mode=args.mode,
+                     chunk_size=args.chunk_size, flush_every=args.flush_every, card_names=args.cards,
+                     incremental=args.incremental, manifest_path=args.manifest, store=store, run_id=args.run_id,
+                     shard=args.shard)
+
+
+def load(args: argparse.Namespace):
+    """
+    Loads a csv file into a DynamoDB table. (see dynamodb.load_csv)
+    """
+    from scripts.dynamodb import load_csv
+    from scripts.dynamodb_io import dynamodb_client
+
+    client = dynamodb_client(args.endpoint_url, args.region)
+    load_csv(args.input, args.table, workers=args.workers, client=client)
+
+
+def merge(args: argparse.Namespace):
+    """
+    Combines the scraped csv files of several shards into one ordered, deduplicated file. (see sharding.merge_shards)
+    """
+    from scripts.sharding import merge_shards
+    merge_shards(args.inputs, args.output, order_csv=args.order)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Returns the parser of the command line arguments.
+    """
+    from scripts.sharding import parse_shard
+
+    def shard_type(value: str):
+        try:
+            return parse_shard(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
+    def replay_latency_type(value: str):
+        from scrape_to_dict.cassette import parse_latency
+        try:
+            return parse_latency(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
+    parser = argparse.ArgumentParser(prog="python -m scripts.cli", description="Credit card scraping pipeline jobs.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    # arguments shared by several subcommands
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--shard", type=shard_type, help="only run the Nth of M shards of the cards, written N/M")
+    common.add_argument("--timings", action="store_true", help="time every stage of every card and print a summary")
+    common.add_argument("--timings-output", help="also write the timing record of every card to this json lines file")
+    common.add_argument("--profile-slowest", type=int, default=0, metavar="N",
+                        help="run every card under cProfile and keep the profiles of the N slowest")
+    common.add_argument("--profile-dir", default="profiles", help="with --profile-slowest, where the .prof files go")
+    common.add_argument("--metrics-port", type=int, help="serve live metrics in Prometheus format on this local port")
+    common.add_argument("--metrics-file", help="write the metrics in Prometheus format to this file periodically")
+    common.add_argument("--metrics-interval", type=float, default=15, help="seconds between two metrics file writes")
+    store = argparse.ArgumentParser(add_help=False)
+    store.add_argument("--store", nargs="?", const=os.path.join(csv_files, "pipeline.db"),
+                       help="also write to the SQLite pipeline store (default path if no path is given)")
+    store.add_argument("--run-id", help="the run id of the records in the store")
+    dynamodb = argparse.ArgumentParser(add_help=False)
+    dynamodb.add_argument("--endpoint-url", help="the DynamoDB endpoint, ie. a local DynamoDB")
+    dynamodb.add_argument("--region", help="the AWS region (default: the region configured for AWS)")
+
+    from scripts.convert_csv import f2
+
+    scrape_parser = subparsers.add_parser("scrape", parents=[common, store], help="scrape the cards of a csv file")
+    scrape_parser.set_defaults(function=scrape)
+    scrape_parser.add_argument("--flush-every", type=int, default=1,
+                               help="cards buffered before the output is flushed")
+    scrape_parser.add_argument("--input", default=os.path.join(csv_files, "InputCreditCardsExample.csv"),
+                               help="csv file of card names and links")
+    scrape_parser.add_argument("--start-index", type=int, default=1, help="row of the input csv file to start from")
+    scrape_parser.add_argument("--output", help="csv file the scraped data is appended to (default: "
+                                                "credit_card_raw_scraped.csv). Required with --store, which "
+                                                "replaces it with the cards of the run")
+    scrape_parser.add_argument("--resume", action="store_true", help="resume a journaled run (requires --store)")
+    scrape_parser.add_argument("--max-attempts", type=int, default=3, help="attempts per card in a journaled run")
+    scrape_parser.add_argument("--card-budget", type=float, default=120,
+                               help="seconds a card may spend fetching its pages before it is cancelled")
+    scrape_parser.add_argument("--cassette", help="record the fetched pages to, or replay them from, this archive")
+    scrape_parser.add_argument("--cassette-mode", choices=["record", "replay"], default="replay",
+                               help="with --cassette, record from the network or replay offline")
+    scrape_parser.add_argument("--replay-latency", type=replay_latency_type, default="original",
+                               help="with --cassette-mode replay, 'original' to wait as long as the recorded "
+                                    "responses took, 'none', or a number of seconds per response")
+    scrape_parser.add_argument("--replay-jitter", type=float, default=0.0,
+                               help="with --cassette-mode replay, maximum seconds a delay differs from the latency")
+    scrape_parser.add_argument("--detect-changes", action="store_true",
+                               help="reuse the previous extraction of cards whose pages are unchanged")
+    scrape_parser.add_argument("--content-manifest",
+                               help="with --detect-changes, the manifest of page hashes and extractions (default: "
+                                    "change_detection.content_manifest_json)")
+    scrape_parser.add_argument("--changes-output", help="with --detect-changes, csv file listing the new and changed "
+                                                        "cards to review (default: change_detection.changed_csv)")
+    scrape_parser.add_argument("--pipeline", action="store_true",
+                               help="scrape and process in one staged pipeline (see scrape_pipeline.py)")
+    scrape_parser.add_argument("--processed-output", default=os.path.join(csv_files, "credit_card_raw_processed.csv"),
+                               help="with --pipeline, csv file the processed data is written to")
+    scrape_parser.add_argument("--fetch-workers", type=int, default=8, help="with --pipeline, pages fetched at once")
+    scrape_parser.add_argument("--extract-workers", type=int, default=2, help="with --pipeline, extraction workers")
+    scrape_parser.add_argument("--clean-workers", type=int, default=2, help="with --pipeline, term cleaning workers")
+    scrape_parser.add_argument("--queue-size", type=int, default=16, help="with --pipeline, cards between two stages")
+
+    process_parser = subparsers.add_parser("process", parents=[common, store],
+                                           help="extract the values and numbers of scraped cards")
+    process_parser.set_defaults(function=process)
+    process_parser.add_argument("--flush-every", type=int,
+                                help="cards buffered before the output is flushed (default: 100, not with --store "
+                                     "or --incremental)")
+    process_parser.add_argument("--input", help="csv file with the scraped data (default: "
+                                                "credit_card_raw_scraped.csv, not with --store)")
+    process_parser.add_argument("--start-index", type=int, default=0, help="row of the input csv file to start from")
+    process_parser.add_argument("--output", default=os.path.join(csv_files, "credit_card_raw_processed.csv"),
+                                help="csv file the processed data is written to")
+    process_parser.add_argument("--cache", choices=["on", "off"], default="on", help="memoize the term cleaning")
+    process_parser.add_argument("--incremental", action="store_true", help="only process new or changed cards")
+    process_parser.add_argument("--manifest", help="with --incremental, the manifest of row fingerprints",
+                                default=os.path.join(csv_files, "credit_card_raw_processed_manifest.json"))
+    process_parser.add_argument("--columnar-npy", help="also export the numbers to this .npy file")
+    process_parser.add_argument("--source-run-id", help="with --store, the run id of the scraped records")
+
+    generate_parser = subparsers.add_parser("generate", parents=[common, store, dynamodb],
+                                            help="generate the phrases of the cards in DynamoDB")
+    generate_parser.set_defaults(function=generate)
+    generate_parser.add_argument("--flush-every", type=int, default=100,
+                                 help="cards buffered before the output is flushed")
+    generate_parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    generate_parser.add_argument("--chunk-size", type=int, default=8, help="cards sent to a worker at a time")
+    generate_parser.add_argument("--format", choices=["csv", "jsonl"], default="csv", help="output format")
+    generate_parser.add_argument("--output", help="file the phrases are written to (default: credit_card_phrases.csv, "
+                                                  "or credit_card_phrases.jsonl with --format jsonl)")
+    generate_parser.add_argument("--mode", choices=["a", "w"], default="a", help="append to or overwrite the output")
+    generate_parser.add_argument("--cards", nargs="+", help="only generate these cards")
+    generate_parser.add_argument("--incremental", action="store_true", help="only generate cards whose inputs changed")
+    generate_parser.add_argument("--manifest", default=os.path.join(csv_files, "credit_card_phrases_manifest.json"),
+                                 help="with --incremental, the manifest of input fingerprints")
+    generate_parser.add_argument("--refresh-images", action="store_true", help="list the S3 card images again")
+
+    load_parser = subparsers.add_parser("load", parents=[dynamodb], help="load a csv file into a DynamoDB table")
+    load_parser.set_defaults(function=load)
+    load_parser.add_argument("--input", default=os.path.join(csv_files, "CreditCardCardRaw - Main.csv"),
+                             help="csv file whose first row has the attribute titles")
+    load_parser.add_argument("--table", default="CreditCardCardRaw", help="the DynamoDB table")
+    load_parser.add_argument("--workers", type=int, default=4, help="threads sending batches")
+
+    merge_parser = subparsers.add_parser("merge", help="merge the scraped csv files of several shards")
+    merge_parser.set_defaults(function=merge)
+    merge_parser.add_argument("--inputs", nargs="+", required=True,
+                              help="csv files written by the shards, a card found twice is kept from the last file")
+    merge_parser.add_argument("--order", help="input csv file the cards are ordered by (default: by name)")
+    merge_parser.add_argument("--output", default=f2, help="csv file the merged data is written to")
+
+    return parser
+
+
+def main(argv: List[str] = None):
+    """
+    Runs the subcommand given on the command line.
+
+    Args:
+        argv (List[str]): The arguments. Defaults to sys.argv.
+    """
+    args = build_parser().parse_args(argv)
+    if getattr(args, "resume", False) and not args.store:
+        build_parser().error("--resume requires --store")
+    if args.command == "process" and (args.store or args.incremental):
+        # these modes read and rewrite every card, they would silently ignore the options instead of honouring them
+        mode = "--store" if args.store else "--incremental"
+        for option, value in [("--shard", args.shard), ("--flush-every", args.flush_every),
+                              ("--input", args.input if args.store else None)]:
+            if value is not None:
+                build_parser().error("process {} does not support {}".format(mode, option))
+    if args.command == "scrape" and args.store and not (args.resume or args.pipeline or args.output):
+        # a journaled run replaces its output with the cards of the run, never default to the shared scraped csv
+        build_parser().error("scrape --store requires --output, the file is replaced with the cards of the run")
+
+    timed_run = getattr(args, "timings", False) or getattr(args, "timings_output", None) or \
+        getattr(args, "profile_slowest", 0)
+    if timed_run:
+        from instrumentation import timing
+        timing.configure(enabled=True, profile_slowest=args.profile_slowest)
+
+    metrics_server = None
+    stop_metrics_writer = None
+    if getattr(args, "metrics_port", None) is not None or getattr(args, "metrics_file", None):
+        from instrumentation import metrics
+        if args.metrics_port is not None:
+            metrics_server = metrics.serve(args.metrics_port)
+        if args.metrics_file:
+            stop_metrics_writer = metrics.write_periodically(args.metrics_file, args.metrics_interval)
+
+    try:
+        args.function(args)
+    finally:
+        if stop_metrics_writer is not None:
+            stop_metrics_writer()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+    if timed_run:
+        __report_timings(args)
+
+
+def __report_timings(args: argparse.Namespace):
+    """
+    Prints the timing summary of the run, and writes the records and profiles that were asked for.
+    """
+    from instrumentation import timing
+
+    print(timing.run_timings.report())
+    if args.timings_output:
+        timing.run_timings.write_records(args.timings_output)
+        print("Wrote the timing records to " + args.timings_output)
+    if args.profile_slowest:
+        for path in timing.run_timings.write_profiles(args.profile_dir):
+            print("Wrote profile " + path)
+
+
+@contextmanager
+def __open_store(args: argparse.Namespace):
+    """
+    Opens the pipeline store given with --store (or yields None), and closes it once the job is done, so the SQLite
+    write-ahead log is checkpointed.
+    """
+    if not getattr(args, "store", None):
+        yield None
+        return
+    from scripts.pipeline_store import PipelineStore
+    with PipelineStore(args.store) as store:
+        yield store
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
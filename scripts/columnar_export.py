@@ -0,0 +1,114 @@
+"""
+columnar_export.py
+~~~
+Exports the numbers extracted by second_clean.py from the processed csv file (credit_card_raw_processed.csv) into a
+typed columnar file. The file is a NumPy structured array saved as .npy, with one float64 column per numeric
+attribute and missing or unparsable numbers stored as NaN. Comparison and scoring jobs can memory map it with
+load_numbers and run vectorized queries instead of re-parsing the csv text.
+
+Example:
+    numbers = load_numbers("csv_files/credit_card_raw_processed.npy")
+    no_fee_cards = numbers["full_card_name"][numbers["annual_fee"] == 0]
+"""
+
+import math
+import os
+
+import numpy as np
+
+from scripts.convert_csv import column_widths, csv_layout
+from scripts.csv_stream import read_csv_rows
+
+# Maximum number of characters kept from the full card name
+card_name_length = 128
+
+
+def processed_csv_layout() -> dict:
+    """
+    Returns the column index of every numeric attribute in a row written by convert_csv_row. The columns come from
+    convert_csv.csv_layout: the number of an attribute follows its term and value, and credit_score has a low and a
+    high number.
+
+    Returns:
+        dict: Mapping of column name (ie. "annual_fee", "credit_score_low") to its index in the csv row.
+    """
+    widths = column_widths()
+    layout = dict()
+    for attribute, start in csv_layout().items():
+        if attribute == "credit_score":
+            layout["credit_score_low"] = start + 2
+            layout["credit_score_high"] = start + 3
+        elif widths[attribute] == 3:
+            layout[attribute] = start + 2
+    return layout
+
+
+# The numeric columns of the exported array, in csv order
+numeric_columns = list(processed_csv_layout().keys())
+
+# The dtype of the exported structured array
+numbers_dtype = np.dtype([("full_card_name", "U" + str(card_name_length))] +
+                         [(column, np.float64) for column in numeric_columns])
+
+
+def parse_number(text: str) -> float:
+    """
+    Converts a number written by second_clean into a float. Empty strings, the -1 returned when a percentage could not
+    be extracted, and anything that is not a number become NaN.
+
+    Args:
+        text (str): The number as written in the csv file. (ie. "23.99", "", "-1")
+    Returns:
+        float: The number, or NaN if missing.
+    """
+    try:
+        number = float(text)
+    except (TypeError, ValueError):
+        return math.nan
+
+    if number == -1:
+        return math.nan
+    return number
+
+
+def export_processed_csv(processed_csv: str, dest_npy: str, starting_index: int = 0) -> int:
+    """
+    Reads the processed csv file and writes the numbers of every card into a .npy structured array. The file is
+    replaced atomically.
+
+    Args:
+        processed_csv (str): The path to the processed csv file.
+        dest_npy (str): The path to the .npy file to write.
+        starting_index (int): The starting row index in the processed csv file. (1 if it has attribute titles)
+    Returns:
+        int: The number of cards exported.
+    """
+    layout = list(processed_csv_layout().values())
+    records = []
+    for row in read_csv_rows(processed_csv, starting_index):
+        if not row:
+            continue
+        numbers = tuple(parse_number(row[index]) if index < len(row) else math.nan for index in layout)
+        records.append((row[0].strip()[:card_name_length],) + numbers)
+
+    numbers_array = np.array(records, dtype=numbers_dtype)
+    temp_npy = dest_npy + ".tmp"
+    with open(temp_npy, "wb") as npy_file:
+        np.save(npy_file, numbers_array)
+    os.replace(temp_npy, dest_npy)
+
+    print("Exported numbers for {} cards to {}".format(len(records), dest_npy))
+    return len(records)
+
+
+def load_numbers(npy_path: str, mmap: bool = True) -> np.ndarray:
+    """
+    Loads an exported structured array. By default the file is memory mapped read only.
+
+    Args:
+        npy_path (str): The path to the .npy file.
+        mmap (bool): Whether to memory map the file instead of reading it into memory.
+    Returns:
+        np.ndarray: The structured array, with one field per column in numbers_dtype.
+    """
+    return np.load(npy_path, mmap_mode="r" if mmap else None)
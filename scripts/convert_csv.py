@@ -81,36 +81,7 @@ def convert_csv(data_dict: dict, dest_csv: str=f2) -> str:
     """
     with open(dest_csv, "a", newline="") as csv_file:
         csv_writer = csv.writer(csv_file)
-
-        # add all of the term and values into data_list
-        data_list = []
-        for attribute in attributes_order:
-            example_data = card_dict.get(attribute)
-            try:
-                data = data_dict.get(attribute)
-                if type(data) == dict:  # the data is a dictionary with keys "term" and "value"
-                    # if the attribute is a credit score, value is instead value_low and value_high
-                    term = data.get("term")
-                    value = data.get("value")
-                    data_list.append(term)
-                    data_list.append(value)
-                    if attribute == "credit_score":
-                        data_list.append(data.get("low_number"))
-                        data_list.append(data.get("high_number"))
-                    elif "number" in data.keys():
-                        # rubber band fix. for some reason, intro_apr_check has "number" in it even though
-                        # it shouldn't
-                        if attribute != "intro_apr_check":
-                            data_list.append(data.get("number"))
-                elif type(data) == str:
-                    data_list.append(data)
-            except KeyError:  # the given attribute could not be found during the scraping
-                # insert "" empty strings in place of the data for the attribute
-                if type(example_data) == dict:
-                    data_list.append("")
-                    data_list.append("")
-                else:
-                    data_list.append("")
+        data_list = convert_csv_row(data_dict)
         print(data_list)
 
         csv_writer.writerow(data_list)
@@ -118,6 +89,109 @@ def convert_csv(data_dict: dict, dest_csv: str=f2) -> str:
     return "Success"
 
 
+def convert_csv_row(data_dict: dict) -> list:
+    """
+    Formats the data in data_dict into a single csv row, in the order of attributes_order. See convert_csv.
+
+    Args:
+        data_dict (dict): The data to be formatted.
+    Returns:
+        list: The csv row.
+    """
+    # add all of the term and values into data_list
+    data_list = []
+    for attribute in attributes_order:
+        example_data = card_dict.get(attribute)
+        try:
+            data = data_dict.get(attribute)
+            if type(data) == dict:  # the data is a dictionary with keys "term" and "value"
+                # if the attribute is a credit score, value is instead value_low and value_high
+                term = data.get("term")
+                value = data.get("value")
+                data_list.append(term)
+                data_list.append(value)
+                if attribute == "credit_score":
+                    data_list.append(data.get("low_number"))
+                    data_list.append(data.get("high_number"))
+                elif "number" in data.keys():
+                    # rubber band fix. for some reason, intro_apr_check has "number" in it even though
+                    # it shouldn't
+                    if attribute != "intro_apr_check":
+                        data_list.append(data.get("number"))
+            elif type(data) == str:
+                data_list.append(data)
+        except KeyError:  # the given attribute could not be found during the scraping
+            # insert "" empty strings in place of the data for the attribute
+            if type(example_data) == dict:
+                data_list.append("")
+                data_list.append("")
+            else:
+                data_list.append("")
+
+    return data_list
+
+
+def column_widths() -> dict:
+    """
+    Returns the number of columns every attribute takes in a row written by convert_csv_row, following the card
+    schema. A string attribute takes one column. An attribute with a term takes two columns (term, value) plus one
+    column per number. (credit_score has low_number and high_number)
+
+    Returns:
+        dict: Mapping of attribute name to its number of columns, in attributes_order.
+    """
+    widths = dict()
+    for attribute in attributes_order:
+        example_data = card_dict.get(attribute)
+        if type(example_data) != dict:
+            widths[attribute] = 1
+        elif attribute == "credit_score":
+            widths[attribute] = 4
+        elif "number" in example_data.keys() and attribute != "intro_apr_check":
+            widths[attribute] = 3
+        else:
+            widths[attribute] = 2  # term and value
+    return widths
+
+
+def csv_layout() -> dict:
+    """
+    Returns the column index of every attribute in a row written by convert_csv_row. (see column_widths)
+
+    Returns:
+        dict: Mapping of attribute name to the index of its first column. (ie. "annual_fee" -> 26)
+    """
+    layout = dict()
+    index = 0
+    for attribute, width in column_widths().items():
+        layout[attribute] = index
+        index += width
+    return layout
+
+
+def csv_row_to_dict(data_list: list) -> dict:
+    """
+    Reads a row written by convert_csv_row back into a dictionary keyed by attribute name, the inverse of
+    convert_csv_row for the columns of the card schema. Missing trailing columns are read as empty strings.
+
+    Args:
+        data_list (list): The csv row.
+    Returns:
+        dict: The attributes. Attributes with a term are dictionaries with keys "term" and "value".
+    """
+    def column(index: int) -> str:
+        return data_list[index] if index < len(data_list) else ""
+
+    data_dict = dict()
+    for attribute, index in csv_layout().items():
+        if type(card_dict.get(attribute)) == dict:
+            data_dict[attribute] = {"term": column(index), "value": column(index + 1)}
+        else:
+            data_dict[attribute] = column(index)
+
+    return data_dict
+
+
 def convert_csv_voice_responses(data_dict: dict, dest_csv: str=f) -> str:
     """
     Writes the data in data_dict to the dest_csv file. The data is the generated responses from
@@ -131,12 +205,7 @@ def convert_csv_voice_responses(data_dict: dict, dest_csv: str=f) -> str:
     """
     with open(dest_csv, "a", newline="") as csv_file:
         csv_writer = csv.writer(csv_file)
-
-        # add all of the term and values into data_list
-        data_list = []
-        for attribute in attributes_order_voice_responses:
-            data = data_dict.get(attribute)
-            data_list.append(data)
+        data_list = convert_csv_voice_responses_row(data_dict)
         print(data_list)
 
         csv_writer.writerow(data_list)
@@ -144,6 +213,19 @@ def convert_csv_voice_responses(data_dict: dict, dest_csv: str=f) -> str:
     return "Success"
 
 
+def convert_csv_voice_responses_row(data_dict: dict) -> list:
+    """
+    Formats the generated responses in data_dict into a single csv row, in the order of
+    attributes_order_voice_responses. See convert_csv_voice_responses.
+
+    Args:
+        data_dict (dict): The data to be formatted.
+    Returns:
+        list: The csv row.
+    """
+    return [data_dict.get(attribute) for attribute in attributes_order_voice_responses]
+
+
 def convert_csv_voice_responses_header(dest_csv: str=f) -> str:
     """
     Generates headers for the csv file for voice responses.
@@ -0,0 +1,140 @@
+"""
+csv_stream.py
+~~~
+Streaming csv helpers used by the scripts. Rows are read lazily one at a time instead of loading the whole file into
+memory, and output rows go through one long lived buffered writer instead of opening and closing the destination
+file for every card. BufferedJsonLinesWriter writes records as JSON Lines with the same flush policy.
+"""
+
+import csv
+import json
+import os
+import time
+from itertools import islice
+from typing import Iterator, List
+
+from instrumentation import metrics
+from instrumentation.timing import timed
+
+rows_written = metrics.counter("scraper_rows_written_total", "Rows written, by destination file or store table.",
+                               ["destination"])
+
+
+def read_csv_rows(source_csv: str, start_index: int = 0) -> Iterator[List[str]]:
+    """
+    Lazily yields the rows of a csv file, starting at start_index.
+
+    Args:
+        source_csv (str): The path to the csv file.
+        start_index (int): The integer row index to start from. (1 to skip the attribute titles)
+    Returns:
+        Iterator[List[str]]: The rows of the csv file.
+    """
+    with open(source_csv, "r", newline="") as csv_file:
+        yield from islice(csv.reader(csv_file), start_index, None)
+
+
+class BufferedCsvWriter:
+    """
+    Keeps the destination csv file open and buffers rows written to it. Use as a context manager, the file is
+    flushed and closed on exit.
+
+    The flush policy is configurable: the buffer is flushed to disk every flush_every rows and/or whenever
+    flush_interval seconds have passed since the last flush. Set both to 0 to only flush when the buffer is full and
+    when the writer is closed.
+    """
+
+    def __init__(self, dest_csv: str, mode: str = "a", flush_every: int = 100, flush_interval: float = 0,
+                 buffer_size: int = 1 << 16):
+        """
+        Args:
+            dest_csv (str): The path to the destination csv file.
+            mode (str): "a" to append to the file, "w" to overwrite it.
+            flush_every (int): Flush after this many rows. 0 to disable.
+            flush_interval (float): Flush when this many seconds have passed since the last flush. 0 to disable.
+            buffer_size (int): The size in bytes of the file buffer.
+        """
+        self.dest_csv = dest_csv
+        self.mode = mode
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.rows_written = 0
+        self._destination = os.path.basename(dest_csv)
+        self._csv_file = None
+        self._csv_writer = None
+        self._unflushed_rows = 0
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """
+        Opens the destination file.
+        """
+        self._csv_file = open(self.dest_csv, self.mode, newline="", buffering=self.buffer_size)
+        self._csv_writer = csv.writer(self._csv_file)
+        self._last_flush = time.monotonic()
+
+    @timed("write.csv")
+    def writerow(self, row: list):
+        """
+        Writes a single row, flushing according to the flush policy.
+
+        Args:
+            row (list): The csv row.
+        """
+        self._write(row)
+        self.rows_written += 1
+        rows_written.inc(destination=self._destination)
+        self._unflushed_rows += 1
+
+        if self.flush_every and self._unflushed_rows >= self.flush_every:
+            self.flush()
+        elif self.flush_interval and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _write(self, row: list):
+        self._csv_writer.writerow(row)
+
+    def writerows(self, rows):
+        """
+        Writes multiple rows, flushing according to the flush policy.
+
+        Args:
+            rows (Iterable[list]): The csv rows.
+        """
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        """
+        Flushes the buffered rows to disk.
+        """
+        self._csv_file.flush()
+        self._unflushed_rows = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Flushes and closes the destination file.
+        """
+        if self._csv_file is not None:
+            self._csv_file.close()
+            self._csv_file = None
+            self._csv_writer = None
+
+
+class BufferedJsonLinesWriter(BufferedCsvWriter):
+    """
+    BufferedCsvWriter that writes each record as one line of json instead of a csv row. Values that aren't json
+    serializable (ie. Decimal numbers from DynamoDB) are written as strings.
+    """
+
+    def _write(self, row: dict):
+        self._csv_file.write(json.dumps(row, default=str) + "\n")
@@ -5,51 +5,49 @@ Script to transfer credit cards from csv file to dynamodb table CreditCardCardRa
 to transfer Google sheets to DynamoDB.
 """
 
-import boto3
-import csv
+import os
+from typing import Iterator
 
-dynamodb = boto3.resource('dynamodb')
-credit_card_table = dynamodb.Table('CreditCardCardRaw')
+from scripts.csv_stream import read_csv_rows
+from scripts.dynamodb_io import batch_write_items
 
-source = "csv_files/CreditCardCardRaw - Main.csv"
+current_directory = os.path.dirname(os.path.realpath(__file__))
+source = os.path.join(current_directory, "csv_files/CreditCardCardRaw - Main.csv")
 
-attribute_titles = []
 
-with open(source, "r", newline='') as csv_file:
-    csv_reader = list(csv.reader(csv_file))
-
-    # gets the attribute titles
-    first_row = list(csv_reader[0])
-    for attribute in first_row:
-        attribute_titles.append(attribute)
+def read_items(source_csv: str) -> Iterator[dict]:
+    """
+    Yields every row of the csv file as a dictionary. The first row of the csv file contains the attribute titles.
 
+    Args:
+        source_csv (str): The path to the csv file.
+    Returns:
+        Iterator[dict]: The items, keyed by attribute title.
+    """
+    rows = read_csv_rows(source_csv)
+    attribute_titles = next(rows)
     print("Finished attribute titles")
     print(attribute_titles)
 
-    for row in csv_reader[1:]:
-        key = row[0]
-        row = list(row)[1:]
-
-        print("Started transferring " + key)
-        p = {}
-
-        for i in range(len(row)):
-            p[attribute_titles[1:][i]] = row[i]
+    for row in rows:
+        yield dict(zip(attribute_titles, row))
 
-        update_string = "set "
-        update_values = {}
-        j = 1
-        for key, item in p.items():
-            update_string += (key + " = :val" + str(j) + ", ")
-            update_values[":val" + str(j)] = item
-            j += 1
-        update_string = update_string[:len(update_string) - 1]
 
-        print(update_string)
-        print(update_values)
+def load_csv(source_csv: str, table_name: str = "CreditCardCardRaw", workers: int = 4, client=None) -> int:
+    """
+    Loads every card in the csv file into the DynamoDB table with batched writes.
 
-        credit_card_table.update_item(Key={"name": key},
-                                      UpdateExpression=update_string,
-                                      ExpressionAttributeValues=update_values)
+    Args:
+        source_csv (str): The path to the csv file.
+        table_name (str): The name of the DynamoDB table.
+        workers (int): The number of threads sending batches.
+        client: The boto3 DynamoDB client. (see dynamodb_io.dynamodb_client)
+    Returns:
+        int: The number of cards written.
+    """
+    return batch_write_items(table_name, read_items(source_csv), key="name", client=client, workers=workers)
 
 
+# only load when run as a script. (see cli.py for the options)
+if __name__ == "__main__":
+    load_csv(source)
@@ -0,0 +1,276 @@
+"""
+dynamodb_io.py
+~~~
+Bulk read and write helpers for the DynamoDB tables (CreditCardCardRaw, CreditCardCardScore...). Writes are sent in
+batches of 25 items from a pool of threads, and unprocessed items are retried with exponential backoff. Scans follow
+LastEvaluatedKey pagination and read the segments of a parallel scan from multiple threads.
+
+Every function takes an optional boto3 DynamoDB client, so the helpers can be pointed at a local DynamoDB stand-in
+(DynamoDB Local or moto) with dynamodb_client(endpoint_url=...).
+"""
+
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator, List
+
+import boto3
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+
+# The maximum number of items in a single BatchWriteItem request
+max_batch_write_size = 25
+
+# The maximum number of keys in a single BatchGetItem request
+max_batch_get_size = 100
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+# Put on the scan queue by a segment thread once it has read all of its pages
+_segment_done = object()
+
+
+def dynamodb_client(endpoint_url: str = None, region_name: str = None):
+    """
+    Creates a low level DynamoDB client. Unlike boto3 resources, clients can be shared between threads.
+
+    Args:
+        endpoint_url (str): The endpoint of a local DynamoDB stand-in (ie. "http://localhost:8000"). None for AWS.
+        region_name (str): The AWS region. None to use the default region.
+    Returns:
+        The boto3 DynamoDB client.
+    """
+    return boto3.client("dynamodb", endpoint_url=endpoint_url, region_name=region_name)
+
+
+def serialize_item(item: dict) -> dict:
+    """
+    Converts a python dictionary into the DynamoDB attribute value format. ({"name": "x"} -> {"name": {"S": "x"}})
+
+    Args:
+        item (dict): The item to serialize.
+    Returns:
+        dict: The serialized item.
+    """
+    return {key: _serializer.serialize(value) for key, value in item.items()}
+
+
+def deserialize_item(item: dict) -> dict:
+    """
+    Converts an item in the DynamoDB attribute value format into a python dictionary. (see serialize_item)
+
+    Args:
+        item (dict): The item to deserialize.
+    Returns:
+        dict: The deserialized item.
+    """
+    return {key: _deserializer.deserialize(value) for key, value in item.items()}
+
+
+def scan_items(table_name: str, client=None, segments: int = 4, page_size: int = None,
+               queue_size: int = 16) -> Iterator[dict]:
+    """
+    Scans a whole DynamoDB table and yields its items as they arrive. Every segment of a parallel scan is read by its
+    own thread, and each thread follows LastEvaluatedKey until its segment is exhausted, so tables larger than the
+    1 MB scan page are read completely. The order of the items is not defined.
+
+    Args:
+        table_name (str): The name of the DynamoDB table.
+        client: The boto3 DynamoDB client. Defaults to dynamodb_client().
+        segments (int): The number of parallel scan segments (and threads). 1 for a regular sequential scan.
+        page_size (int): The maximum number of items per scan request. None to let DynamoDB fill 1 MB pages.
+        queue_size (int): The maximum number of pages buffered before the segment threads wait for the consumer.
+    Returns:
+        Iterator[dict]: The deserialized items of the table.
+    """
+    if client is None:
+        client = dynamodb_client()
+
+    if segments <= 1:
+        for page in __scan_pages(client, table_name, 0, 1, page_size):
+            for item in page:
+                yield deserialize_item(item)
+        return
+
+    pages = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(page):
+        # gives up if the consumer stopped iterating, so the thread doesn't wait forever on a full queue
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def read_segment(segment: int):
+        try:
+            for page in __scan_pages(client, table_name, segment, segments, page_size):
+                if stop.is_set():
+                    return
+                put(page)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_segment_done)
+
+    threads = [threading.Thread(target=read_segment, args=(segment,), daemon=True) for segment in range(segments)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        finished = 0
+        while finished < segments:
+            page = pages.get()
+            if page is _segment_done:
+                finished += 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                for item in page:
+                    yield deserialize_item(item)
+    finally:
+        stop.set()
+
+
+def __scan_pages(client, table_name: str, segment: int, total_segments: int, page_size: int) -> Iterator[list]:
+    """
+    Yields the pages of one scan segment, following LastEvaluatedKey.
+
+    Args:
+        client: The boto3 DynamoDB client.
+        table_name (str): The name of the DynamoDB table.
+        segment (int): The segment to scan.
+        total_segments (int): The total number of segments. 1 for a regular scan.
+        page_size (int): The maximum number of items per request, or None.
+    Returns:
+        Iterator[list]: The serialized items of each page.
+    """
+    kwargs = {"TableName": table_name}
+    if total_segments > 1:
+        kwargs["Segment"] = segment
+        kwargs["TotalSegments"] = total_segments
+    if page_size:
+        kwargs["Limit"] = page_size
+
+    while True:
+        response = client.scan(**kwargs)
+        yield response.get("Items", [])
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key:
+            return
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def batch_get_items(table_name: str, keys: Iterable[str], key: str = "name", client=None, max_retries: int = 8,
+                    base_delay: float = 0.05) -> Iterator[dict]:
+    """
+    Reads specific items by key with batched point reads (BatchGetItem) instead of scanning the table. Keys that are
+    not in the table are skipped. Unprocessed keys are retried with exponential backoff and jitter.
+
+    Args:
+        table_name (str): The name of the DynamoDB table.
+        keys (Iterable[str]): The partition key values to read. (ie. card names)
+        key (str): The name of the partition key of the table.
+        client: The boto3 DynamoDB client. Defaults to dynamodb_client().
+        max_retries (int): The number of times unprocessed keys are retried before giving up.
+        base_delay (float): The delay in seconds before the first retry. Doubles after every retry.
+    Returns:
+        Iterator[dict]: The deserialized items that were found.
+    """
+    if client is None:
+        client = dynamodb_client()
+
+    unique_keys = list(dict.fromkeys(keys))
+    for i in range(0, len(unique_keys), max_batch_get_size):
+        pending = {"Keys": [serialize_item({key: value}) for value in unique_keys[i:i + max_batch_get_size]]}
+        for attempt in range(max_retries + 1):
+            response = client.batch_get_item(RequestItems={table_name: pending})
+            for item in response.get("Responses", dict()).get(table_name, []):
+                yield deserialize_item(item)
+
+            pending = response.get("UnprocessedKeys", dict()).get(table_name)
+            if not pending:
+                break
+
+            delay = base_delay * (2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay))
+        else:
+            raise RuntimeError("{} keys could not be read from {} after {} retries"
+                               .format(len(pending["Keys"]), table_name, max_retries))
+
+
+def batch_write_items(table_name: str, items: Iterable[dict], key: str = "name", client=None, workers: int = 4,
+                      max_retries: int = 8, base_delay: float = 0.05, progress_every: int = 100) -> int:
+    """
+    Writes items to a DynamoDB table with batched PutItem requests spread over a thread pool. Items with the same key
+    are deduplicated, keeping the last one, since a batch can't contain the same key twice.
+
+    Args:
+        table_name (str): The name of the DynamoDB table.
+        items (Iterable[dict]): The items to write.
+        key (str): The name of the partition key of the table.
+        client: The boto3 DynamoDB client. Defaults to dynamodb_client().
+        workers (int): The number of threads sending batches.
+        max_retries (int): The number of times unprocessed items are retried before giving up.
+        base_delay (float): The delay in seconds before the first retry. Doubles after every retry.
+        progress_every (int): Print the progress every time this many items are written.
+    Returns:
+        int: The number of items written.
+    """
+    if client is None:
+        client = dynamodb_client()
+
+    unique_items = dict()
+    for item in items:
+        unique_items[item[key]] = item
+    requests = [{"PutRequest": {"Item": serialize_item(item)}} for item in unique_items.values()]
+    batches = [requests[i:i + max_batch_write_size] for i in range(0, len(requests), max_batch_write_size)]
+
+    progress = {"written": 0, "reported": 0}
+    progress_lock = threading.Lock()
+
+    def report(count: int):
+        with progress_lock:
+            progress["written"] += count
+            if progress["written"] - progress["reported"] >= progress_every or progress["written"] == len(requests):
+                progress["reported"] = progress["written"]
+                print("Wrote {}/{} items to {}".format(progress["written"], len(requests), table_name))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(__write_batch, client, table_name, batch, max_retries, base_delay)
+                   for batch in batches]
+        for future in as_completed(futures):
+            report(future.result())
+
+    return progress["written"]
+
+
+def __write_batch(client, table_name: str, batch: List[dict], max_retries: int, base_delay: float) -> int:
+    """
+    Sends one BatchWriteItem request and retries the unprocessed items with exponential backoff and jitter.
+
+    Args:
+        client: The boto3 DynamoDB client.
+        table_name (str): The name of the DynamoDB table.
+        batch (List[dict]): The write requests. (at most 25)
+        max_retries (int): The number of retries before giving up.
+        base_delay (float): The delay in seconds before the first retry.
+    Returns:
+        int: The number of items written.
+    """
+    pending = batch
+    for attempt in range(max_retries + 1):
+        response = client.batch_write_item(RequestItems={table_name: pending})
+        pending = response.get("UnprocessedItems", dict()).get(table_name, [])
+        if not pending:
+            return len(batch)
+
+        delay = base_delay * (2 ** attempt)
+        time.sleep(delay + random.uniform(0, delay))
+
+    raise RuntimeError("{} items could not be written to {} after {} retries"
+                       .format(len(pending), table_name, max_retries))
@@ -0,0 +1,116 @@
+"""
+fingerprint_manifest.py
+~~~
+Stores a fingerprint (content hash) of the inputs used to produce each card's output, so that later runs can skip
+cards whose inputs have not changed. The manifest is a json file mapping card names to fingerprints, along with the
+version of the rules that produced the output. Changing the version makes every card count as changed.
+"""
+
+import hashlib
+import json
+import os
+from typing import Iterable
+
+
+def fingerprint(parts: Iterable[str]) -> str:
+    """
+    Returns a stable content hash of a sequence of strings.
+
+    Args:
+        parts (Iterable[str]): The strings to hash. (ie. the raw terms of a card)
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = str(part).encode("utf-8")
+        # prefix each part with its length so ["ab", "c"] and ["a", "bc"] hash differently
+        digest.update(str(len(encoded)).encode("ascii") + b":")
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def load_versioned_json(path: str, version: str) -> dict:
+    """
+    Returns a json manifest written by save_versioned_json, or an empty dictionary if the file does not exist or was
+    written with another version.
+
+    Args:
+        path (str): The path to the json manifest.
+        version (str): The version the manifest must have been written with.
+    Returns:
+        dict: The saved manifest, including its version.
+    """
+    if not os.path.exists(path):
+        return dict()
+    with open(path, "r") as manifest_file:
+        saved = json.load(manifest_file)
+    if saved.get("version") != version:
+        print("Version of {} changed from {} to {}. Every card counts as changed."
+              .format(os.path.basename(path), saved.get("version"), version))
+        return dict()
+    return saved
+
+
+def save_versioned_json(path: str, version: str, manifest: dict):
+    """
+    Writes a json manifest along with its version. The file is replaced atomically so a crash never leaves a half
+    written manifest. Callers sharing a manifest between threads must hold a lock, since the temporary file is
+    shared too.
+
+    Args:
+        path (str): The path to the json manifest.
+        version (str): The version of the manifest.
+        manifest (dict): The json serializable content.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as manifest_file:
+        json.dump(dict(manifest, version=version), manifest_file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+class FingerprintManifest:
+    """
+    A json backed mapping of card name to the fingerprint of the inputs its output was built from.
+    """
+
+    def __init__(self, path: str, version: str):
+        """
+        Loads the manifest at path. If the file does not exist, or was written with another version, the manifest
+        starts out empty.
+
+        Args:
+            path (str): The path to the json manifest.
+            version (str): The version of the rules that produce the output. (ie. term_cache.RULES_VERSION)
+        """
+        self.path = path
+        self.version = version
+        self.fingerprints = load_versioned_json(path, version).get("fingerprints", dict())
+
+    def is_changed(self, card_name: str, card_fingerprint: str) -> bool:
+        """
+        Returns True if the card is new or its fingerprint differs from the stored one.
+
+        Args:
+            card_name (str): The name of the card.
+            card_fingerprint (str): The fingerprint of the card's current inputs.
+        Returns:
+            bool: Whether the card needs to be processed again.
+        """
+        return self.fingerprints.get(card_name) != card_fingerprint
+
+    def update(self, card_name: str, card_fingerprint: str):
+        """
+        Records the fingerprint of a processed card.
+
+        Args:
+            card_name (str): The name of the card.
+            card_fingerprint (str): The fingerprint of the inputs the output was built from.
+        """
+        self.fingerprints[card_name] = card_fingerprint
+
+    def save(self):
+        """
+        Writes the manifest to disk. (see save_versioned_json)
+        """
+        save_versioned_json(self.path, self.version, {"fingerprints": self.fingerprints})
@@ -3,32 +3,279 @@ phrase_generation_script.py
 ~~~
 Phrase generation script. Builds the phrases and outputs them in a csv file called credit_card_phrases.csv.
 """
-import boto3
-from phrase_generation.generator import generate_responses
-from scripts.convert_csv import convert_csv_voice_responses, convert_csv_voice_responses_header
-
-# initialize dynamoDB tables
-db = boto3.resource("dynamodb")
-credit_card_table = db.Table("CreditCardCardRaw")
-card_score_table = db.Table("CreditCardCardScore")
+import json
+import os
+from contextlib import ExitStack
+from multiprocessing import Pool
+from typing import Iterable, Iterator, List, Tuple
+
+from instrumentation import timing
+from phrase_generation import generator
+from phrase_generation.image_index import ImageIndex
+from scripts.convert_csv import attributes_order_voice_responses, convert_csv_voice_responses_row, f
+from scripts.csv_stream import BufferedCsvWriter, BufferedJsonLinesWriter
+from scripts.dynamodb_io import batch_get_items, dynamodb_client, scan_items
+from scripts.fingerprint_manifest import FingerprintManifest, fingerprint
+from scripts.pipeline_store import PipelineStore
+from scripts.sharding import select_shard
+
+# dynamoDB tables
+credit_card_table = "CreditCardCardRaw"
+card_score_table = "CreditCardCardScore"
 # the CreditCardAttrbituteIndividualCard table contains phrases that override the generated phrase
-card_individual_attribute = db.Table("CreditCardAttrbituteIndividualCard")
+card_individual_attribute = "CreditCardAttrbituteIndividualCard"
+
+# number of parallel scan segments used to read each table
+scan_segments = 4
+
+# The manifest of input fingerprints used by incremental phrase generation
+current_directory = os.path.dirname(os.path.realpath(__file__))
+manifest_json = os.path.join(current_directory, "csv_files/credit_card_phrases_manifest.json")
+
+# The default output of the jsonl format, so json lines are never appended to the spreadsheet export
+phrases_jsonl = os.path.join(current_directory, "csv_files/credit_card_phrases.jsonl")
+
+
+def index_by_name(items: Iterable[dict], table_name: str) -> dict:
+    """
+    Indexes the items of a table by card name. If a name appears more than once, the first item is kept and the
+    duplicate is reported.
+
+    Args:
+        items (Iterable[dict]): The items of the table.
+        table_name (str): The name of the table. (for reporting)
+    Returns:
+        dict: Mapping of card name to item.
+    """
+    index = dict()
+    for item in items:
+        name = item["name"]
+        if name in index:
+            print("Duplicate card name {} in {}, keeping the first item.".format(name, table_name))
+            continue
+        index[name] = item
+    return index
+
+
+def join_cards(cards: dict, scores: dict, individual_cards: dict) -> Iterator[Tuple[str, dict, dict, dict]]:
+    """
+    Joins the card, score, and override tables by card name, in alphabetical order of card name. Cards without a
+    score are reported and skipped, since the score table provides the issuer and similar cards.
+
+    Args:
+        cards (dict): The CreditCardCardRaw items indexed by name.
+        scores (dict): The CreditCardCardScore items indexed by name.
+        individual_cards (dict): The CreditCardAttrbituteIndividualCard items indexed by name.
+    Returns:
+        Iterator[Tuple[str, dict, dict, dict]]: The name, card, score, and override info of every card.
+    """
+    missing_scores = []
+    for name in sorted(cards):
+        score_info = scores.get(name)
+        if score_info is None:
+            missing_scores.append(name)
+            continue
+        individual_card_info = individual_cards.get(name, {"name": name})
+        yield name, cards[name], score_info, individual_card_info
+
+    if missing_scores:
+        print("Skipped {} cards without a score in {}: {}".format(len(missing_scores), card_score_table,
+                                                                  ", ".join(missing_scores)))
+
+
+def read_tables(client=None, card_names: List[str] = None) -> (dict, dict, dict):
+    """
+    Reads the card, score, and override tables, indexed by card name. By default every table is scanned. If
+    card_names is given, only the rows of those cards are fetched, with batched point reads.
+
+    Args:
+        client: The boto3 DynamoDB client. (see dynamodb_io.dynamodb_client)
+        card_names (List[str]): The names of the cards to read. None to read every card.
+    Returns:
+        (dict, dict, dict): The card, score, and override items indexed by name.
+    """
+    if client is None:
+        client = dynamodb_client()
+
+    tables = []
+    for table_name in [credit_card_table, card_score_table, card_individual_attribute]:
+        if card_names is None:
+            items = scan_items(table_name, client, segments=scan_segments)
+        else:
+            items = batch_get_items(table_name, card_names, client=client)
+        tables.append(index_by_name(items, table_name))
+
+    if card_names is not None:
+        missing_cards = [name for name in card_names if name not in tables[0]]
+        if missing_cards:
+            print("Cards not found in {}: {}".format(credit_card_table, ", ".join(missing_cards)))
+
+    return tables[0], tables[1], tables[2]
+
+
+def card_fingerprint(joined_card: Tuple[str, dict, dict, dict]) -> str:
+    """
+    Returns the fingerprint of every row used to generate a card's phrases: the raw row, score row, and override row.
+    The template version is the version of the manifest, so editing a template regenerates every card.
+
+    Args:
+        joined_card (Tuple[str, dict, dict, dict]): The name, card, score, and override info of the card.
+    Returns:
+        str: The fingerprint.
+    """
+    name, card, score_info, individual_card_info = joined_card
+    rows = (card, score_info, individual_card_info)
+    return fingerprint(json.dumps(row, sort_keys=True, default=str) for row in rows)
+
+
+def generate_all(client=None, workers: int = 1, output_format: str = "csv", dest: str = None, mode: str = "a",
+                 chunk_size: int = 8, flush_every: int = 100, card_names: List[str] = None,
+                 incremental: bool = False, manifest_path: str = manifest_json, store: PipelineStore = None,
+                 run_id: str = None, shard: Tuple[int, int] = None):
+    """
+    Reads the card, score, and override tables, and writes the generated phrases of every card to dest.
+
+    With more than one worker, cards are fanned out to a pool of worker processes. The compiled templates are loaded
+    once per worker and the S3 image index is built once here and handed to every worker. Results stream back in
+    card order to a single buffered writer.
+
+    In incremental mode, a manifest of the fingerprint of each card's inputs (see card_fingerprint) is kept, and only
+    the cards whose inputs changed since the last run are generated and written.
+
+    Args:
+        client: The boto3 DynamoDB client. (see dynamodb_io.dynamodb_client)
+        workers (int): The number of worker processes. 1 to generate in this process.
+        output_format (str): "csv" for the CreditCardCard spreadsheet format, "jsonl" for one json object per card.
+        dest (str): The output file. Defaults to credit_card_phrases.csv, or credit_card_phrases.jsonl for jsonl.
+        mode (str): "a" to append to dest, "w" to overwrite it.
+        chunk_size (int): The number of cards sent to a worker at a time.
+        flush_every (int): The number of cards buffered before they are flushed to dest.
+        card_names (List[str]): Only generate these cards, reading just their rows instead of scanning the tables.
+        incremental (bool): Only generate the cards whose inputs changed since the last incremental run.
+        manifest_path (str): The path to the json manifest of input fingerprints used in incremental mode.
+        store (PipelineStore): If given, the phrases of every card are also upserted into the phrases table.
+        run_id (str): The run id of the phrase records in the store.
+        shard (Tuple[int, int]): Only generate the cards of this shard. (see sharding.parse_shard)
+    Returns:
+        int: The number of rows written.
+    """
+    cards, scores, individual_cards = read_tables(client, card_names)
+    joined_cards = join_cards(cards, scores, individual_cards)
+    joined_cards = select_shard(joined_cards, shard, key=lambda joined_card: joined_card[0])
+
+    manifest = None
+    pending_fingerprints = dict()
+    if incremental:
+        manifest = FingerprintManifest(manifest_path, generator.template_version)
+        joined_cards = __changed_cards(joined_cards, manifest, pending_fingerprints)
+
+    if output_format == "jsonl":
+        writer = BufferedJsonLinesWriter(dest or phrases_jsonl, mode=mode, flush_every=flush_every)
+    else:
+        writer = BufferedCsvWriter(dest or f, mode=mode, flush_every=flush_every)
+
+    with ExitStack() as stack:
+        stack.enter_context(writer)
+        if store is not None:
+            stack.enter_context(store.transaction())
+        if output_format != "jsonl":
+            # create the attribute headers for the csv file
+            writer.writerow(attributes_order_voice_responses)
+
+        if workers > 1:
+            images = generator.image_index.images()
+            with Pool(workers, initializer=__init_worker,
+                      initargs=(images, timing.ENABLED, timing.run_timings.profile_slowest)) as pool:
+                responses = pool.imap(generate_card, joined_cards, chunk_size)
+                write_responses(writer, responses, output_format, manifest, pending_fingerprints, store, run_id)
+        else:
+            responses = map(generate_card, joined_cards)
+            write_responses(writer, responses, output_format, manifest, pending_fingerprints, store, run_id)
+
+    if manifest is not None:
+        manifest.save()
+        print("Generated {} changed cards.".format(len(pending_fingerprints)))
+
+    print("Success")
+    return writer.rows_written
+
+
+def __changed_cards(joined_cards: Iterable[Tuple[str, dict, dict, dict]], manifest: FingerprintManifest,
+                    pending_fingerprints: dict) -> Iterator[Tuple[str, dict, dict, dict]]:
+    """
+    Filters out the cards whose inputs have not changed. The fingerprint of each changed card is stored in
+    pending_fingerprints, and only recorded in the manifest once the card's phrases are written.
+    """
+    for joined_card in joined_cards:
+        name = joined_card[0]
+        new_fingerprint = card_fingerprint(joined_card)
+        if manifest.is_changed(name, new_fingerprint):
+            pending_fingerprints[name] = new_fingerprint
+            yield joined_card
+
+
+def generate_card(joined_card: Tuple[str, dict, dict, dict]) -> Tuple[dict, timing.CardTiming]:
+    """
+    Generates the responses of one joined card. (see join_cards) Runs in the worker processes, so the timing record
+    of the card is returned for the parent to add to its run, instead of being added to the worker's.
+
+    Args:
+        joined_card (Tuple[str, dict, dict, dict]): The name, card, score, and override info of the card.
+    Returns:
+        Tuple[dict, timing.CardTiming]: The responses, or None if the card is missing a required attribute, and the
+                                        timing record, or None when timing is off.
+    """
+    name, card, score_info, individual_card_info = joined_card
+    record = timing.start_card(name.strip())
+    with timing.recording(record):
+        responses = generator.generate_responses(name, card, score_info, individual_card_info)
+    return responses, record
+
+
+def write_responses(writer: BufferedCsvWriter, responses: Iterable[Tuple[dict, timing.CardTiming]], output_format: str,
+                    manifest: FingerprintManifest = None, pending_fingerprints: dict = None,
+                    store: PipelineStore = None, run_id: str = None):
+    """
+    Writes generated responses with a buffered writer, skipping cards that could not be generated.
+
+    Args:
+        writer (BufferedCsvWriter): The csv or json lines writer.
+        responses (Iterable[Tuple[dict, timing.CardTiming]]): The responses and timing record of each card.
+        output_format (str): "csv" or "jsonl".
+        manifest (FingerprintManifest): In incremental mode, the manifest updated for every written card.
+        pending_fingerprints (dict): In incremental mode, the fingerprints of the cards being generated.
+        store (PipelineStore): If given, the pipeline store the responses are also upserted into.
+        run_id (str): The run id of the phrase records in the store.
+    """
+    for output_dict, record in responses:
+        timing.finish_card(record)
+        if output_dict is None:
+            continue
+        if output_format == "jsonl":
+            writer.writerow({attribute: output_dict.get(attribute) for attribute in attributes_order_voice_responses})
+        else:
+            writer.writerow(convert_csv_voice_responses_row(output_dict))
+        if store is not None:
+            store.upsert("phrases", run_id, output_dict["name"], output_dict)
+
+        if manifest is not None:
+            manifest.update(output_dict["name"], pending_fingerprints[output_dict["name"]])
 
-all_credit_cards = credit_card_table.scan()["Items"]
-all_scores = card_score_table.scan()["Items"]
-all_individual_cards = card_individual_attribute.scan()["Items"]
 
-# create the attribute headers for the csv file
-convert_csv_voice_responses_header()
+def __init_worker(images: dict, timings: bool = False, profile_slowest: int = 0):
+    """
+    Initializes a worker process with the image index built by the parent process, so workers never list S3, and
+    with the timing settings of the parent.
 
-for card in all_credit_cards:
-    name = card["name"]
-    score_info = list(filter(lambda x: x["name"] == name, all_scores))[0]
-    individual_card_info = list(filter(lambda x: x["name"] == name, all_individual_cards))
-    if len(individual_card_info) == 0:
-        individual_card_info = {"name": name}
-    output_dict = generate_responses(name, card, score_info, individual_card_info)
-    convert_csv_voice_responses(output_dict)
+    Args:
+        images (dict): The image index. (see ImageIndex.images)
+        timings (bool): Whether the cards are timed. (see timing.configure)
+        profile_slowest (int): Whether the cards are profiled, if not 0.
+    """
+    generator.image_index = ImageIndex(images=images)
+    timing.configure(enabled=timings, profile_slowest=profile_slowest)
 
-print("Success")
 
+# the worker processes import this module, so only generate when it is run as a script
+if __name__ == "__main__":
+    generate_all()
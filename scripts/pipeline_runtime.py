@@ -0,0 +1,237 @@
+"""
+pipeline_runtime.py
+~~~
+Runs items through a chain of stages connected by bounded queues. Every stage has its own pool of worker threads, so
+a slow network bound stage (ie. fetching pages) overlaps with the stages after it instead of blocking them. When a
+queue is full, the stage feeding it waits, so fast stages never run far ahead of slow ones and memory stays bounded.
+
+While the pipeline runs, the depth of every queue is sampled. A stage whose input queue stays full, or whose workers
+are busy all of the time, is the bottleneck. (see PipelineStats.report)
+
+Example:
+    pipeline = StagedPipeline([Stage("fetch", fetch, workers=8), Stage("parse", parse, workers=2),
+                               Stage("write", write, ordered=True)])
+    stats = pipeline.run(urls)
+    print(stats.report())
+"""
+
+import queue
+import threading
+import time
+import traceback
+from typing import Callable, Iterable, List
+
+# Marks an item that failed or was dropped by an earlier stage, so ordered stages can move past it
+_skipped = object()
+# Tells a worker that no more items will come
+_done = object()
+
+
+class Stage:
+    """
+    A step of a StagedPipeline. The function is called with the output of the previous stage, and returns the input
+    of the next stage. Returning None drops the item. If the function raises an error, the error is printed and the
+    item is dropped. The return value of the last stage is ignored.
+    """
+
+    def __init__(self, name: str, function: Callable, workers: int = 1, queue_size: int = 16, ordered: bool = False):
+        """
+        Args:
+            name (str): The name of the stage, used in the metrics.
+            function (Callable): The function applied to every item.
+            workers (int): The number of worker threads.
+            queue_size (int): The maximum number of items waiting in the input queue of the stage.
+            ordered (bool): Process the items in input order. Only allowed with a single worker. (ie. for a writer)
+        """
+        if ordered and workers != 1:
+            raise ValueError("Ordered stage {} must have a single worker".format(name))
+
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ordered = ordered
+
+
+class StageStats:
+    """
+    The metrics of a stage during a run.
+    """
+
+    def __init__(self, stage: Stage):
+        self.name = stage.name
+        self.workers = stage.workers
+        self.queue_size = stage.queue_size
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+
+    @property
+    def average_depth(self) -> float:
+        return self.depth_total / self.depth_samples if self.depth_samples else 0.0
+
+
+class PipelineStats:
+    """
+    The metrics of a StagedPipeline run.
+    """
+
+    def __init__(self, stage_stats: List[StageStats]):
+        self.stages = stage_stats
+        self.elapsed = 0.0
+
+    def bottleneck(self) -> StageStats:
+        """
+        Returns the stage whose workers were busy for the largest share of the run.
+        """
+        return max(self.stages, key=self.utilization)
+
+    def utilization(self, stage: StageStats) -> float:
+        """
+        Returns the share of the run the workers of a stage were busy, between 0 and 1.
+        """
+        if not self.elapsed:
+            return 0.0
+        return stage.busy_time / (stage.workers * self.elapsed)
+
+    def report(self) -> str:
+        """
+        Returns a table of the metrics of every stage.
+        """
+        lines = ["{:<10} {:>7} {:>9} {:>7} {:>7} {:>9} {:>9} {:>6}".format(
+            "stage", "workers", "processed", "dropped", "failed", "avg queue", "max queue", "busy")]
+        for stage in self.stages:
+            lines.append("{:<10} {:>7} {:>9} {:>7} {:>7} {:>9.1f} {:>5}/{:<3} {:>5.0%}".format(
+                stage.name, stage.workers, stage.processed, stage.dropped, stage.failed, stage.average_depth,
+                stage.max_depth, stage.queue_size, self.utilization(stage)))
+        lines.append("Finished in {:.1f} s, bottleneck: {}".format(self.elapsed, self.bottleneck().name))
+        return "\n".join(lines)
+
+
+class StagedPipeline:
+    """
+    A chain of stages connected by bounded queues.
+    """
+
+    def __init__(self, stages: List[Stage], sample_interval: float = 0.5):
+        """
+        Args:
+            stages (List[Stage]): The stages, in order.
+            sample_interval (float): The number of seconds between two samples of the queue depths.
+        """
+        self.stages = stages
+        self.sample_interval = sample_interval
+
+    def run(self, items: Iterable) -> PipelineStats:
+        """
+        Runs the items through every stage and waits for the last one to finish. If the items raise an error (ie. a
+        malformed csv row), it is raised once the items before it went through every stage.
+
+        Args:
+            items (Iterable): The input of the first stage.
+        Returns:
+            PipelineStats: The metrics of the run.
+        """
+        queues = [queue.Queue(stage.queue_size) for stage in self.stages]
+        stats = PipelineStats([StageStats(stage) for stage in self.stages])
+        remaining_workers = [stage.workers for stage in self.stages]
+        lock = threading.Lock()
+        finished = threading.Event()
+
+        def worker(index: int):
+            stage = self.stages[index]
+            stage_stats = stats.stages[index]
+            output_queue = queues[index + 1] if index + 1 < len(queues) else None
+            pending = dict()  # out of order items, for ordered stages
+            next_sequence = 0
+
+            while True:
+                message = queues[index].get()
+                if message is _done:
+                    break
+
+                if not stage.ordered:
+                    self.__process(stage, stage_stats, message, output_queue, lock)
+                    continue
+
+                pending[message[0]] = message
+                while next_sequence in pending:
+                    self.__process(stage, stage_stats, pending.pop(next_sequence), output_queue, lock)
+                    next_sequence += 1
+
+            # the last worker of a stage to finish tells every worker of the next stage to finish
+            with lock:
+                remaining_workers[index] -= 1
+                last_worker = remaining_workers[index] == 0
+            if last_worker and output_queue is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    output_queue.put(_done)
+
+        def sample_depths():
+            while not finished.wait(self.sample_interval):
+                for stage_queue, stage_stats in zip(queues, stats.stages):
+                    depth = stage_queue.qsize()
+                    stage_stats.max_depth = max(stage_stats.max_depth, depth)
+                    stage_stats.depth_total += depth
+                    stage_stats.depth_samples += 1
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(index,), daemon=True)
+                   for index, stage in enumerate(self.stages) for _ in range(stage.workers)]
+        sampler = threading.Thread(target=sample_depths, daemon=True)
+        for thread in threads:
+            thread.start()
+        sampler.start()
+
+        try:
+            # feeding blocks while the first queue is full, which is the backpressure on the input
+            for sequence, item in enumerate(items):
+                queues[0].put((sequence, item))
+        finally:
+            # if the input raises, the items fed so far still go through every stage before the error is raised, so
+            # no stage is left running (ie. a writer holding the pipeline store)
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_done)
+            for thread in threads:
+                thread.join()
+            finished.set()
+            sampler.join()
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+    @staticmethod
+    def __process(stage: Stage, stage_stats: StageStats, message: tuple, output_queue: queue.Queue,
+                  lock: threading.Lock):
+        """
+        Applies the function of a stage to one item and passes the result on. Failed and dropped items are passed on
+        as skipped, so ordered stages downstream don't wait for them.
+        """
+        sequence, item = message
+        result = _skipped
+        if item is not _skipped:
+            start = time.perf_counter()
+            try:
+                result = stage.function(item)
+                outcome = "processed"
+            except Exception:
+                print("Error in stage {} on item {}:".format(stage.name, sequence))
+                traceback.print_exc()
+                result = None
+                outcome = "failed"
+            busy_time = time.perf_counter() - start
+
+            if result is None:
+                result = _skipped
+                # the return value of the last stage is not used, so it is never a drop
+                if outcome == "processed" and output_queue is not None:
+                    outcome = "dropped"
+            with lock:
+                stage_stats.busy_time += busy_time
+                setattr(stage_stats, outcome, getattr(stage_stats, outcome) + 1)
+
+        if output_queue is not None:
+            output_queue.put((sequence, result))
@@ -0,0 +1,286 @@
+"""
+pipeline_store.py
+~~~
+Embedded SQLite store for the data handed off between the pipeline stages. Instead of appending to
+credit_card_raw_scraped.csv, credit_card_raw_processed.csv and credit_card_phrases.csv, each stage upserts one record
+per card into a table keyed by card name and run id:
+
+    raw_scrapes      ----> the dictionaries returned by run_scraper
+    processed_terms  ----> the dictionaries returned by clean_up_terms and second_clean
+    phrases          ----> the dictionaries returned by generate_responses
+
+Rerunning a stage replaces the records of the same run instead of appending duplicates, and a stage only reads the
+records (and attributes) it needs. The tables can still be exported to the usual csv files for the business team.
+
+Example:
+    with PipelineStore() as store:
+        run_id = store.latest_run_id("raw_scrapes")
+        store.export_csv("raw_scrapes", "csv_files/credit_card_raw_scraped.csv", run_id)
+"""
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Tuple
+
+from instrumentation.timing import timed
+from scripts.convert_csv import attributes_order_voice_responses, convert_csv_row, convert_csv_voice_responses_row, \
+    csv_row_to_dict
+from scripts.csv_stream import read_csv_rows, rows_written, BufferedCsvWriter
+
+current_directory = os.path.dirname(os.path.realpath(__file__))
+pipeline_db = os.path.join(current_directory, "csv_files/pipeline.db")
+
+# The tables of the store, one per pipeline stage
+tables = ["raw_scrapes", "processed_terms", "phrases"]
+
+table_schema = """
+CREATE TABLE IF NOT EXISTS {table} (
+    card_name TEXT NOT NULL,
+    run_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (card_name, run_id)
+);
+CREATE INDEX IF NOT EXISTS {table}_run_id ON {table} (run_id);
+"""
+
+
+def new_run_id() -> str:
+    """
+    Returns a new run id based on the current time, with microseconds and a random suffix so processes started in
+    the same second (ie. the shards of a run) get different ids. (ie. "20180716-153000-042113-9f1c2a7e")
+
+    Returns:
+        str: The run id.
+    """
+    now = time.time()
+    return "{}-{:06d}-{}".format(time.strftime("%Y%m%d-%H%M%S", time.localtime(now)), int(now % 1 * 1000000),
+                                 uuid.uuid4().hex[:8])
+
+
+class PipelineStore:
+    """
+    A SQLite database holding one table per pipeline stage. Use as a context manager, the connection is closed on
+    exit. Records are dictionaries stored as json, so stages read attributes by name instead of by csv column.
+    """
+
+    def __init__(self, path: str = pipeline_db, timeout: float = 30):
+        """
+        Opens (or creates) the database at path and creates the tables that don't exist yet.
+
+        Args:
+            path (str): The path to the SQLite database file.
+            timeout (float): The number of seconds to wait for a lock held by another process.
+        """
+        self.path = path
+        # autocommit mode, transactions are opened explicitly by transaction(). The connection may be handed to a
+        # writer thread (see scrape_pipeline.py), but is only ever used by one thread at a time.
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._transaction_depth = 0
+        for table in tables:
+            self.connection.executescript(table_schema.format(table=table))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the enclosed writes in a single transaction, committed on exit and rolled back on error. Nested
+        transactions join the outermost one.
+        """
+        if self._transaction_depth:
+            self._transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self._transaction_depth -= 1
+            return
+
+        self.connection.execute("BEGIN")
+        self._transaction_depth = 1
+        try:
+            yield self
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        else:
+            self.connection.execute("COMMIT")
+        finally:
+            self._transaction_depth = 0
+
+    @timed("write.store")
+    def upsert(self, table: str, run_id: str, card_name: str, data: dict):
+        """
+        Inserts the record of a card, or replaces it if the card already has a record in this run.
+
+        Args:
+            table (str): The name of the table. (see tables)
+            run_id (str): The run id.
+            card_name (str): The full card name.
+            data (dict): The record.
+        """
+        self.upsert_many(table, run_id, [(card_name, data)])
+
+    def upsert_many(self, table: str, run_id: str, records: Iterable[Tuple[str, dict]], batch_size: int = 500) -> int:
+        """
+        Upserts many records in one transaction. (see upsert) Records keep their original position when they are
+        replaced, so exports stay in the order the cards were first written.
+
+        Args:
+            table (str): The name of the table. (see tables)
+            run_id (str): The run id.
+            records (Iterable[Tuple[str, dict]]): The card name and record of every card.
+            batch_size (int): The number of records sent to SQLite at a time.
+        Returns:
+            int: The number of records written.
+        """
+        self.__check_table(table)
+        insert = "INSERT OR IGNORE INTO {} (card_name, run_id, data, updated_at) VALUES (?, ?, ?, ?)".format(table)
+        update = "UPDATE {} SET data = ?, updated_at = ? WHERE card_name = ? AND run_id = ?".format(table)
+
+        written = 0
+        with self.transaction():
+            batch = []
+            for card_name, data in records:
+                batch.append((card_name, run_id, json.dumps(data, default=str), time.time()))
+                if len(batch) >= batch_size:
+                    written += self.__write_batch(insert, update, batch)
+                    batch = []
+            if batch:
+                written += self.__write_batch(insert, update, batch)
+        rows_written.inc(written, destination="store:" + table)
+        return written
+
+    def __write_batch(self, insert: str, update: str, batch: List[tuple]) -> int:
+        self.connection.executemany(insert, batch)
+        self.connection.executemany(update, [(data, updated_at, card_name, run_id)
+                                             for card_name, run_id, data, updated_at in batch])
+        return len(batch)
+
+    def read(self, table: str, run_id: str = None, card_names: List[str] = None) -> Iterator[Tuple[str, dict]]:
+        """
+        Yields the records of a run, in the order they were first written.
+
+        Args:
+            table (str): The name of the table. (see tables)
+            run_id (str): The run id. Defaults to the latest run.
+            card_names (List[str]): Only read the records of these cards. None to read every card.
+        Returns:
+            Iterator[Tuple[str, dict]]: The card name and record of every card.
+        """
+        self.__check_table(table)
+        if run_id is None:
+            run_id = self.latest_run_id(table)
+
+        query = "SELECT card_name, data FROM {} WHERE run_id = ?".format(table)
+        parameters = [run_id]
+        if card_names is not None:
+            query += " AND card_name IN ({})".format(", ".join("?" * len(card_names)))
+            parameters += list(card_names)
+        query += " ORDER BY rowid"
+
+        for card_name, data in self.connection.execute(query, parameters):
+            yield card_name, json.loads(data)
+
+    def read_attribute(self, table: str, attribute: str, run_id: str = None) -> Iterator[Tuple[str, object]]:
+        """
+        Yields a single attribute of every record of a run. (ie. read_attribute("processed_terms", "annual_fee"))
+
+        Args:
+            table (str): The name of the table. (see tables)
+            attribute (str): The name of the attribute.
+            run_id (str): The run id. Defaults to the latest run.
+        Returns:
+            Iterator[Tuple[str, object]]: The card name and attribute of every card. None if a card doesn't have it.
+        """
+        for card_name, data in self.read(table, run_id):
+            yield card_name, data.get(attribute)
+
+    def runs(self, table: str) -> List[str]:
+        """
+        Returns the run ids of a table, oldest first.
+
+        Args:
+            table (str): The name of the table. (see tables)
+        Returns:
+            List[str]: The run ids.
+        """
+        self.__check_table(table)
+        query = "SELECT run_id FROM {} GROUP BY run_id ORDER BY MIN(rowid)".format(table)
+        return [row[0] for row in self.connection.execute(query)]
+
+    def latest_run_id(self, table: str) -> str:
+        """
+        Returns the id of the latest run of a table, or None if the table is empty.
+
+        Args:
+            table (str): The name of the table. (see tables)
+        Returns:
+            str: The run id.
+        """
+        runs = self.runs(table)
+        return runs[-1] if runs else None
+
+    def import_raw_csv(self, source_csv: str, run_id: str, start_index: int = 1) -> int:
+        """
+        Imports a csv file in the format of credit_card_raw_scraped.csv into the raw_scrapes table, ie. after it was
+        manually edited in Google sheets.
+
+        Args:
+            source_csv (str): The path to the csv file.
+            run_id (str): The run id of the imported records.
+            start_index (int): The integer row index to start from. (1 to skip the attribute titles)
+        Returns:
+            int: The number of records imported.
+        """
+        records = ((row[0].strip(), csv_row_to_dict(row)) for row in read_csv_rows(source_csv, start_index) if row)
+        return self.upsert_many("raw_scrapes", run_id, records)
+
+    def export_csv(self, table: str, dest_csv: str, run_id: str = None) -> int:
+        """
+        Exports the records of a run to a csv file in the same format as the csv files written by the scripts. The
+        file is replaced atomically, so a crash never leaves a half written export.
+
+        Args:
+            table (str): The name of the table. (see tables)
+            dest_csv (str): The destination csv file. Overwritten if it exists.
+            run_id (str): The run id. Defaults to the latest run.
+        Returns:
+            int: The number of records exported.
+        """
+        exported = 0
+        temp_csv = dest_csv + ".tmp"
+        with BufferedCsvWriter(temp_csv, mode="w", flush_every=0) as csv_writer:
+            if table == "phrases":
+                csv_writer.writerow(attributes_order_voice_responses)
+            for card_name, data in self.read(table, run_id):
+                if table == "phrases":
+                    csv_writer.writerow(convert_csv_voice_responses_row(data))
+                else:
+                    csv_writer.writerow(convert_csv_row(data))
+                exported += 1
+        os.replace(temp_csv, dest_csv)
+        return exported
+
+    @staticmethod
+    def __check_table(table: str):
+        if table not in tables:
+            raise ValueError("Unknown table {}, expected one of {}".format(table, ", ".join(tables)))
@@ -0,0 +1,182 @@
+"""
+run_journal.py
+~~~
+Durable journal of a scraping run, kept in the pipeline store database. Every card of the input csv file is recorded
+with its state (pending, running, done, or failed), the number of attempts, the last error, and where its output was
+written. A card is marked done in the same transaction its scraped record is stored in, so after a crash a resumed run
+knows exactly which cards are finished, without setting start_index by hand.
+"""
+
+import json
+import time
+from typing import Iterable, List, Tuple
+
+from scripts.pipeline_store import PipelineStore
+
+# The states of a card in the journal
+pending = "pending"
+running = "running"
+done = "done"
+failed = "failed"
+
+journal_schema = """
+CREATE TABLE IF NOT EXISTS scrape_runs (
+    run_id TEXT PRIMARY KEY,
+    input_csv TEXT NOT NULL,
+    start_index INTEGER NOT NULL,
+    dest_csv TEXT,
+    created_at REAL NOT NULL,
+    shard TEXT
+);
+CREATE TABLE IF NOT EXISTS scrape_journal (
+    run_id TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    card_name TEXT NOT NULL,
+    input_row TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    output TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (run_id, row_index)
+);
+CREATE INDEX IF NOT EXISTS scrape_journal_status ON scrape_journal (run_id, status);
+"""
+
+
+class RunJournal:
+    """
+    The journal of the scraping runs stored in a PipelineStore.
+    """
+
+    def __init__(self, store: PipelineStore):
+        """
+        Args:
+            store (PipelineStore): The pipeline store holding the journal tables. They are created if needed.
+        """
+        self.store = store
+        self.connection = store.connection
+        self.connection.executescript(journal_schema)
+        # journals created before runs recorded their shard
+        columns = [column[1] for column in self.connection.execute("PRAGMA table_info(scrape_runs)")]
+        if "shard" not in columns:
+            self.connection.execute("ALTER TABLE scrape_runs ADD COLUMN shard TEXT")
+
+    def start_run(self, run_id: str, input_csv: str, start_index: int, dest_csv: str,
+                  rows: Iterable[Tuple[int, List[str]]], shard: Tuple[int, int] = None) -> int:
+        """
+        Records a new run and all of its cards as pending. Starting a run id that already exists with the same input
+        csv file and shard keeps the recorded state of its cards, with another one raises a ValueError.
+
+        Args:
+            run_id (str): The run id.
+            input_csv (str): The path to the input csv file.
+            start_index (int): The row index the run starts from.
+            dest_csv (str): The csv file the scraped data is exported to. None for no export.
+            rows (Iterable[Tuple[int, List[str]]]): The row index and row of every card in the input csv file.
+            shard (Tuple[int, int]): The shard of the cards, None if the run has every card.
+        Returns:
+            int: The number of cards in the run.
+        """
+        now = time.time()
+        shard_name = "{}/{}".format(*shard) if shard else None
+        with self.store.transaction():
+            existing = self.connection.execute("SELECT input_csv, shard FROM scrape_runs WHERE run_id = ?",
+                                               (run_id,)).fetchone()
+            if existing is not None and tuple(existing) != (input_csv, shard_name):
+                raise ValueError("Run {} already exists for {} (shard {}), not {} (shard {})"
+                                 .format(run_id, existing[0], existing[1] or "all", input_csv, shard_name or "all"))
+            self.connection.execute("INSERT OR IGNORE INTO scrape_runs (run_id, input_csv, start_index, dest_csv, "
+                                    "created_at, shard) VALUES (?, ?, ?, ?, ?, ?)",
+                                    (run_id, input_csv, start_index, dest_csv, now, shard_name))
+            self.connection.executemany("INSERT OR IGNORE INTO scrape_journal (run_id, row_index, card_name, "
+                                        "input_row, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                        ((run_id, row_index, row[0].strip(), json.dumps(row), pending, now)
+                                         for row_index, row in rows))
+        return self.connection.execute("SELECT COUNT(*) FROM scrape_journal WHERE run_id = ?", (run_id,)).fetchone()[0]
+
+    def run(self, run_id: str = None) -> dict:
+        """
+        Returns the settings of a run. (input_csv, start_index, dest_csv)
+
+        Args:
+            run_id (str): The run id. Defaults to the latest run.
+        Returns:
+            dict: The run, or None if there is no such run.
+        """
+        query = "SELECT run_id, input_csv, start_index, dest_csv FROM scrape_runs"
+        if run_id is None:
+            row = self.connection.execute(query + " ORDER BY created_at DESC LIMIT 1").fetchone()
+        else:
+            row = self.connection.execute(query + " WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        return {"run_id": row[0], "input_csv": row[1], "start_index": row[2], "dest_csv": row[3]}
+
+    def cards_to_scrape(self, run_id: str, max_attempts: int) -> List[Tuple[int, List[str]]]:
+        """
+        Returns the cards of a run that are not done and have attempts left, in input order. Cards left running by
+        a crash are scraped again, and count the crashed attempt.
+
+        Args:
+            run_id (str): The run id.
+            max_attempts (int): The maximum number of attempts per card.
+        Returns:
+            List[Tuple[int, List[str]]]: The row index and input row of every card.
+        """
+        query = ("SELECT row_index, input_row FROM scrape_journal WHERE run_id = ? AND status != ? AND attempts < ? "
+                 "ORDER BY row_index")
+        return [(row_index, json.loads(input_row))
+                for row_index, input_row in self.connection.execute(query, (run_id, done, max_attempts))]
+
+    def mark_running(self, run_id: str, row_index: int):
+        """
+        Marks a card as running and counts the attempt.
+        """
+        self.connection.execute("UPDATE scrape_journal SET status = ?, attempts = attempts + 1, updated_at = ? "
+                                "WHERE run_id = ? AND row_index = ?", (running, time.time(), run_id, row_index))
+
+    def mark_done(self, run_id: str, row_index: int, output: str):
+        """
+        Marks a card as done. Call inside the store transaction that writes the card's output, so both are committed
+        together.
+
+        Args:
+            run_id (str): The run id.
+            row_index (int): The row index of the card.
+            output (str): Where the output was written. (ie. "raw_scrapes")
+        """
+        self.connection.execute("UPDATE scrape_journal SET status = ?, error = NULL, output = ?, updated_at = ? "
+                                "WHERE run_id = ? AND row_index = ?", (done, output, time.time(), run_id, row_index))
+
+    def mark_failed(self, run_id: str, row_index: int, error: str):
+        """
+        Marks a card as failed with the error that stopped it.
+        """
+        self.connection.execute("UPDATE scrape_journal SET status = ?, error = ?, updated_at = ? "
+                                "WHERE run_id = ? AND row_index = ?", (failed, error, time.time(), run_id, row_index))
+
+    def summary(self, run_id: str) -> dict:
+        """
+        Returns the number of cards in each state.
+
+        Args:
+            run_id (str): The run id.
+        Returns:
+            dict: Mapping of state to number of cards.
+        """
+        query = "SELECT status, COUNT(*) FROM scrape_journal WHERE run_id = ? GROUP BY status"
+        return dict(self.connection.execute(query, (run_id,)).fetchall())
+
+    def failures(self, run_id: str) -> List[Tuple[str, int, str]]:
+        """
+        Returns the failed cards of a run.
+
+        Args:
+            run_id (str): The run id.
+        Returns:
+            List[Tuple[str, int, str]]: The card name, number of attempts, and last error of every failed card.
+        """
+        query = ("SELECT card_name, attempts, error FROM scrape_journal WHERE run_id = ? AND status = ? "
+                 "ORDER BY row_index")
+        return self.connection.execute(query, (run_id, failed)).fetchall()
@@ -4,9 +4,16 @@ run_scraping_script.py
 Script to start the scraping. Calls scrape_card in scrape_card.py on each credit card. Writes the dictionary returned
 back into a csv file, which will be emailed to the Starbutter business team.
 """
+from instrumentation import timing
+from scrape_to_dict.deadline import card_budget
 from scrape_to_dict.scrape_card import run_scraper
-from scripts.convert_csv import convert_csv
-import csv
+from scripts.change_detection import ChangeDetector
+from scripts.convert_csv import convert_csv, convert_csv_row, f2
+from scripts.csv_stream import read_csv_rows, BufferedCsvWriter
+from scripts.pipeline_store import PipelineStore, new_run_id
+from scripts.run_journal import RunJournal
+from scripts.sharding import scrape_key, select_shard
+from typing import List, Tuple
 import os
 
 # The source csv file where we get the links to TOC, offer, and agg for each regular credit cards. (Regular as in the
@@ -30,29 +37,148 @@ def single_scrape(card_name: str, toc_link: str, offer_link, agg_link, toc_type:
     convert_csv(answer_dict)
 
 
-def mass_scrape(input_csv: str, start_index: int = 0):
+def mass_scrape(input_csv: str, start_index: int = 0, dest_csv: str = None, flush_every: int = 1,
+                store: PipelineStore = None, run_id: str = None, max_attempts: int = 3, shard: Tuple[int, int] = None,
+                budget: float = card_budget, changes: ChangeDetector = None):
     """
     Mass scrapes a csv file containing credit cards and links. Afterwards, writes to a new csv file.
 
+    If a store is given, the run is journaled (see run_journal.py): every scraped card is upserted into the
+    raw_scrapes table and marked done in the same transaction. A card that raises an error, whose terms and
+    conditions could not be scraped (scraper is "FALSE"), or whose pages timed out is marked failed instead, and is
+    scraped again by resume_scrape until it has been attempted max_attempts times. If dest_csv is given, it is then
+    replaced with the cards of the run exported from the store, rather than appended to card by card, so it should
+    not be a file holding other runs (like credit_card_raw_scraped.csv). An interrupted run is continued with
+    resume_scrape.
+
     Args:
         input_csv (str): The path to the csv file.
         start_index (int): The integer row index to start from in csv_file.
+        dest_csv (str): The csv file the scraped data is appended to. Defaults to credit_card_raw_scraped.csv. With
+                        a store, the csv file replaced by the export of the run, None to only write to the store.
+        flush_every (int): The number of scraped cards buffered before they are flushed to dest_csv. Scraping is
+                           slow, so by default every card is flushed as soon as it is scraped.
+        store (PipelineStore): If given, the run is journaled and the scraped cards are stored in the raw_scrapes
+                               table.
+        run_id (str): The run id of the scraped records in the store. Defaults to a new run id.
+        max_attempts (int): The number of times a failing card is attempted, across resumes, when journaled.
+        shard (Tuple[int, int]): Only scrape the cards of this shard, grouped by host. (see sharding.scrape_key)
+        budget (float): The number of seconds a card may spend fetching its pages. None for no limit.
+        changes (ChangeDetector): If given, cards whose pages are unchanged since the previous run reuse their
+                                  previous extraction. (see change_detection.py)
+    Returns:
+        str: The run id, if a store is given.
+    """
+    if store is not None:
+        if run_id is None:
+            run_id = new_run_id()
+        journal = RunJournal(store)
+        rows = ((row_index, row) for row_index, row in enumerate(read_csv_rows(input_csv, start_index), start_index)
+                if row)
+        rows = select_shard(rows, shard, key=lambda indexed_row: scrape_key(indexed_row[1]))
+        total = journal.start_run(run_id, input_csv, start_index, dest_csv, rows, shard)
+        print("Started run {} with {} cards.".format(run_id, total))
+        return __scrape_journaled(store, journal, run_id, dest_csv, max_attempts, budget, changes)
+
+    with BufferedCsvWriter(dest_csv or f2, flush_every=flush_every) as csv_writer:
+        # First row are the attribute titles
+        for row in select_shard(read_csv_rows(input_csv, start_index), shard, key=scrape_key):
+            with timing.card(row[0]):
+                answer_dict = __scrape_row(row, budget, changes)
+                csv_writer.writerow(convert_csv_row(answer_dict))
+
+
+def resume_scrape(run_id: str = None, store: PipelineStore = None, max_attempts: int = 3,
+                  budget: float = card_budget, changes: ChangeDetector = None) -> str:
+    """
+    Resumes a journaled mass_scrape run after a crash or a stop. Finished cards are skipped, and failed or
+    interrupted cards are scraped again until they have been attempted max_attempts times.
+
+    Args:
+        run_id (str): The run id. Defaults to the latest run.
+        store (PipelineStore): The pipeline store of the run. Defaults to PipelineStore().
+        max_attempts (int): The number of times a failing card is attempted, across resumes.
+        budget (float): The number of seconds a card may spend fetching its pages. None for no limit.
+        changes (ChangeDetector): If given, unchanged cards reuse their previous extraction.
+    Returns:
+        str: The run id.
+    """
+    if store is None:
+        store = PipelineStore()
+    journal = RunJournal(store)
+    run = journal.run(run_id)
+    if run is None:
+        raise ValueError("No scraping run {} in {}".format(run_id or "to resume", store.path))
+
+    print("Resuming run {}: {}".format(run["run_id"], journal.summary(run["run_id"])))
+    return __scrape_journaled(store, journal, run["run_id"], run["dest_csv"], max_attempts, budget, changes)
+
+
+def __scrape_row(row: List[str], budget: float = card_budget, changes: ChangeDetector = None) -> dict:
+    """
+    Scrapes the card of a row of the input csv file. (card_name, offer_link, toc_link, agg_link, toc_type)
     """
-    with open(input_csv, newline='') as csv_file:
-        csv_reader = list(csv.reader(csv_file))
-        for row in csv_reader[start_index:]:  # First row are the attribute titles
-            full_card_name = row[0]
-            toc_link = row[2]
-            offer_link = row[1]
-            agg_link = row[3]
-            toc_type = row[4]
-            print("Starting scraping on " + full_card_name)
-            answer_dict = run_scraper(full_card_name, toc_link, offer_link, agg_link, toc_type)
-            convert_csv(answer_dict)
-
-
-# Mass scrape
-mass_scrape(input_csv=source_csv_all, start_index=1)
+    full_card_name = row[0]
+    toc_link = row[2]
+    offer_link = row[1]
+    agg_link = row[3]
+    toc_type = row[4]
+    print("Starting scraping on " + full_card_name)
+    return run_scraper(full_card_name, toc_link, offer_link, agg_link, toc_type, budget, changes)
+
+
+def __scrape_journaled(store: PipelineStore, journal: RunJournal, run_id: str, dest_csv: str,
+                       max_attempts: int, budget: float = card_budget, changes: ChangeDetector = None) -> str:
+    """
+    Scrapes the cards of a journaled run that are not done yet, then exports the run to dest_csv.
+    """
+    for row_index, row in journal.cards_to_scrape(run_id, max_attempts):
+        journal.mark_running(run_id, row_index)
+        with timing.card(row[0]):
+            try:
+                answer_dict = __scrape_row(row, budget, changes)
+            except Exception as e:
+                print("Error scraping {}: {!r}".format(row[0], e))
+                journal.mark_failed(run_id, row_index, repr(e))
+                continue
+
+            # run_scraper catches fetch and parse errors itself, and reports them in the scraped record
+            error = __scrape_error(answer_dict)
+            with store.transaction():
+                # a failed card keeps its partial record, replaced if a later attempt works
+                store.upsert("raw_scrapes", run_id, row[0].strip(), answer_dict)
+                if error is None:
+                    journal.mark_done(run_id, row_index, "raw_scrapes")
+                else:
+                    print("Failed scraping {}: {}".format(row[0], error))
+                    journal.mark_failed(run_id, row_index, error)
+
+    summary = journal.summary(run_id)
+    print("Run {}: {}".format(run_id, summary))
+    for card_name, attempts, error in journal.failures(run_id):
+        print("Failed after {} attempts: {} ({})".format(attempts, card_name, error))
+
+    if dest_csv:
+        store.export_csv("raw_scrapes", dest_csv, run_id)
+    return run_id
+
+
+def __scrape_error(answer_dict: dict) -> str:
+    """
+    Returns why the scraped record of a card counts as failed, or None if it worked: the terms and conditions could
+    not be scraped, or a page ran out of time.
+    """
+    errors = []
+    if answer_dict.get("scraper") == "FALSE":
+        errors.append("terms and conditions could not be scraped")
+    if answer_dict.get("timed_out"):
+        errors.append("timed out: " + answer_dict["timed_out"])
+    return "; ".join(errors) or None
+
+
+# Mass scrape. (see cli.py for the command line options)
+if __name__ == "__main__":
+    mass_scrape(input_csv=source_csv_all, start_index=1)
 
 # Single scrape
 test_card = "Journey Student Credit Card from Capital One"
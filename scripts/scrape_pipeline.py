@@ -0,0 +1,140 @@
+"""
+scrape_pipeline.py
+~~~
+Scrapes and processes a csv file of credit cards in one go, as a staged pipeline (see pipeline_runtime.py):
+
+    fetch    ----> visible text of the TOC and agg pages (network bound, many workers)
+    extract  ----> scraped sentences of every attribute, from the fetched text (see scrape_card.parse_card)
+    clean    ----> values and numbers of every attribute (see term_processing_script.process_scraped_dict)
+    write    ----> credit_card_raw_scraped.csv, credit_card_raw_processed.csv, and optionally the pipeline store
+
+The stages are connected by bounded queues, so the pages of the next cards are fetched while the previous cards are
+extracted and cleaned. The output is written in the order of the input csv file, and is the same as running
+mass_scrape followed by term_process.
+"""
+
+import os
+from contextlib import ExitStack
+from typing import List, Tuple
+
+from instrumentation import timing
+from scrape_to_dict.deadline import card_budget
+from scrape_to_dict.scrape_card import fetch_card, parse_card
+from scripts.change_detection import ChangeDetector
+from scripts.convert_csv import convert_csv_row, f2
+from scripts.csv_stream import read_csv_rows, BufferedCsvWriter
+from scripts.pipeline_runtime import Stage, StagedPipeline, PipelineStats
+from scripts.pipeline_store import PipelineStore, new_run_id
+from scripts.sharding import scrape_key, select_shard
+from scripts.term_processing_script import process_scraped_dict
+
+current_directory = os.path.dirname(os.path.realpath(__file__))
+processed_csv = os.path.join(current_directory, "csv_files/credit_card_raw_processed.csv")
+
+
+def fetch_stage(row: List[str], budget: float = card_budget) -> dict:
+    """
+    Fetches the pages of a row of the input csv file. (card_name, offer_link, toc_link, agg_link, toc_type)
+    """
+    card = {"full_card_name": row[0], "offer_link": row[1], "toc_link": row[2], "agg_link": row[3],
+            "toc_type": row[4], "timing": timing.start_card(row[0].strip())}
+    print("Starting scraping on " + card["full_card_name"])
+    with timing.recording(card["timing"]):
+        card["fetched"] = fetch_card(card["toc_link"], card["agg_link"], card["toc_type"], budget,
+                                     card["full_card_name"])
+    return card
+
+
+def extract_stage(card: dict, changes: ChangeDetector = None) -> dict:
+    """
+    Scrapes the attributes of a card from its fetched pages. With changes, unchanged pages reuse their previous
+    extraction.
+    """
+    with timing.recording(card["timing"]):
+        if changes is not None:
+            card["scraped"] = changes.extract(card["full_card_name"], card["toc_link"], card["offer_link"],
+                                              card["agg_link"], card.pop("fetched"))
+        else:
+            card["scraped"] = parse_card(card["full_card_name"], card["toc_link"], card["offer_link"],
+                                         card["agg_link"], card.pop("fetched"))
+    return card
+
+
+def clean_stage(card: dict, changes: ChangeDetector = None) -> dict:
+    """
+    Extracts the values and numbers of the scraped attributes of a card. With changes, a card whose extraction was
+    reused also reuses its previous processed result.
+    """
+    with timing.recording(card["timing"]):
+        card["processed"] = changes.previous_processed(card["full_card_name"]) if changes is not None else None
+        if card["processed"] is None:
+            card["processed"] = process_scraped_dict(card["scraped"])
+            if changes is not None:
+                changes.record_processed(card["full_card_name"], card["processed"])
+    return card
+
+
+def run_pipeline(input_csv: str, start_index: int = 1, raw_csv: str = f2, dest_csv: str = processed_csv,
+                 fetch_workers: int = 8, extract_workers: int = 2, clean_workers: int = 2, queue_size: int = 16,
+                 store: PipelineStore = None, run_id: str = None, flush_every: int = 1,
+                 shard: Tuple[int, int] = None, budget: float = card_budget,
+                 changes: ChangeDetector = None) -> PipelineStats:
+    """
+    Scrapes and processes every card of a csv file containing credit cards and links, and prints the metrics of
+    every stage.
+
+    Args:
+        input_csv (str): The path to the csv file. (see mass_scrape)
+        start_index (int): The integer row index to start from in input_csv.
+        raw_csv (str): The csv file the scraped data is appended to. None to skip.
+        dest_csv (str): The csv file the processed data is appended to. None to skip.
+        fetch_workers (int): The number of cards fetched at the same time.
+        extract_workers (int): The number of workers scraping the fetched pages.
+        clean_workers (int): The number of workers extracting values and numbers.
+        queue_size (int): The maximum number of cards waiting between two stages.
+        store (PipelineStore): If given, the scraped and processed cards are also upserted into the store.
+        run_id (str): The run id of the records in the store. Defaults to a new run id.
+        flush_every (int): The number of cards buffered before they are flushed to the csv files.
+        shard (Tuple[int, int]): Only run the cards of this shard, grouped by host. (see sharding.scrape_key)
+        budget (float): The number of seconds a card may spend fetching its pages. None for no limit.
+        changes (ChangeDetector): If given, cards whose pages are unchanged since the previous run skip extraction
+                                  and term processing. (see change_detection.py)
+    Returns:
+        PipelineStats: The metrics of the run.
+    """
+    if store is not None and run_id is None:
+        run_id = new_run_id()
+
+    with ExitStack() as stack:
+        raw_writer = None
+        processed_writer = None
+        if raw_csv:
+            raw_writer = stack.enter_context(BufferedCsvWriter(raw_csv, flush_every=flush_every))
+        if dest_csv:
+            processed_writer = stack.enter_context(BufferedCsvWriter(dest_csv, flush_every=flush_every))
+
+        def write_stage(card: dict):
+            with timing.recording(card["timing"]):
+                if raw_writer is not None:
+                    raw_writer.writerow(convert_csv_row(card["scraped"]))
+                if processed_writer is not None:
+                    processed_writer.writerow(convert_csv_row(card["processed"]))
+                if store is not None:
+                    with store.transaction():
+                        store.upsert("raw_scrapes", run_id, card["full_card_name"].strip(), card["scraped"])
+                        store.upsert("processed_terms", run_id, card["full_card_name"].strip(), card["processed"])
+            timing.finish_card(card["timing"])
+
+        pipeline = StagedPipeline([
+            Stage("fetch", lambda row: fetch_stage(row, budget), workers=fetch_workers, queue_size=queue_size),
+            Stage("extract", lambda card: extract_stage(card, changes), workers=extract_workers, queue_size=queue_size),
+            Stage("clean", lambda card: clean_stage(card, changes), workers=clean_workers, queue_size=queue_size),
+            # a single writer keeps the output in input order, and the store connection in one thread
+            Stage("write", write_stage, queue_size=queue_size, ordered=True),
+        ])
+        rows = (row for row in read_csv_rows(input_csv, start_index) if row)
+        rows = select_shard(rows, shard, key=scrape_key)
+        stats = pipeline.run(rows)
+
+    print(stats.report())
+    return stats
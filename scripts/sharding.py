@@ -0,0 +1,150 @@
+"""
+sharding.py
+~~~
+Splits the cards of a job into shards, so a long job can be run as several independent processes or machines. A
+card always lands in the same shard for a given shard count, because the shard is picked from a stable hash of the
+card's key (not python's hash, which changes between processes).
+
+Scraping shards group the cards by the domain of their terms-and-conditions page (see scrape_key), so every issuer
+site is only scraped from one machine and its politeness limits still hold when the shards run from several IPs. The
+outputs of the shards are combined with merge_shards:
+
+    python -m scripts.cli scrape --shard 1/3 --output shard_1.csv      (on each machine)
+    python -m scripts.cli merge --inputs shard_1.csv shard_2.csv shard_3.csv --order cards.csv --output merged.csv
+"""
+
+import hashlib
+import os
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from scrape_to_dict.selector_preferences import host_of
+from scripts.csv_stream import BufferedCsvWriter, read_csv_rows
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    Parses a shard selection written as "N/M", the Nth of M shards, counting from 1.
+
+    Args:
+        shard (str): The shard selection. (ie. "2/4")
+    Returns:
+        Tuple[int, int]: The shard number and the shard count.
+    """
+    try:
+        number, count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError("Invalid shard {}, expected N/M (ie. 2/4)".format(shard))
+    if count < 1 or not 1 <= number <= count:
+        raise ValueError("Invalid shard {}, N must be between 1 and M".format(shard))
+    return number, count
+
+
+def shard_of(key: str, shard_count: int) -> int:
+    """
+    Returns the shard a key belongs to, counting from 1.
+
+    Args:
+        key (str): The key. (ie. the card name)
+        shard_count (int): The number of shards.
+    Returns:
+        int: The shard number.
+    """
+    digest = hashlib.md5(key.strip().lower().encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count + 1
+
+
+def select_shard(items: Iterable, shard: Tuple[int, int], key: Callable) -> Iterator:
+    """
+    Yields the items that belong to a shard.
+
+    Args:
+        items (Iterable): The items. (ie. the rows of the input csv file)
+        shard (Tuple[int, int]): The shard number and shard count. (see parse_shard) None to yield every item.
+        key (Callable): Returns the key of an item.
+    Returns:
+        Iterator: The items of the shard.
+    """
+    if shard is None:
+        yield from items
+        return
+
+    number, count = shard
+    for item in items:
+        if shard_of(key(item), count) == number:
+            yield item
+
+
+def scrape_key(row: List[str]) -> str:
+    """
+    Returns the shard key of a row of the input csv file when scraping: the registrable domain of the
+    terms-and-conditions link, so the cards of an issuer stay together even when they are on several of its hosts
+    (ie. www.americanexpress.com and www262.americanexpress.com). A row without a link falls back to the card name.
+    The NerdWallet pages all share one host, so it is still visited by every shard.
+
+    Args:
+        row (List[str]): The row. (card_name, offer_link, toc_link, agg_link, toc_type)
+    Returns:
+        str: The shard key.
+    """
+    toc_link = row[2].strip() if len(row) > 2 else ""
+    return registrable_domain(host_of(toc_link)) or row[0]
+
+
+def registrable_domain(host: str) -> str:
+    """
+    Returns the last two labels of a host, without its port. ("www262.americanexpress.com:443" ->
+    "americanexpress.com") An ip address is returned whole. Hosts under a two label suffix (ie. co.uk) are grouped
+    by the suffix, which puts more cards in one shard but never splits an issuer.
+    """
+    if host.startswith("["):
+        return host.split("]")[0] + "]"
+    host = host.rsplit(":", 1)[0]
+    if not host or host.replace(".", "").isdigit():
+        return host
+    return ".".join(host.rstrip(".").split(".")[-2:])
+
+
+def merge_shards(shard_csvs: List[str], dest_csv: str, order_csv: str = None) -> int:
+    """
+    Combines the scraped csv files of several shards into one. A card found more than once (ie. a shard that was run
+    again) is kept once, from the last file it is found in. The result doesn't depend on how the shards were split,
+    so merging is deterministic: the cards are in the order of order_csv, and otherwise sorted by name.
+
+    Args:
+        shard_csvs (List[str]): The csv files written by the shards, in increasing priority.
+        dest_csv (str): The merged csv file. Replaced atomically if it exists.
+        order_csv (str): The input csv file the shards were scraped from. Cards missing from it come last, by name.
+    Returns:
+        int: The number of cards in the merged file.
+    """
+    cards = dict()
+    duplicates = 0
+    for shard_csv in shard_csvs:
+        for row in read_csv_rows(shard_csv):
+            # skip blank lines and attribute titles
+            if not row or not row[0].strip() or row[0] == "full_card_name":
+                continue
+            key = __card_key(row[0])
+            if key in cards:
+                duplicates += 1
+            cards[key] = row
+
+    order = dict()
+    if order_csv is not None:
+        for row_index, row in enumerate(read_csv_rows(order_csv, 1)):
+            if row:
+                order.setdefault(__card_key(row[0]), row_index)
+
+    temp_csv = dest_csv + ".tmp"
+    with BufferedCsvWriter(temp_csv, mode="w", flush_every=0) as csv_writer:
+        for key in sorted(cards, key=lambda card_key: (order.get(card_key, len(order)), card_key)):
+            csv_writer.writerow(cards[key])
+    os.replace(temp_csv, dest_csv)
+
+    print("Merged {} cards from {} shard files into {} ({} duplicates dropped).".format(
+        len(cards), len(shard_csvs), dest_csv, duplicates))
+    return len(cards)
+
+
+def __card_key(card_name: str) -> str:
+    return card_name.strip().lower()
@@ -4,16 +4,36 @@ term_processing_script.py
 Takes in a csv file and extracts numerical values for most attributes of a credit card.
 """
 
-import csv
+import os
+from collections import OrderedDict
+from instrumentation import timing
 from scrape_to_dict.card_schema import card_dict
 from term_processor import clean_up_terms, second_clean
-from scripts.convert_csv import convert_csv
+from term_processor import term_cache
+from scripts.convert_csv import attributes_order, convert_csv_row, csv_row_to_dict
+from scripts.csv_stream import read_csv_rows, BufferedCsvWriter
+from scripts.columnar_export import export_processed_csv
+from scripts.fingerprint_manifest import FingerprintManifest, fingerprint
+from scripts.pipeline_store import PipelineStore
 
-from typing import List
+from scripts.sharding import select_shard
+
+from typing import List, Tuple
 import copy
 
+current_directory = os.path.dirname(os.path.realpath(__file__))
+
 # source_csv = "csv_filescredit_card_raw_scraped - credit_card_raw_all.csv"
-source_csv = "csv_files/credit_card_raw_scraped.csv"
+source_csv = os.path.join(current_directory, "csv_files/credit_card_raw_scraped.csv")
+dest_csv_processed = os.path.join(current_directory, "csv_files/credit_card_raw_processed.csv")
+
+# The manifest of row fingerprints used by incremental term processing
+manifest_json = os.path.join(current_directory, "csv_files/credit_card_raw_processed_manifest.json")
+
+
+# The attributes copied from the scraped data, in the order of the scraped csv files. Attributes with a term only copy
+# the term, the rest is extracted again.
+scraped_attributes = attributes_order
 
 
 def __store_attribute_string_to_dict(attribute_list: List[str]) -> dict:
@@ -25,6 +45,18 @@ def __store_attribute_string_to_dict(attribute_list: List[str]) -> dict:
     Returns:
         dict: The dictionary (card_dict from card_schema) of attributes and its corresponding string and value.
     """
+    return __store_scraped_dict(csv_row_to_dict(attribute_list))
+
+
+def __store_scraped_dict(scraped_dict: dict) -> dict:
+    """
+    Takes the scraped attributes of a card, keyed by attribute name, and stores them in a fresh card dictionary.
+
+    Args:
+        scraped_dict (dict): The scraped attributes. (ie. a record of the raw_scrapes table)
+    Returns:
+        dict: The dictionary (card_dict from card_schema) of attributes and its corresponding string and value.
+    """
     answer_dict = copy.deepcopy(card_dict)
     if "tips_apr" in answer_dict.keys():
         del(answer_dict["tips_apr"])
@@ -33,65 +65,178 @@ def __store_attribute_string_to_dict(attribute_list: List[str]) -> dict:
     if "plan_fee" in answer_dict.keys():
         del (answer_dict["plan_fee"])
 
-    answer_dict["full_card_name"] = attribute_list[0].strip()
-    answer_dict["short_card_name"] = attribute_list[1].strip()
-    answer_dict["trademark_card_name"] = attribute_list[2].strip()
-    answer_dict["category"] = attribute_list[3].strip()
-    answer_dict["issuer"] = attribute_list[4].strip()
-    answer_dict["processor"] = attribute_list[5].strip()
-    answer_dict["toc_link"] = attribute_list[6].strip()
-    answer_dict["offer_link"] = attribute_list[7].strip()
-    answer_dict["agg_link"] = attribute_list[8].strip()
-    answer_dict["balance_transfer_apr"]["term"] = attribute_list[9].strip()
-    answer_dict["cash_advance_apr"]["term"] = attribute_list[12].strip()
-    answer_dict["penalty_apr"]["term"] = attribute_list[15].strip()
-    answer_dict["purchase_apr"]["term"] = attribute_list[18].strip()
-    answer_dict["paying_interest"]["term"] = attribute_list[21].strip()
-    answer_dict["minimum_interest_charge_apr"]["term"] = attribute_list[23].strip()
-    answer_dict["annual_fee"]["term"] = attribute_list[26].strip()
-    answer_dict["balance_transfer_fee"]["term"] = attribute_list[29].strip()
-    answer_dict["cash_advance_fee"]["term"] = attribute_list[32].strip()
-    answer_dict["foreign_transaction_fee"]["term"] = attribute_list[35].strip()
-    answer_dict["late_payment_fee"]["term"] = attribute_list[38].strip()
-    answer_dict["returned_payment_fee"]["term"] = attribute_list[41].strip()
-    answer_dict["returned_check_fee"]["term"] = attribute_list[44].strip()
-    answer_dict["over_limit_fee"]["term"] = attribute_list[47].strip()
-    answer_dict["pros"]["term"] = attribute_list[50].strip()
-    answer_dict["cons"]["term"] = attribute_list[52].strip()
-    answer_dict["credit_score"]["term"] = attribute_list[54].strip()
-    answer_dict["bonus_offer"]["term"] = attribute_list[58].strip()
-    answer_dict["offer_details"]["term"] = attribute_list[60].strip()
-    answer_dict["rewards_rate"]["term"] = attribute_list[62].strip()
-    answer_dict["intro_apr_check"]["term"] = attribute_list[64].strip()
-    answer_dict["variable_apr_check"]["term"] = attribute_list[66].strip()
-    answer_dict["annual_fee_check"]["term"] = attribute_list[68].strip()
+    for attribute in scraped_attributes:
+        data = scraped_dict.get(attribute)
+        if type(data) == dict:
+            data = data.get("term")
+        if data is None:
+            data = ""
+
+        if type(answer_dict[attribute]) == dict:
+            answer_dict[attribute]["term"] = data.strip()
+        else:
+            answer_dict[attribute] = data.strip()
 
     return answer_dict
 
 
-def term_process(dest_csv: str, starting_index: int):
+def __process_row(attribute_data: List[str]) -> dict:
+    """
+    Processes a single scraped row. Returns the dictionary of terms, values, and numbers.
+
+    Args:
+        attribute_data (List[str]): The list of attribute data about a card.
+    Returns:
+        dict: The processed dictionary.
+    """
+    print([str(i) + ' ' + str(j) for i, j in enumerate(attribute_data)])
+    return __process_dict(__store_attribute_string_to_dict(attribute_data))
+
+
+def __process_dict(attribute_dict: dict) -> dict:
+    """
+    Processes the card dictionary of a single card. Returns the dictionary of terms, values, and numbers.
+
+    Args:
+        attribute_dict (dict): The card dictionary. (see __store_scraped_dict)
+    Returns:
+        dict: The processed dictionary.
+    """
+    processed_dict = clean_up_terms.clean_up_terms(attribute_dict)
+    processed_dict = second_clean.second_clean(processed_dict)
+    print(processed_dict)
+    return processed_dict
+
+
+def process_scraped_dict(scraped_dict: dict) -> dict:
+    """
+    Processes the scraped attributes of a single card, keyed by attribute name. (ie. the dictionary returned by
+    run_scraper) Returns the dictionary of terms, values, and numbers.
+
+    Args:
+        scraped_dict (dict): The scraped attributes.
+    Returns:
+        dict: The processed dictionary.
+    """
+    with timing.card(scraped_dict.get("full_card_name", "")):
+        return __process_dict(__store_scraped_dict(scraped_dict))
+
+
+def term_process(dest_csv: str, starting_index: int, flush_every: int = 100, columnar_npy: str = None,
+                 source: str = source_csv, shard: Tuple[int, int] = None):
     """
-    Function to term process and extract numerical values from scraped data.
+    Function to term process and extract numerical values from scraped data. Rows are streamed from source_csv and
+    appended to dest_csv through a single buffered writer.
 
     Args:
         dest_csv (str): The destination csv file.
         starting_index (int): The starting index.
+        flush_every (int): The number of rows buffered before they are flushed to dest_csv.
+        columnar_npy (str): If given, the numbers in dest_csv are also exported to this typed .npy file.
+        source (str): The csv file with the scraped data. Defaults to source_csv.
+        shard (Tuple[int, int]): Only process the cards of this shard. (see sharding.parse_shard)
+    Returns:
+         str: Success
+    """
+    with BufferedCsvWriter(dest_csv, flush_every=flush_every) as csv_writer:
+        for row in select_shard(read_csv_rows(source, starting_index), shard, key=lambda row: row[0]):
+            with timing.card(row[0]):
+                processed_dict = __process_row(row)
+                csv_writer.writerow(convert_csv_row(processed_dict))
+
+    if columnar_npy:
+        export_processed_csv(dest_csv, columnar_npy)
+    term_cache.print_cache_stats()
+    return "Success"
+
+
+def term_process_incremental(dest_csv: str, starting_index: int, manifest_path: str = manifest_json,
+                             columnar_npy: str = None, source: str = source_csv):
+    """
+    Incremental version of term_process. Only rows whose raw terms changed since the last run (or that were
+    processed with another RULES_VERSION) are processed again. The processed rows are merged into the existing
+    dest_csv, replacing the previous row of the same card, and dest_csv is rewritten.
+
+    Args:
+        dest_csv (str): The destination csv file. Rows are matched by full card name (first column).
+        starting_index (int): The starting index.
+        manifest_path (str): The path to the json manifest of row fingerprints.
+        columnar_npy (str): If given, the numbers in dest_csv are also exported to this typed .npy file.
+        source (str): The csv file with the scraped data. Defaults to source_csv.
     Returns:
          str: Success
     """
-    with open(source_csv, 'r', newline='') as csv_f:
-        csv_reader = list(csv.reader(csv_f))
-        for row in csv_reader[starting_index:]:
-            attribute_data = list(row)
-            print([str(i) + ' ' + str(j) for i, j in enumerate(attribute_data)])
-            attribute_dict = __store_attribute_string_to_dict(attribute_data)
-            processed_dict = clean_up_terms.clean_up_terms(attribute_dict)
-            processed_dict = second_clean.second_clean(processed_dict)
-            print(processed_dict)
-            convert_csv(processed_dict, dest_csv)
+    manifest = FingerprintManifest(manifest_path, term_cache.RULES_VERSION)
+
+    # (1) Load the previously processed rows, keyed by full card name
+    processed_rows = OrderedDict()
+    if os.path.exists(dest_csv):
+        for row in read_csv_rows(dest_csv):
+            if row:
+                processed_rows[row[0]] = row
+
+    # (2) Process only the new or changed rows
+    changed = 0
+    unchanged = 0
+    for attribute_data in read_csv_rows(source, starting_index):
+        card_name = attribute_data[0].strip()
+        row_fingerprint = fingerprint(value.strip() for value in attribute_data)
+        if card_name in processed_rows and not manifest.is_changed(card_name, row_fingerprint):
+            unchanged += 1
+            continue
+
+        with timing.card(card_name):
+            processed_dict = __process_row(attribute_data)
+        processed_rows[card_name] = convert_csv_row(processed_dict)
+        manifest.update(card_name, row_fingerprint)
+        changed += 1
 
+    # (3) Write the merged output. Replaced atomically, then save the manifest so both stay consistent.
+    temp_csv = dest_csv + ".tmp"
+    with BufferedCsvWriter(temp_csv, mode="w", flush_every=0) as csv_writer:
+        csv_writer.writerows(processed_rows.values())
+    os.replace(temp_csv, dest_csv)
+    manifest.save()
+    if columnar_npy:
+        export_processed_csv(dest_csv, columnar_npy)
+
+    print("Processed {} new or changed rows, skipped {} unchanged rows.".format(changed, unchanged))
+    term_cache.print_cache_stats()
     return "Success"
 
 
-term_process("csv_files/credit_card_raw_processed.csv", 0)
+def term_process_store(store: PipelineStore, source_run_id: str = None, run_id: str = None,
+                       card_names: List[str] = None, dest_csv: str = None):
+    """
+    Version of term_process that reads the scraped records from the raw_scrapes table of the pipeline store, and
+    upserts the processed records into the processed_terms table. Rerunning it replaces the records of the run
+    instead of appending duplicates.
+
+    Args:
+        store (PipelineStore): The pipeline store.
+        source_run_id (str): The run id of the scraped records. Defaults to the latest scraping run.
+        run_id (str): The run id of the processed records. Defaults to source_run_id.
+        card_names (List[str]): Only process these cards. None to process every card of the run.
+        dest_csv (str): If given, the processed records of the run are also exported to this csv file.
+    Returns:
+         str: Success
+    """
+    if source_run_id is None:
+        source_run_id = store.latest_run_id("raw_scrapes")
+    if run_id is None:
+        run_id = source_run_id
+
+    processed = ((card_name, process_scraped_dict(scraped_dict))
+                 for card_name, scraped_dict in store.read("raw_scrapes", source_run_id, card_names))
+    written = store.upsert_many("processed_terms", run_id, processed)
+    print("Processed {} cards of run {}.".format(written, source_run_id))
+
+    if dest_csv:
+        store.export_csv("processed_terms", dest_csv, run_id)
+    term_cache.print_cache_stats()
+    return "Success"
+
 
+# the staged pipeline imports this module, so only process when it is run as a script. (see cli.py for the options)
+if __name__ == "__main__":
+    term_process(dest_csv_processed, 0)
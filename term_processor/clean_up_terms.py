@@ -4,6 +4,9 @@ import copy
 import re
 from typing import List
 
+from instrumentation.timing import timed
+from term_processor.term_cache import memoize_term
+
 # Attributes in which the extracted value is a percentage
 percent_attributes = [
     "purchase_apr",
@@ -58,6 +61,7 @@ nw_attributes = [
 ]
 
 
+@timed("clean.clean_up_terms")
 def clean_up_terms(card_dict: dict) -> dict:
     """
     Takes a card_dict and processes the terms for each attribute. Returns another dictionary with values stored along
@@ -104,6 +108,7 @@ def clean_up_terms(card_dict: dict) -> dict:
     return card_info
 
 
+@memoize_term
 def process_money_attribute(attribute: str, raw_term: str) -> str:
     """
     Extracts a monetary value.
@@ -146,6 +151,7 @@ def process_money_attribute(attribute: str, raw_term: str) -> str:
     return processed_val
 
 
+@memoize_term
 def process_percent_attribute(attribute: str, raw_term: str) -> str:
     """
     Extracts a percentage value.
@@ -365,6 +371,17 @@ def process_weird_fees(attribute: str, raw_term: str) -> str:
 
 # General Cleaning/Regex Helper Functions
 
+# Single regex that performs every spacing rule of simple_clean in one scan. It either matches a run of extra spaces,
+# or a character that needs a space after it:
+#   - lowercase letter concatenated with an uppercase letter, number, or $ ("aB", "a1", "a$")
+#   - period concatenated with an uppercase letter (".A")
+#   - comma, %, or number concatenated with a letter (",a", "%a", "1a")
+#   - colon concatenated with a word character (":a")
+# Only the first character is consumed, so every pair of adjacent characters is still checked.
+spacing_regex = re.compile(r"[a-z](?=[A-Z\d$])|\.(?=[A-Z])|[,%\d](?=[a-zA-Z])|:(?=\w)| {2,}")
+
+
+@memoize_term
 def simple_clean(term: str) -> str:
     """
     Function that takes in a raw_term and fixes basic formatting issues. Only used for process_other_agg.
@@ -374,60 +391,46 @@ def simple_clean(term: str) -> str:
     Returns:
          str: Fixed string.
     """
-    answer = term
-
     # (0) If term is blank, return
     if term == "" or term == " ":
         return ""
 
     # (1) Replace remaining newlines with spaces
-    answer = answer.replace("\n", " ")
-    answer = answer.replace("&nbsp;", "")
-
-    # (2) Add spaces after periods and commas
-    answer = re.sub(r"\.[A-Z]", add_space, answer)
-    answer = re.sub(r"\,[a-zA-Z]", add_space, answer)
-
-    # (3) Add spaces after lowercase letter concatenated with NOT (lowercase letter or space)
-    # essentially, add space between lowercase letter concatenated with uppercase letter, number, or special character
-    answer = re.sub(r"[a-z][A-Z]", add_space, answer)
-    answer = re.sub(r"[a-z]\d", add_space, answer)
-    answer = re.sub(r"[a-z]\$", add_space, answer)
-    answer = re.sub(r":\w", add_space, answer)
-    answer = re.sub(r"\d[a-zA-Z]", add_space, answer)
-    answer = re.sub(r"%[a-zA-Z]", add_space, answer)
-
-    # (4) Remove periods or asterisk at the end of answer
-    last_index = len(answer) - 1
-    last_char = answer[last_index]
-    if last_char == "." or last_char == "*":
-        answer = answer[:last_index]
+    answer = term.replace("\n", " ").replace("&nbsp;", "")
+
+    # (2) Add spaces after periods, commas, colons, and lowercase letters concatenated with NOT (lowercase letter or
+    # space), and remove extra spaces (see spacing_regex)
+    answer = spacing_regex.sub(fix_spacing, answer)
 
-    # (4) Remove extra spaces
-    answer = re.sub(r" +", " ", answer)
+    # (3) Remove periods or asterisk at the end of answer
+    last_char = answer[len(answer) - 1]
+    if last_char == "." or last_char == "*":
+        answer = answer[:len(answer) - 1]
 
-    # (5) Remove terms apply string
-    answer = re.sub("Terms Apply", "", answer)
-    answer = re.sub(r" introductory APR", "", answer)
+    # (4) Remove terms apply string
+    answer = answer.replace("Terms Apply", "").replace(" introductory APR", "")
 
-    # (6) If after processing answer is blank, return not found string
+    # (5) If after processing answer is blank, return not found string
     if answer == "" or answer.isspace():
         return ""
 
     return answer
 
 
-def add_space(matchobj) -> str:
+def fix_spacing(matchobj) -> str:
     """
-    Function called by re.sub to add a space where needed.
+    Function called by re.sub with spacing_regex. Adds a space after a matched character, or collapses a matched
+    run of spaces into a single space.
 
     Args:
         matchobj (re.Match): The Match object.
     Returns:
-        str: The string with space.
+        str: The replacement string.
     """
-    current_str = matchobj.group(0)
-    return current_str[:1] + " " + current_str[1:]
+    first_char = matchobj.group(0)[0]
+    if first_char == " ":
+        return " "
+    return first_char + " "
 
 
 # Helper functions for regex matching and returning
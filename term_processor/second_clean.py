@@ -9,6 +9,8 @@ import re
 import copy
 from typing import List
 
+from instrumentation.timing import timed
+
 # Attributes where both the monetary and percentage values exist and are used
 weird_fee_attributes = [
     "balance_transfer_fee",
@@ -57,6 +59,7 @@ excluded_attributes = [
 ]
 
 
+@timed("clean.second_clean")
 def second_clean(card_dict: dict) -> dict:
     """
     Performs a second round of numerical extraction. This time, we extract only a single numerical value for each
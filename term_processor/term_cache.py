@@ -0,0 +1,217 @@
+"""
+term_cache.py
+~~~
+Bounded LRU memo used in front of the term cleaning functions in clean_up_terms.py. Many raw terms are identical
+across cards from the same issuer ("Up to $40", "None", the same penalty APR paragraph...), so the cleaned value is
+cached by (function, attribute, raw_term) and repeated boilerplate costs only a dictionary lookup.
+
+All cached entries are tied to RULES_VERSION. Bump RULES_VERSION whenever the cleaning rules in clean_up_terms.py
+change, or call invalidate() to drop everything that was cached by an older version of the rules.
+"""
+
+import functools
+import threading
+from collections import OrderedDict
+
+from instrumentation import metrics
+
+# Version of the term cleaning rules. Bump this whenever the regexes in clean_up_terms.py change so that cached values
+# (and any fingerprint stored alongside processed output) are recomputed.
+RULES_VERSION = "1"
+
+# Default number of entries kept per memoized function
+DEFAULT_MAX_SIZE = 4096
+
+# Whether memoized functions use their cache. (see set_enabled)
+ENABLED = True
+
+
+class TermCache:
+    """
+    A bounded least-recently-used cache with hit/miss statistics. Entries are stored under the rules version they
+    were computed with, so changing the version makes every older entry unreachable.
+    """
+
+    def __init__(self, name: str, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        Args:
+            name (str): The name of the cache (usually the name of the memoized function).
+            max_size (int): The maximum number of entries before the least recently used entry is evicted.
+        """
+        self.name = name
+        self.max_size = max_size
+        self.rules_version = RULES_VERSION
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # the staged pipeline cleans cards on several threads, the compute itself runs outside the lock
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: tuple, compute):
+        """
+        Returns the cached value for key. If the key is not cached, calls compute() and stores the result.
+
+        Args:
+            key (tuple): The cache key. (ie. ("annual_fee", "Up to $40"))
+            compute (callable): Zero argument function that computes the value on a cache miss.
+        Returns:
+            The cached or freshly computed value.
+        """
+        if self.rules_version != RULES_VERSION:
+            self.invalidate(RULES_VERSION)
+
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+
+        # exceptions are not cached, clean_up_terms reports them per attribute
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, rules_version: str = None):
+        """
+        Drops every cached entry and resets the statistics.
+
+        Args:
+            rules_version (str): The rules version new entries are computed with. Defaults to the current version.
+        """
+        with self._lock:
+            self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rules_version = rules_version if rules_version is not None else RULES_VERSION
+
+    def stats(self) -> dict:
+        """
+        Returns the hit rate statistics of the cache.
+
+        Returns:
+            dict: The name, size, hits, misses, evictions, and hit rate of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "rules_version": self.rules_version,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Every cache created by memoize_term, so they can be inspected or invalidated together
+_caches = []
+
+
+def memoize_term(func=None, *, max_size: int = DEFAULT_MAX_SIZE):
+    """
+    Decorator that memoizes a term cleaning function. The arguments of the function (attribute name and raw term
+    string) are used as the cache key, so the function must be pure and its arguments hashable.
+
+    Args:
+        func (callable): The function to memoize.
+        max_size (int): The maximum number of cached entries for this function.
+    Returns:
+        callable: The memoized function. The underlying TermCache is available as the attribute cache.
+    """
+    def decorator(f):
+        cache = TermCache(f.__name__, max_size)
+        _caches.append(cache)
+
+        @functools.wraps(f)
+        def wrapper(*args):
+            if not ENABLED:
+                return f(*args)
+            return cache.get_or_compute(args, lambda: f(*args))
+
+        wrapper.cache = cache
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def set_rules_version(rules_version: str):
+    """
+    Changes the rules version and invalidates every term cache.
+
+    Args:
+        rules_version (str): The new rules version.
+    """
+    global RULES_VERSION
+    RULES_VERSION = rules_version
+    invalidate_all()
+
+
+def set_enabled(enabled: bool):
+    """
+    Turns every term cache on or off. While off, the memoized functions always call the underlying function. (ie. to
+    measure the uncached processing time)
+
+    Args:
+        enabled (bool): Whether the caches are used.
+    """
+    global ENABLED
+    ENABLED = enabled
+
+
+def invalidate_all():
+    """
+    Drops the entries of every term cache.
+    """
+    for cache in _caches:
+        cache.invalidate()
+
+
+def cache_stats() -> list:
+    """
+    Returns the statistics of every term cache.
+
+    Returns:
+        list: A list of statistic dictionaries. (see TermCache.stats)
+    """
+    return [cache.stats() for cache in _caches]
+
+
+def print_cache_stats():
+    """
+    Prints the hit rate of every term cache.
+    """
+    for stats in cache_stats():
+        print("{name}: {hits} hits, {misses} misses, {evictions} evictions, {size}/{max_size} entries, "
+              "{hit_rate:.1%} hit rate (rules version {rules_version})".format(**stats))
+
+
+def __cache_metrics() -> list:
+    """
+    Returns the statistics of every term cache as metrics. (see metrics.register_collector)
+    """
+    stats = cache_stats()
+    families = []
+    for statistic in ["hits", "misses", "evictions"]:
+        families.append(("term_cache_{}_total".format(statistic), "counter",
+                         "Term cache {} since the cache was last invalidated.".format(statistic),
+                         [("term_cache_{}_total".format(statistic), {"cache": cache["name"]}, cache[statistic])
+                          for cache in stats]))
+    families.append(("term_cache_hit_rate", "gauge", "Share of term cache lookups that were hits.",
+                     [("term_cache_hit_rate", {"cache": cache["name"]}, cache["hit_rate"]) for cache in stats]))
+    return families
+
+
+metrics.register_collector(__cache_metrics)